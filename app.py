@@ -13,13 +13,29 @@ import os
 import re
 import json
 import time
+import heapq
+import bisect
+import codecs
 import hashlib
-from dataclasses import dataclass
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache, wraps
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, BinaryIO, Callable, ContextManager, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
 
 import streamlit as st
 
+try:
+    import fcntl  # 프로세스 간 파일 잠금(POSIX)
+except ImportError:  # Windows: 같은 프로세스 안에서만 직렬화
+    fcntl = None  # type: ignore[assignment]
+
 
 # -----------------------------
 # 0) 앱 버전/해시 (실행 중 코드 확인용)
@@ -28,6 +44,13 @@ APP_VERSION = "PT-SOAP-FINAL-2026-02-05-v4"
 _THIS_FILE = os.path.abspath(__file__)
 
 
+# Streamlit은 rerun마다 이 파일을 처음부터 다시 실행함 → 이번 실행의 모듈 로드 시간 측정 시작점
+_MODULE_T0 = time.perf_counter()
+
+# 첫 화면(콜드 스타트) 허용 시간: 넘으면 사이드바에 경고
+STARTUP_BUDGET_SEC = float(os.getenv("SOAP_STARTUP_BUDGET_SEC", "3.0"))
+
+
 def _file_hash(path: str) -> str:
     try:
         with open(path, "rb") as f:
@@ -36,7 +59,236 @@ def _file_hash(path: str) -> str:
         return "unknownhash"
 
 
-APP_HASH = _file_hash(_THIS_FILE)
+@st.cache_data(show_spinner=False)
+def _file_hash_cached(path: str, mtime_ns: int) -> str:
+    return _file_hash(path)
+
+
+def app_hash() -> str:
+    """실행 중 코드 해시(처음 필요할 때 계산, 파일이 바뀔 때만 다시 읽음)."""
+    try:
+        mtime_ns = os.stat(_THIS_FILE).st_mtime_ns
+    except OSError:
+        return "unknownhash"
+    return _file_hash_cached(_THIS_FILE, mtime_ns)
+
+
+class StartupTimings:
+    """프로세스 시작 후 첫 실행(콜드 스타트)과 최근 실행의 모듈 로드/화면 그리기 시간(초)."""
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.runs = 0
+        self.first_module_sec: Optional[float] = None
+        self.first_render_sec: Optional[float] = None
+        self.last_module_sec: Optional[float] = None
+        self.last_render_sec: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, module_sec: float, render_sec: float) -> None:
+        with self._lock:
+            self.runs += 1
+            if self.first_render_sec is None:
+                self.first_module_sec = module_sec
+                self.first_render_sec = render_sec
+            self.last_module_sec = module_sec
+            self.last_render_sec = render_sec
+
+    @property
+    def first_total_sec(self) -> Optional[float]:
+        if self.first_render_sec is None or self.first_module_sec is None:
+            return None
+        return self.first_module_sec + self.first_render_sec
+
+
+@st.cache_resource(show_spinner=False)
+def _startup_timings() -> StartupTimings:
+    return StartupTimings()
+
+
+STARTUP = _startup_timings()
+
+
+# 실행 단계별 시간 측정(SOAP_PROFILE=1일 때만. 꺼져 있으면 측정 코드가 아무것도 하지 않음)
+PROFILE_ENABLED = os.getenv("SOAP_PROFILE", "0").strip().lower() in ("1", "true", "yes", "on")
+PROFILE_KEEP_RUNS = int(os.getenv("SOAP_PROFILE_RUNS", "200"))  # 메모리에 남기는 최근 실행 수
+# 기록 파일(data/ 아래): "jsonl" = 실행마다 1줄 추가 | "prom" = Prometheus 텍스트(요약, 매번 덮어씀) | "none"
+PROFILE_LOG = os.getenv("SOAP_PROFILE_LOG", "jsonl").strip().lower()
+PROFILE_LOG_MAX_BYTES = 5_000_000  # jsonl이 이보다 커지면 .1로 넘기고 새로 시작
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+_JSONL_LOCK = threading.Lock()
+
+
+def append_jsonl(path: str, rec: Dict[str, Any], max_bytes: int) -> None:
+    """기록 1줄 추가. 파일이 max_bytes를 넘으면 path.1로 넘기고 새로 시작(실패는 무시)."""
+    try:
+        ensure_data_dir()
+        line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+        with _JSONL_LOCK:
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > max_bytes:
+                os.replace(path, f"{path}.1")
+            with open(path, "ab") as f:
+                f.write(line)
+    except Exception:
+        pass
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+class RerunProfiler:
+    """rerun 1회 = 기록 1개 {"ts", "total", "phases": {단계: 초}}. 최근 keep개를 링 버퍼에 보관.
+
+    - 세션마다 스크립트 스레드가 다르므로 진행 중인 기록은 스레드별로 둠
+    - 같은 단계가 여러 번 불리면(예: build_prompt) 합산
+    - 실행 밖(배치/벤치마크)에서 불린 측정은 버림
+    """
+
+    def __init__(self, keep: int, log: str) -> None:
+        self.keep = keep
+        self.log = log
+        self._runs: "deque[Dict[str, Any]]" = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def begin(self) -> None:
+        self._local.phases = {}
+        self._local.t0 = time.perf_counter()
+
+    def add(self, name: str, sec: float) -> None:
+        phases = getattr(self._local, "phases", None)
+        if phases is not None:
+            phases[name] = phases.get(name, 0.0) + sec
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def end(self) -> None:
+        phases = getattr(self._local, "phases", None)
+        if phases is None:
+            return
+        rec = {"ts": round(time.time(), 3), "total": time.perf_counter() - self._local.t0, "phases": phases}
+        self._local.phases = None
+        with self._lock:
+            self._runs.append(rec)
+        self._write(rec)
+
+    def runs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._runs)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """단계별 [{"phase", "runs", "p50", "p95", "last"}](초), p95 큰 순."""
+        by_phase: Dict[str, List[float]] = {}
+        for rec in self.runs():
+            by_phase.setdefault("total", []).append(rec["total"])
+            for name, sec in rec["phases"].items():
+                by_phase.setdefault(name, []).append(sec)
+        out = []
+        for name, vals in by_phase.items():
+            s = sorted(vals)
+            out.append({"phase": name, "runs": len(s), "p50": _percentile(s, 0.5), "p95": _percentile(s, 0.95), "last": vals[-1]})
+        return sorted(out, key=lambda r: r["p95"], reverse=True)
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self.runs())
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP soap_rerun_phase_seconds Streamlit rerun phase duration over the last runs.",
+            "# TYPE soap_rerun_phase_seconds summary",
+        ]
+        sums: Dict[str, float] = {}
+        for rec in self.runs():
+            sums["total"] = sums.get("total", 0.0) + rec["total"]
+            for name, sec in rec["phases"].items():
+                sums[name] = sums.get(name, 0.0) + sec
+        for r in self.summary():
+            label = r["phase"].replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'soap_rerun_phase_seconds{{phase="{label}",quantile="0.5"}} {r["p50"]:.6f}')
+            lines.append(f'soap_rerun_phase_seconds{{phase="{label}",quantile="0.95"}} {r["p95"]:.6f}')
+            lines.append(f'soap_rerun_phase_seconds_sum{{phase="{label}"}} {sums[r["phase"]]:.6f}')
+            lines.append(f'soap_rerun_phase_seconds_count{{phase="{label}"}} {r["runs"]}')
+        return "\n".join(lines) + "\n"
+
+    def log_path(self) -> str:
+        return os.path.join(DATA_DIR, "profile.prom" if self.log == "prom" else "profile.jsonl")
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        if self.log == "jsonl":
+            append_jsonl(self.log_path(), rec, PROFILE_LOG_MAX_BYTES)
+        elif self.log == "prom":
+            try:
+                ensure_data_dir()
+                path = self.log_path()
+                tmp = f"{path}.tmp.{threading.get_ident()}"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(self.to_prometheus())
+                os.replace(tmp, path)
+            except Exception:
+                pass
+
+
+@st.cache_resource(show_spinner=False)
+def _rerun_profiler() -> RerunProfiler:
+    return RerunProfiler(PROFILE_KEEP_RUNS, PROFILE_LOG)
+
+
+PROFILER = _rerun_profiler()
+_NO_PHASE = nullcontext()
+
+
+def phase(name: str) -> ContextManager[None]:
+    """with phase("단계"): ... → 이번 rerun 기록에 시간 추가(측정이 꺼져 있으면 아무것도 안 함)."""
+    return PROFILER.phase(name) if PROFILE_ENABLED else _NO_PHASE
+
+
+def _no_lap(name: str) -> None:
+    pass
+
+
+def laps(prefix: str) -> Callable[[str], None]:
+    """긴 함수를 구간별로 측정: lap = laps("sidebar") 후 구간이 끝날 때마다 lap("구간") →
+    직전 lap(또는 시작)부터의 시간이 "sidebar/구간"으로 기록됨."""
+    if not PROFILE_ENABLED:
+        return _no_lap
+    last = [time.perf_counter()]
+
+    def lap(name: str) -> None:
+        now = time.perf_counter()
+        PROFILER.add(f"{prefix}/{name}", now - last[0])
+        last[0] = now
+
+    return lap
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """함수 전체를 한 단계로 측정. 측정이 꺼져 있으면 원래 함수를 그대로 돌려줌(추가 비용 0)."""
+
+    def deco(fn: F) -> F:
+        if not PROFILE_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PROFILER.add(name, time.perf_counter() - t0)
+
+        return wrapper  # type: ignore[return-value]
+
+    return deco
 
 
 # -----------------------------
@@ -79,27 +331,58 @@ REPLACE_MAP = {
 NOISE_PATTERN = re.compile(r"^(?:[ㄱ-ㅎ]{1,2}|[ㅏ-ㅣ]{1,2}|[가-힣]{1,2})$")
 
 
-def normalize_text(s: str) -> str:
-    """화면/저장/AI입력에 들어가기 전에 문구를 강제 정리."""
-    if not isinstance(s, str):
-        return s
+# 정규화 엔진(임포트 시 1회 컴파일)
+# - 치환/금칙 토큰 전체를 하나의 교대(alternation) 패턴으로 묶어 "해당 없음"을 한 번의 스캔으로 판정
+# - 해당이 있을 때만 기존과 동일한 순서로 적용(순차 적용 결과와 완전히 동일해야 하므로)
+# - 짧은 문자열(선택지/라벨/폼 값)은 결과를 캐시
+_REPLACE_ITEMS: Tuple[Tuple[str, str], ...] = tuple(REPLACE_MAP.items())
+_BANNED_SEP = r"[\s,/\|·\-]+"
+_BANNED_RES: Tuple[Tuple[str, "re.Pattern[str]"], ...] = tuple(
+    (tok, re.compile(rf"(^|{_BANNED_SEP}){re.escape(tok)}({_BANNED_SEP}|$)"))
+    for tok in BANNED_TOKENS
+)
+_NORMALIZE_PROBE = re.compile(
+    "|".join(re.escape(k) for k in sorted(set(REPLACE_MAP) | set(BANNED_TOKENS), key=len, reverse=True))
+)
+_WS_RE = re.compile(r"[ \t]+")
+NORMALIZE_CACHE_MAX_LEN = 256  # 이 길이 이하만 캐시(긴 S/O/AI 출력은 매번 다름)
 
+
+def _normalize_uncached(s: str) -> str:
     out = s
 
-    # 1) 치환
-    for k, v in REPLACE_MAP.items():
-        out = out.replace(k, v)
+    if _NORMALIZE_PROBE.search(out) is not None:
+        # 1) 치환 — 앞선 치환 결과가 뒤 키와 이어질 수 있어 순서대로 적용
+        for k, v in _REPLACE_ITEMS:
+            if k in out:
+                out = out.replace(k, v)
 
-    # 2) 금칙 토큰이 '단독' 혹은 '구분자'로 들어간 경우 제거(선택지 오염 방지)
-    # 예: "킄", "와" 등이 줄바꿈/쉼표로 섞임
-    for tok in BANNED_TOKENS:
-        # 단독 토큰(앞뒤 공백/구분자) 제거
-        out = re.sub(rf"(^|[\s,/\|·\-]+){re.escape(tok)}([\s,/\|·\-]+|$)", r"\1", out)
+        # 2) 금칙 토큰이 '단독' 혹은 '구분자'로 들어간 경우 제거(선택지 오염 방지)
+        # 예: "킄", "와" 등이 줄바꿈/쉼표로 섞임
+        for tok, pat in _BANNED_RES:
+            if tok in out:
+                out = pat.sub(r"\1", out)
 
     # 3) 다중 공백 정리
-    out = re.sub(r"[ \t]+", " ", out).strip()
+    return _WS_RE.sub(" ", out).strip()
+
+
+@st.cache_resource(show_spinner=False)
+def _normalize_cache() -> Callable[[str], str]:
+    # 모듈 전역 lru_cache는 rerun(모듈 재실행)마다 비워지므로 프로세스 단위로 보관
+    return lru_cache(maxsize=4096)(_normalize_uncached)
 
-    return out
+
+_normalize_cached = _normalize_cache()
+
+
+def normalize_text(s: str) -> str:
+    """화면/저장/AI입력에 들어가기 전에 문구를 강제 정리."""
+    if not isinstance(s, str):
+        return s
+    if len(s) <= NORMALIZE_CACHE_MAX_LEN:
+        return _normalize_cached(s)
+    return _normalize_uncached(s)
 
 
 def clean_options(options: List[str], allow_other_label: Optional[str] = None) -> List[str]:
@@ -161,11 +444,28 @@ FOLLOW_UP = ["1주", "2주", "4주", "6주"]
 
 
 # -----------------------------
-# 3) 기록 저장/불러오기(JSON)
+# 3) 기록 저장/불러오기(JSON / SQLite)
 # -----------------------------
 DATA_DIR = os.path.join(os.path.dirname(_THIS_FILE), "data")
-os.makedirs(DATA_DIR, exist_ok=True)
 DEFAULT_DB_PATH = os.path.join(DATA_DIR, "soap_notes.json")
+DEFAULT_SQLITE_PATH = os.path.join(DATA_DIR, "soap_notes.sqlite3")
+
+# 저장 백엔드: "json"(기본, 기존 soap_notes.json 파일 1개) | "sqlite"(노트 1건 = 행 1개, 처음 열 때 JSON을 1회 옮김)
+STORAGE_BACKEND = os.getenv("SOAP_STORAGE", "json").strip().lower()
+STORE_PAGE_ROWS = 500  # iter_notes가 한 번에 읽는 행 수
+
+
+def ensure_data_dir() -> None:
+    # import 시점이 아니라 실제로 쓸 때 생성(읽기 전용 배포/도구 import 시 부작용 없음)
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def _stat_sig(path: str) -> Tuple[int, int]:
+    try:
+        stt = os.stat(path)
+    except OSError:
+        return (0, -1)
+    return (stt.st_mtime_ns, stt.st_size)
 
 
 def load_db(path: str) -> Dict[str, Any]:
@@ -184,17 +484,1129 @@ def load_db(path: str) -> Dict[str, Any]:
 
 
 def save_db(path: str, db: Dict[str, Any]) -> None:
+    # 임시 파일에 다 쓴 뒤 교체 → 저장 도중 중단돼도 기존 파일이 잘리지 않음
+    tmp = f"{path}.tmp"
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        with open(tmp, "w", encoding="utf-8") as f:
             json.dump(db, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
     except Exception as e:
         st.error(f"저장 실패: {e}")
 
 
+def _note_id(note: Dict[str, Any]) -> str:
+    """id 없는(옛 백업) 노트는 내용 해시로 id 부여."""
+    nid = note.get("id")
+    if isinstance(nid, str) and nid:
+        return nid
+    raw = json.dumps(note, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:10]
+
+
+class NoteStore(ABC):
+    """노트 저장소 공통 인터페이스(JSON/SQLite)."""
+
+    path: str
+
+    @abstractmethod
+    def load(self) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def upsert_note(self, note: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def upsert_many(self, notes: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def replace_all(self, db: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def iter_notes(self, body_part: str = "", since: str = "", until: str = "") -> Iterator[Dict[str, Any]]:
+        """since <= created_at <= until(빈 값이면 제한 없음)인 노트를 created_at 오름차순으로 하나씩."""
+
+    @abstractmethod
+    def signature(self) -> Tuple[Any, ...]:
+        """저장 내용이 바뀌면 달라지는 값(파일 mtime 등). 전체를 다시 읽을지 판단용."""
+
+
+class JsonNoteStore(NoteStore):
+    """기존 soap_notes.json 파일 1개에 전체 저장(저장할 때마다 전체 재작성)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        return load_db(self.path)
+
+    def upsert_note(self, note: Dict[str, Any]) -> None:
+        self.upsert_many([note])
+
+    def upsert_many(self, notes: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            db = load_db(self.path)
+            pos = {_note_id(n): i for i, n in enumerate(db["notes"]) if isinstance(n, dict)}
+            for note in notes:
+                nid = _note_id(note)
+                if note.get("id") != nid:  # SqliteNoteStore와 같게 id를 채워 저장
+                    note = {**note, "id": nid}
+                if nid in pos:
+                    db["notes"][pos[nid]] = note
+                else:
+                    pos[nid] = len(db["notes"])
+                    db["notes"].append(note)
+            save_db(self.path, db)
+
+    def replace_all(self, db: Dict[str, Any]) -> None:
+        with self._lock:
+            save_db(self.path, db)
+
+    def _filtered(self, body_part: str) -> List[Dict[str, Any]]:
+        notes = [n for n in load_db(self.path)["notes"] if isinstance(n, dict)]
+        if body_part:
+            notes = [n for n in notes if n.get("body_part", "") == body_part]
+        return notes
+
+    def iter_notes(self, body_part: str = "", since: str = "", until: str = "") -> Iterator[Dict[str, Any]]:
+        notes = sorted(self._filtered(body_part), key=lambda x: x.get("created_at", ""))
+        for n in notes:
+            c = str(n.get("created_at", ""))
+            if (not since or c >= since) and (not until or c <= until):
+                yield n
+
+    def signature(self) -> Tuple[Any, ...]:
+        return _stat_sig(self.path)
+
+
+class SqliteNoteStore(NoteStore):
+    """SQLite(WAL) 저장소: 노트 1건 = 행 1개, created_at/body_part 인덱스로 페이지 조회."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0  # 같은 프로세스의 쓰기(mtime 해상도가 낮은 파일시스템 대비)
+        import sqlite3  # SOAP_STORAGE=sqlite일 때만 필요 → 기본(json) 시작 경로에서는 import하지 않음
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS notes (
+                id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL DEFAULT '',
+                body_part TEXT NOT NULL DEFAULT '',
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_notes_created_at ON notes(created_at);
+            CREATE INDEX IF NOT EXISTS idx_notes_body_created ON notes(body_part, created_at);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+
+    @staticmethod
+    def _row(note: Dict[str, Any]) -> Tuple[str, str, str, str]:
+        nid = _note_id(note)
+        if note.get("id") != nid:
+            note = {**note, "id": nid}
+        return (
+            nid,
+            str(note.get("created_at", "")),
+            str(note.get("body_part", "")),
+            json.dumps(note, ensure_ascii=False),
+        )
+
+    def _upsert_rows(self, notes: List[Dict[str, Any]]) -> None:
+        self._writes += 1
+        self._conn.executemany(
+            "INSERT INTO notes(id, created_at, body_part, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET created_at=excluded.created_at, "
+            "body_part=excluded.body_part, data=excluded.data",
+            [self._row(n) for n in notes if isinstance(n, dict)],
+        )
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM notes ORDER BY rowid").fetchall()
+        return {"notes": [json.loads(r[0]) for r in rows]}
+
+    def upsert_note(self, note: Dict[str, Any]) -> None:
+        with self._lock:
+            self._upsert_rows([note])
+
+    def _transaction(self, notes: List[Dict[str, Any]], clear: bool) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if clear:
+                    self._conn.execute("DELETE FROM notes")
+                self._upsert_rows(notes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def upsert_many(self, notes: List[Dict[str, Any]]) -> None:
+        self._transaction(notes, clear=False)
+
+    def replace_all(self, db: Dict[str, Any]) -> None:
+        self._transaction(db.get("notes", []), clear=True)
+
+    def iter_notes(self, body_part: str = "", since: str = "", until: str = "") -> Iterator[Dict[str, Any]]:
+        # (created_at, id) 다음 것부터 STORE_PAGE_ROWS개씩 이어 읽음 → 잠금은 한 묶음 읽는 동안만
+        where = ["(created_at > ? OR (created_at = ? AND id > ?))"]
+        args: List[Any] = []
+        if body_part:
+            where.append("body_part = ?")
+            args.append(body_part)
+        if until:
+            where.append("created_at <= ?")
+            args.append(until)
+        sql = f"SELECT created_at, id, data FROM notes WHERE {' AND '.join(where)} ORDER BY created_at, id LIMIT ?"
+        after, after_id = since, ""  # id는 비어 있지 않으므로 첫 묶음은 created_at >= since
+        while True:
+            with self._lock:
+                rows = self._conn.execute(sql, (after, after, after_id, *args, STORE_PAGE_ROWS)).fetchall()
+            for r in rows:
+                yield json.loads(r[2])
+            if len(rows) < STORE_PAGE_ROWS:
+                return
+            after, after_id = rows[-1][0], rows[-1][1]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta(key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, value),
+            )
+
+    def signature(self) -> Tuple[Any, ...]:
+        # 다른 프로세스의 쓰기는 WAL 파일 mtime/크기로 감지
+        return (_stat_sig(self.path), _stat_sig(f"{self.path}-wal"), self._writes)
+
+
+def migrate_json_to_sqlite(json_path: str, store: SqliteNoteStore) -> int:
+    """기존 JSON 파일을 SQLite로 1회 이관. 이관한 노트 수 반환(이미 이관했으면 0)."""
+    if store.get_meta("migrated_from_json") or not os.path.exists(json_path):
+        return 0
+    notes = load_db(json_path)["notes"]
+    store.upsert_many(notes)
+    store.set_meta("migrated_from_json", f"{now_str()} | {json_path} | {len(notes)}")
+    return len(notes)
+
+
+@st.cache_resource(show_spinner=False)
+def get_store() -> NoteStore:
+    """프로세스 전역 저장소(설정된 백엔드, 최초 1회 생성 후 모든 세션/rerun이 공유)."""
+    ensure_data_dir()
+    if STORAGE_BACKEND == "json":
+        return JsonNoteStore(DEFAULT_DB_PATH)
+    store = SqliteNoteStore(DEFAULT_SQLITE_PATH)
+    migrate_json_to_sqlite(DEFAULT_DB_PATH, store)
+    return store
+
+
 def now_str() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
+# -----------------------------
+# 3-1) 노트 검색 색인(사이드바 키워드/부위 검색)
+# -----------------------------
+def _note_haystack(note: Dict[str, Any]) -> str:
+    """키워드 검색 대상 문자열(부위 + S/O/A/P, 소문자)."""
+    return " ".join([
+        str(note.get("body_part", "")),
+        str(note.get("body_part_free", "")),
+        str(note.get("S", "")),
+        str(note.get("O", "")),
+        str(note.get("A", "")),
+        str(note.get("P", "")),
+    ]).lower()
+
+
+def _note_body_haystack(note: Dict[str, Any]) -> str:
+    return (str(note.get("body_part", "")) + " " + str(note.get("body_part_free", ""))).lower()
+
+
+class NoteSearchIndex:
+    """문자 2-gram 역색인(형태소 분석 없이 한국어 부분 문자열 검색).
+
+    - 문서 번호 = notes 리스트 위치(추가만 되므로 게시 목록은 항상 오름차순)
+    - 2-gram으로 후보를 좁힌 뒤 원래의 `keyword in 문자열` 검사로 확인 → 기존 결과와 동일
+    """
+
+    GRAM = 2
+
+    def __init__(self, version: int = 0) -> None:
+        self.version = version
+        self._hay: List[str] = []
+        self._body: List[str] = []
+        self._postings: Dict[str, "array[int]"] = {}
+
+    @classmethod
+    def build(cls, notes: List[Dict[str, Any]], version: int) -> "NoteSearchIndex":
+        idx = cls(version)
+        for n in notes:
+            idx.add(n)
+        return idx
+
+    def __len__(self) -> int:
+        return len(self._hay)
+
+    def add(self, note: Dict[str, Any]) -> None:
+        doc = len(self._hay)
+        hay = _note_haystack(note)
+        self._hay.append(hay)
+        self._body.append(_note_body_haystack(note))
+        g = self.GRAM
+        postings = self._postings
+        for gram in {hay[i:i + g] for i in range(len(hay) - g + 1)}:
+            p = postings.get(gram)
+            if p is None:
+                p = postings[gram] = array("I")
+            p.append(doc)
+
+    def _candidates(self, q: str) -> Optional[Sequence[int]]:
+        """q의 2-gram 중 게시 목록이 가장 짧은 것. q가 너무 짧으면 None(전체 확인)."""
+        g = self.GRAM
+        if len(q) < g:
+            return None
+        best: Optional[Sequence[int]] = None
+        for gram in {q[i:i + g] for i in range(len(q) - g + 1)}:
+            p = self._postings.get(gram)
+            if p is None:
+                return ()
+            if best is None or len(p) < len(best):
+                best = p
+        return best
+
+    def search(self, keyword: str, fbody: str = "", upto: Optional[int] = None) -> List[int]:
+        """keyword(S/O/A/P/부위) + fbody(부위) 조건을 모두 만족하는 문서 번호(오름차순).
+        upto를 주면 그 앞 문서만(다른 스레드가 add 중이어도 스냅샷 범위만 봄)."""
+        n = len(self._hay) if upto is None else min(upto, len(self._hay))
+        if not keyword and not fbody:
+            return list(range(n))
+
+        kc = self._candidates(keyword) if keyword else None
+        bc = self._candidates(fbody) if fbody else None
+        if kc is not None and bc is not None:
+            cand: Sequence[int] = kc if len(kc) <= len(bc) else bc
+        elif kc is not None:
+            cand = kc
+        elif bc is not None:
+            cand = bc
+        else:
+            cand = range(n)
+
+        hay, body = self._hay, self._body
+        out: List[int] = []
+        for i in cand:
+            if i >= n:
+                break  # 게시 목록은 오름차순
+            if (not keyword or keyword in hay[i]) and (not fbody or fbody in body[i]):
+                out.append(i)
+        return out
+
+
+# -----------------------------
+# 3-2) 변경 기록(저널) - 여러 앱 프로세스가 새 노트를 전체 재로딩 없이 받아 감
+# -----------------------------
+JOURNAL_COMPACT_BYTES = 4_000_000  # 이보다 커지면 압축
+JOURNAL_KEEP_ENTRIES = 500  # 압축 후에도 남겨 두는 최근 기록(조금 뒤처진 프로세스용)
+# 남겨 두는 기록의 크기 상한. 일괄 가져오기는 기록 1개에 노트 수백 개가 들어가므로 개수만으로 자르면
+# 압축 후에도 JOURNAL_COMPACT_BYTES를 넘어 저장할 때마다 다시 압축하게 됨
+JOURNAL_KEEP_BYTES = JOURNAL_COMPACT_BYTES // 4
+
+JournalEntry = Dict[str, Any]
+# 저널 파일 구분: (inode, 앞부분). 압축으로 지운 파일의 inode를 새 파일이 다시 받을 수 있어서
+# inode만 보면 교체를 놓치고 엉뚱한 위치부터 읽음 → 압축 때 쓰는 base 줄에 임의 값을 넣어 앞부분으로 구분
+JournalFile = Tuple[int, bytes]
+JOURNAL_HEAD_BYTES = 64
+
+
+def journal_path_for(store_path: str) -> str:
+    return f"{os.path.splitext(store_path)[0]}.journal.jsonl"
+
+
+class NoteJournal:
+    """저장소 옆 추가 전용 JSONL: {"seq": n, "op": "upsert", "notes": [...]} | {"seq": n, "op": "reset"}.
+
+    - 쓰기: 파일 잠금 안에서 저장소 반영 → 기록 1줄 추가(seq는 1씩 증가)
+    - 읽기: 잠금 없이 마지막으로 읽은 위치부터 끝까지(완성된 줄만)
+    - 압축: 파일을 새로 써서 교체(첫 줄 {"op": "base", "file": 임의 값, "seq": s} = s번까지는 저장소에 반영됨)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._tlock = threading.Lock()
+        self._tail: Tuple[JournalFile, int, int] = ((0, b""), 0, 0)  # 마지막으로 확인한 (파일, 위치, seq)
+        self._tail_lock = threading.Lock()
+        self.compactions = 0
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with self._tlock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "a+") as lf:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+    def stat(self) -> Tuple[int, int]:
+        """(inode, 크기). 없으면 (0, 0)."""
+        try:
+            stt = os.stat(self.path)
+        except OSError:
+            return (0, 0)
+        return (stt.st_ino, stt.st_size)
+
+    @staticmethod
+    def _parse(raw: bytes) -> List[JournalEntry]:
+        out = []
+        for line in raw.splitlines():
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(e, dict) and isinstance(e.get("seq"), int):
+                out.append(e)
+        return out
+
+    def read_since(self, file: JournalFile, offset: int) -> Tuple[JournalFile, int, List[JournalEntry]]:
+        """(파일, 다음 읽을 위치, 기록들). 파일이 교체(압축)됐으면 처음부터 읽는다."""
+        try:
+            with open(self.path, "rb") as f:
+                cur = (os.fstat(f.fileno()).st_ino, f.read(JOURNAL_HEAD_BYTES))
+                if cur != file:
+                    offset = 0
+                f.seek(offset)
+                raw = f.read()
+        except OSError:
+            return ((0, b""), 0, [])
+        end = raw.rfind(b"\n") + 1  # 쓰는 중인 마지막 줄은 다음에
+        return (cur, offset + end, self._parse(raw[:end]))
+
+    def position(self) -> Tuple[JournalFile, int, int]:
+        """(파일, 끝 위치, 마지막 seq). 지난번 확인한 곳부터만 읽는다."""
+        with self._tail_lock:
+            file, offset, seq = self._tail
+            new_file, new_offset, entries = self.read_since(file, offset)
+            if new_file != file:
+                seq = 0
+            if entries:
+                seq = entries[-1]["seq"]
+            self._tail = (new_file, new_offset, seq)
+            return self._tail
+
+    def append(self, op: str, notes: Optional[List[Dict[str, Any]]] = None) -> int:
+        """locked() 안에서만 호출. 새 seq 반환."""
+        seq = self.position()[2] + 1
+        entry: JournalEntry = {"seq": seq, "op": op}
+        if notes is not None:
+            entry["notes"] = notes
+        with open(self.path, "ab") as f:
+            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+        if self.stat()[1] > JOURNAL_COMPACT_BYTES:
+            self.compact()
+        return seq
+
+    def compact(self, keep: Optional[int] = None) -> None:
+        """locked() 안에서만 호출. 최근 keep개(합쳐서 JOURNAL_KEEP_BYTES 이하)만 남기고 새 파일로 교체
+        (저장소에는 이미 반영됨. 더 뒤처진 프로세스는 base를 보고 저장소를 다시 읽음)."""
+        keep = JOURNAL_KEEP_ENTRIES if keep is None else keep
+        entries = [e for e in self.read_since((-1, b""), 0)[2] if e.get("op") != "base"]
+        if not entries:
+            return
+        kept: List[bytes] = []
+        size = 0
+        for e in reversed(entries[-keep:] if keep > 0 else []):
+            line = (json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8")
+            if size + len(line) > JOURNAL_KEEP_BYTES:
+                break
+            kept.append(line)
+            size += len(line)
+        kept.reverse()
+        base = entries[-1]["seq"] - len(kept)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write((json.dumps({"op": "base", "file": os.urandom(8).hex(), "seq": base}) + "\n").encode("utf-8"))
+            for line in kept:
+                f.write(line)
+        os.replace(tmp, self.path)
+        self.compactions += 1
+
+
+# -----------------------------
+# 3-3) 프로세스 공유 노트(모든 세션이 같은 스냅샷을 읽음)
+# -----------------------------
+NOTE_PAGE_SIZE = 50
+NOTE_QUERY_CACHE_ITEMS = 128
+
+
+def _created_key(note: Dict[str, Any]) -> str:
+    return str(note.get("created_at", ""))
+
+
+class _NoteGeneration:
+    """추가만 되는 노트 리스트 1세대 + id 위치 + (필요할 때 만드는) 검색 색인/created_at 정렬.
+    기존 노트 교체/전체 교체는 새 세대를 만든다(copy-on-write)."""
+
+    def __init__(self, items: List[Dict[str, Any]], write_lock: threading.Lock) -> None:
+        self.items = items
+        self.pos: Dict[str, int] = {}
+        for i, n in enumerate(items):
+            self.pos[_note_id(n)] = i
+        self._write_lock = write_lock
+        self._build_lock = threading.Lock()
+        self._index: Optional[NoteSearchIndex] = None
+        self._builder: Optional[threading.Thread] = None
+        # created_at 오름차순 (키 목록, 문서 번호 목록)
+        self._order: Optional[Tuple[List[str], List[int]]] = None
+        # (version, keyword, fbody, page, page_size) -> (문서 번호들, 전체 일치 수)
+        self._queries: "OrderedDict[Tuple[Any, ...], Tuple[List[int], int]]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def append(self, note: Dict[str, Any]) -> None:
+        # 쓰기 잠금 안에서만 호출
+        doc = len(self.items)
+        self.pos[_note_id(note)] = doc
+        self.items.append(note)
+        if self._index is not None:
+            self._index.add(note)
+        if self._order is not None:
+            keys, docs = self._order
+            key = _created_key(note)
+            if not keys or key >= keys[-1]:
+                # 보통은 새 노트가 가장 최근 → 끝에 추가(읽는 쪽이 보던 앞부분은 그대로)
+                keys.append(key)
+                docs.append(doc)
+            else:
+                i = bisect.bisect_right(keys, key)
+                self._order = (keys[:i] + [key] + keys[i:], docs[:i] + [doc] + docs[i:])
+
+    def order(self) -> Tuple[List[str], List[int]]:
+        o = self._order
+        if o is not None:
+            return o
+        with self._write_lock:
+            if self._order is None:
+                docs = sorted(range(len(self.items)), key=lambda i: _created_key(self.items[i]))
+                self._order = ([_created_key(self.items[i]) for i in docs], docs)
+            return self._order
+
+    def cached_query(self, key: Tuple[Any, ...]) -> Optional[Tuple[List[int], int]]:
+        with self._queries_lock:
+            hit = self._queries.get(key)
+            if hit is not None:
+                self._queries.move_to_end(key)
+            return hit
+
+    def remember_query(self, key: Tuple[Any, ...], value: Tuple[List[int], int]) -> None:
+        with self._queries_lock:
+            self._queries[key] = value
+            while len(self._queries) > NOTE_QUERY_CACHE_ITEMS:
+                self._queries.popitem(last=False)
+
+    def _build_index(self) -> None:
+        # 쓰기를 막지 않고 만든 뒤, 그 사이 추가된 것만 잠금 안에서 따라잡음
+        idx = NoteSearchIndex.build(self.items[:len(self.items)], 0)
+        with self._write_lock:
+            for note in self.items[len(idx):]:
+                idx.add(note)
+            self._index = idx
+
+    def index(self) -> Optional[NoteSearchIndex]:
+        """검색 색인. 아직 없으면 백그라운드에서 만들기 시작하고 None(그동안은 순차 검색)."""
+        idx = self._index
+        if idx is None:
+            with self._build_lock:
+                if self._builder is None:
+                    self._builder = threading.Thread(target=self._build_index, name="note-index", daemon=True)
+                    self._builder.start()
+        return idx
+
+
+class NotesSnapshot:
+    """특정 버전의 노트 목록(읽기 전용). 이후 저장이 있어도 이 스냅샷이 보는 내용은 그대로."""
+
+    __slots__ = ("version", "_gen", "_n")
+
+    def __init__(self, version: int, gen: _NoteGeneration, n: int) -> None:
+        self.version = version
+        self._gen = gen
+        self._n = n
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        items = self._gen.items
+        return (items[i] for i in range(self._n))
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return self._gen.items[i]
+
+    def get(self, note_id: str) -> Optional[Dict[str, Any]]:
+        i = self._gen.pos.get(note_id)
+        return self._gen.items[i] if i is not None and i < self._n else None
+
+    def search(self, keyword: str, fbody: str = "") -> List[int]:
+        idx = self._gen.index()
+        if idx is not None:
+            return idx.search(keyword, fbody, upto=self._n)
+        items = self._gen.items
+        return [
+            i for i in range(self._n)
+            if (not keyword or keyword in _note_haystack(items[i]))
+            and (not fbody or fbody in _note_body_haystack(items[i]))
+        ]
+
+    def _newest_first(self) -> Iterator[int]:
+        docs = self._gen.order()[1]
+        for j in range(len(docs) - 1, -1, -1):
+            if docs[j] < self._n:
+                yield docs[j]
+
+    def page(
+        self, keyword: str = "", fbody: str = "", page: int = 0, page_size: int = NOTE_PAGE_SIZE,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """(page번째 묶음의 노트들(최신순), 조건에 맞는 전체 수). 결과는 (버전, 조건, 페이지)로 메모."""
+        key = (self.version, keyword, fbody, page, page_size)
+        hit = self._gen.cached_query(key)
+        items = self._gen.items
+        if hit is None:
+            k = (max(0, page) + 1) * page_size
+            if not keyword and not fbody:
+                docs = [d for _, d in zip(range(k), self._newest_first())]
+                total = self._n
+            else:
+                # 상위 k개만 부분 정렬(top-k)
+                matches = self.search(keyword, fbody)
+                docs = heapq.nlargest(k, matches, key=lambda i: (_created_key(items[i]), i))
+                total = len(matches)
+            hit = (docs[k - page_size:], total)
+            self._gen.remember_query(key, hit)
+        return [items[i] for i in hit[0]], hit[1]
+
+    def page_of_date(self, date: str, keyword: str = "", fbody: str = "", page_size: int = NOTE_PAGE_SIZE) -> int:
+        """date(YYYY-MM-DD) 당일 또는 그 이전 노트 중 가장 최근 것이 있는 페이지."""
+        target = f"{date} 23:59:59"
+        if not keyword and not fbody:
+            keys, docs = self._gen.order()
+            pos = bisect.bisect_right(keys, target, 0, len(docs))
+            newer = sum(1 for d in docs[pos:] if d < self._n)
+        else:
+            items = self._gen.items
+            newer = sum(1 for i in self.search(keyword, fbody) if _created_key(items[i]) > target)
+        return newer // page_size
+
+    def to_db(self) -> Dict[str, Any]:
+        return {"notes": list(self)}
+
+
+class SharedNotes:
+    """프로세스에 노트 1벌만 두고 모든 세션이 공유(세션에는 버전 번호만).
+
+    - 쓰기(저장/가져오기)마다 version 1 증가, 새 스냅샷 발행
+    - 읽기는 잠금 없이 현재 스냅샷을 받아 감(쓰기가 읽기를, 읽기가 쓰기를 막지 않음)
+    - 다른 프로세스의 저장은 변경 기록(저널)에서 못 본 것만 읽어 반영(전체 재로딩 X)
+    """
+
+    def __init__(self, store: NoteStore, journal: NoteJournal) -> None:
+        self.store = store
+        self.journal = journal
+        self._lock = threading.Lock()
+        self._version = 0
+        self._seq = 0  # 반영한 마지막 저널 seq
+        self._jpos: Tuple[JournalFile, int] = ((0, b""), 0)  # 다음에 읽을 저널 (파일, 위치)
+        self._snap: Optional[NotesSnapshot] = None
+        self.loads = 0
+        self.applied = 0
+        self.last_load_sec = 0.0
+
+    def _publish(self, gen: _NoteGeneration) -> NotesSnapshot:
+        self._version += 1
+        self._snap = NotesSnapshot(self._version, gen, len(gen.items))
+        return self._snap
+
+    def _reload(self) -> None:
+        # 저널 위치를 먼저 잡고 저장소를 읽음 → 그 사이 저장된 노트는 다음 추적에서 다시 반영(같은 id면 덮어쓰기라 무해)
+        t0 = time.perf_counter()
+        file, offset, seq = self.journal.position()
+        notes = [n for n in self.store.load().get("notes", []) if isinstance(n, dict)]
+        self._seq = seq
+        self._jpos = (file, offset)
+        self.loads += 1
+        self.last_load_sec = time.perf_counter() - t0
+        gen = _NoteGeneration(notes, self._lock)
+        gen.index()  # 검색 색인은 백그라운드에서 미리
+        self._publish(gen)
+
+    def _apply(self, notes: List[Dict[str, Any]]) -> None:
+        gen = self._snap._gen  # type: ignore[union-attr]
+        ids = [_note_id(n) for n in notes]
+        # 새 id만 있고 그 안에서도 겹치지 않을 때만 추가 전용(같은 id가 두 번이면 교체 경로)
+        if len(set(ids)) == len(ids) and not any(nid in gen.pos for nid in ids):
+            for n in notes:
+                gen.append(n)
+        else:
+            items = list(gen.items)  # 기존 노트 교체는 새 세대(이전 스냅샷은 그대로)
+            pos = dict(gen.pos)
+            for n in notes:
+                nid = _note_id(n)
+                if nid in pos:
+                    items[pos[nid]] = n
+                else:
+                    pos[nid] = len(items)
+                    items.append(n)
+            gen = _NoteGeneration(items, self._lock)
+        self.applied += len(notes)
+        self._publish(gen)
+
+    def _catch_up(self) -> None:
+        """쓰기 잠금 안에서 호출. 저널에서 아직 반영 안 한 기록만 적용."""
+        if self._snap is None:
+            self._reload()
+        while True:
+            file, offset, entries = self.journal.read_since(*self._jpos)
+            pending: List[Dict[str, Any]] = []
+            for e in entries:
+                if e["op"] == "base" and e["seq"] > self._seq:
+                    break  # 압축으로 못 본 기록이 사라짐 → 전체 재로딩
+                if e["seq"] <= self._seq:
+                    continue
+                if e["op"] == "reset":
+                    break  # 다른 프로세스가 전체 교체(가져오기)
+                if e["op"] == "upsert" and isinstance(e.get("notes"), list):
+                    pending.extend(n for n in e["notes"] if isinstance(n, dict))
+                self._seq = e["seq"]
+            else:
+                self._jpos = (file, offset)
+                if pending:
+                    self._apply(pending)
+                return
+            self._reload()
+
+    def snapshot(self) -> NotesSnapshot:
+        snap = self._snap
+        (ino, _), offset = self._jpos  # 압축 교체는 크기로 알아챔(inode 재사용 + 같은 크기면 다음 저장 때)
+        if snap is not None and self.journal.stat() == (ino, offset):
+            return snap
+        with self._lock:
+            self._catch_up()
+            return self._snap  # type: ignore[return-value]
+
+    def upsert(self, note: Dict[str, Any]) -> NotesSnapshot:
+        """저장소 + 저널에 기록(프로세스 간 잠금) 후 반영. 같은 id면 교체."""
+        return self.upsert_many([note])
+
+    def upsert_many(self, notes: List[Dict[str, Any]]) -> NotesSnapshot:
+        notes = [n if n.get("id") == _note_id(n) else {**n, "id": _note_id(n)} for n in notes]
+        with self._lock:
+            if notes:
+                with self.journal.locked():
+                    self.store.upsert_many(notes)
+                    self.journal.append("upsert", notes)
+            self._catch_up()
+            return self._snap  # type: ignore[return-value]
+
+    def replace_all(self, notes: List[Dict[str, Any]]) -> NotesSnapshot:
+        with self._lock:
+            with self.journal.locked():
+                self.store.replace_all({"notes": [n for n in notes if isinstance(n, dict)]})
+                self.journal.append("reset")
+            self._reload()
+            return self._snap  # type: ignore[return-value]
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snap
+        return {
+            "version": snap.version if snap else 0,
+            "notes": len(snap) if snap else 0,
+            "seq": self._seq,
+            "loads": self.loads,
+            "applied": self.applied,
+            "compactions": self.journal.compactions,
+            "last_load_sec": self.last_load_sec,
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def shared_notes() -> SharedNotes:
+    store = get_store()
+    return SharedNotes(store, NoteJournal(journal_path_for(store.path)))
+
+
+# -----------------------------
+# 3-4) 백업 가져오기(JSON) - 조금씩 읽으며 검증 후 id 기준 병합
+# -----------------------------
+IMPORT_READ_BYTES = 1 << 20  # 한 번에 읽는 양(1MB)
+IMPORT_BATCH = 500  # 저장소에 한 번에 반영하는 노트 수
+IMPORT_POLICIES = {"newest": "더 최근 것 유지", "existing": "기존 것 유지"}
+
+# save_current_note가 만드는 노트 모양
+NOTE_TEXT_FIELDS = (
+    "id", "title", "created_at", "mode", "body_part", "body_part_free", "stimulus",
+    "treat_freq", "exer_freq", "follow_up", "S_in", "O_in", "S", "O", "A", "P",
+)
+_CREATED_AT_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+
+def validate_note(note: Any) -> Optional[str]:
+    """문제가 있으면 이유, 없으면 None."""
+    if not isinstance(note, dict):
+        return "객체가 아님"
+    for k in NOTE_TEXT_FIELDS:
+        if k in note and not isinstance(note[k], str):
+            return f"{k}: 문자열이 아님"
+    barriers = note.get("barriers", [])
+    if not isinstance(barriers, list) or not all(isinstance(x, str) for x in barriers):
+        return "barriers: 문자열 목록이 아님"
+    if not _CREATED_AT_RE.fullmatch(note.get("created_at", "")):
+        return "created_at 형식 오류"
+    if not any(note.get(k) for k in ("S", "O", "A", "P")):
+        return "S/O/A/P가 모두 비어 있음"
+    return None
+
+
+class _JsonStream:
+    """파일을 조금씩 읽으며 JSON 값을 하나씩 꺼냄(전체를 한 번에 json.loads 하지 않음)."""
+
+    _WS = " \t\r\n"
+
+    def __init__(self, fp: BinaryIO, read_bytes: Optional[int] = None) -> None:
+        self.fp = fp
+        self.read_bytes = read_bytes or IMPORT_READ_BYTES
+        self.bytes_read = 0
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+        self._decoder = json.JSONDecoder(strict=False)
+
+    def _more(self) -> bool:
+        if self.eof:
+            return False
+        raw = self.fp.read(self.read_bytes)
+        self.bytes_read += len(raw)
+        if self.pos:
+            # 이미 읽은 앞부분은 버림 → 버퍼는 (읽는 단위 + 값 1개) 정도로 유지
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        if not raw:
+            self.eof = True
+            self.buf += self._utf8.decode(b"", final=True)
+            return False
+        self.buf += self._utf8.decode(raw)
+        return True
+
+    def peek(self) -> str:
+        """공백을 건너뛴 다음 글자(끝이면 "")."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self._WS:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch: str) -> None:
+        if self.peek() != ch:
+            raise ValueError(f"JSON 형식 오류: '{ch}' 위치({self.bytes_read:,}바이트 부근)")
+        self.pos += 1
+
+    def _maybe_cut(self, val: Any, end: int) -> bool:
+        if self.eof:
+            return False
+        if end == len(self.buf):
+            return True
+        # "1.5" 가 "1." 까지만 읽힌 경우 등: 뒤가 전부 숫자 글자면 잘렸을 수 있음
+        number = isinstance(val, (int, float)) and not isinstance(val, bool)
+        return number and self.buf[end:].strip("0123456789eE.+-") == ""
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if self._more():
+                    continue  # 값이 읽은 부분 끝에서 잘림
+                raise ValueError(f"JSON 파싱 실패: {e}") from None
+            if self._maybe_cut(val, end) and self._more():
+                continue  # 숫자 등은 읽은 부분 끝에서 잘려도 파싱되므로 더 읽고 다시
+            self.pos = end
+            return val
+
+    def array(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            c = self.peek()
+            self.pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(f"JSON 형식 오류: ',' 또는 ']' 위치({self.bytes_read:,}바이트 부근)")
+
+
+def iter_backup_notes(stream: _JsonStream, ndjson: bool = False) -> Iterator[Any]:
+    """{"notes": [...], ...} 또는 [...](ndjson이면 줄마다 노트 1개)에서 노트를 하나씩."""
+    if ndjson:
+        while stream.peek():
+            yield stream.value()
+        return
+    if stream.peek() == "[":
+        yield from stream.array()
+        return
+    stream.expect("{")
+    found = False
+    while stream.peek() != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key == "notes":
+            found = True
+            yield from stream.array()
+        else:
+            stream.value()  # 다른 항목은 건너뜀
+        if stream.peek() == ",":
+            stream.pos += 1
+    if not found:
+        raise ValueError("notes 목록이 없어요.")
+
+
+@dataclass
+class ImportResult:
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+    duplicates: int = 0  # 파일 안에서 같은 id가 또 나온 행(노트 1건은 added/updated로 이미 셈)
+    invalid: int = 0
+    errors: Optional[List[str]] = None  # 처음 몇 건의 검증 오류
+
+
+@profiled("import_backup")
+def import_backup(
+    fp: BinaryIO,
+    shared: SharedNotes,
+    policy: str = "newest",
+    total_bytes: int = 0,
+    on_progress: Optional[Callable[[float, ImportResult], None]] = None,
+    ndjson: bool = False,
+) -> ImportResult:
+    """백업 JSON을 조금씩 읽어 검증 후 id 기준으로 병합(IMPORT_BATCH개씩 저장). gzip 압축도 그대로 읽음.
+    policy: "newest" = created_at이 더 최근인 쪽 유지, "existing" = 이미 있는 노트는 그대로."""
+    if policy not in IMPORT_POLICIES:
+        raise ValueError(f"알 수 없는 병합 방식: {policy}")
+    res = ImportResult(errors=[])
+    start = fp.tell()
+    gz = fp.read(2) == b"\x1f\x8b"
+    fp.seek(start)
+    src: BinaryIO = fp
+    if gz:
+        import gzip  # 압축 백업을 가져올 때만
+
+        src = gzip.GzipFile(fileobj=fp, mode="rb")  # type: ignore[assignment]
+    stream = _JsonStream(src)
+    seen: Dict[str, str] = {}  # 이번 가져오기에서 받아들인 id → created_at(파일 안 중복 처리)
+    batch: Dict[str, Dict[str, Any]] = {}  # id → 노트(같은 묶음 안에서는 나중 것이 이김)
+
+    def flush() -> None:
+        if batch:
+            shared.upsert_many(list(batch.values()))
+            batch.clear()
+        if on_progress is not None:
+            # 압축 파일도 원본(fp)에서 읽은 위치로 진행률 계산
+            on_progress((fp.tell() - start) / total_bytes if total_bytes else 0.0, res)
+
+    snap = shared.snapshot()
+    for i, note in enumerate(iter_backup_notes(stream, ndjson)):
+        err = validate_note(note)
+        if err is not None:
+            res.invalid += 1
+            if len(res.errors) < 20:  # type: ignore[arg-type]
+                res.errors.append(f"{i + 1}번째: {err}")  # type: ignore[union-attr]
+            continue
+        nid = _note_id(note)
+        earlier = seen.get(nid)
+        if earlier is not None:
+            # 파일 안 중복: 더 최근 것으로 이번 가져오기의 앞 사본을 대신함(추가/갱신은 이미 셈)
+            res.duplicates += 1
+            if policy == "existing" or note["created_at"] <= earlier:
+                continue
+        else:
+            cur = snap.get(nid)
+            existing = cur.get("created_at", "") if cur is not None else None
+            if existing is None:
+                res.added += 1
+            elif policy == "existing" or note["created_at"] <= existing:
+                res.skipped += 1
+                continue
+            else:
+                res.updated += 1
+        seen[nid] = note["created_at"]
+        batch[nid] = note
+        if len(batch) >= IMPORT_BATCH:
+            flush()
+    flush()
+    return res
+
+
+# -----------------------------
+# 3-5) 백업 내보내기 - 누를 때만 만들고 (버전, 형식, 조건)별로 캐시
+# -----------------------------
+# 형식 → (표시 이름, 파일 이름, MIME)
+EXPORT_FORMATS = {
+    "json": ("JSON", "soap_notes_backup.json", "application/json"),
+    "json.gz": ("JSON(gzip 압축)", "soap_notes_backup.json.gz", "application/gzip"),
+    "ndjson": ("NDJSON(한 줄에 노트 1개)", "soap_notes_backup.ndjson", "application/x-ndjson"),
+    "ndjson.gz": ("NDJSON(gzip 압축)", "soap_notes_backup.ndjson.gz", "application/gzip"),
+}
+EXPORT_CACHE_ITEMS = 4  # 메모리에 남겨 두는 내보내기 파일 수
+EXPORT_CHUNK_CHARS = 256 * 1024  # 이만큼 모아서 인코딩/압축
+
+
+@dataclass(frozen=True)
+class ExportFilter:
+    """조건 내보내기: 날짜(YYYY-MM-DD, 양 끝 포함) / 부위. 모두 비면 전체."""
+
+    since: str = ""
+    until: str = ""
+    body_part: str = ""
+
+    def __bool__(self) -> bool:
+        return bool(self.since or self.until or self.body_part)
+
+    def label(self) -> str:
+        parts = []
+        if self.since or self.until:
+            parts.append(f"{self.since or '처음'}~{self.until or '끝'}")
+        if self.body_part:
+            parts.append(self.body_part)
+        return ", ".join(parts) or "전체"
+
+
+def iter_export_chunks(notes: Iterator[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    """노트를 하나씩 직렬화. json = {"notes": [...]}(한 줄에 노트 1개), ndjson = 줄마다 노트."""
+    if fmt.startswith("ndjson"):
+        for n in notes:
+            yield json.dumps(n, ensure_ascii=False) + "\n"
+        return
+    yield '{"notes": ['
+    sep = "\n  "
+    for n in notes:
+        yield sep + json.dumps(n, ensure_ascii=False)
+        sep = ",\n  "
+    yield "\n]}\n"
+
+
+@profiled("build_export")
+def build_export(notes: Iterator[Dict[str, Any]], fmt: str) -> bytes:
+    """내보내기 파일 내용. .gz 형식은 만들면서 바로 압축(직렬화한 전체 문자열을 따로 두지 않음)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"알 수 없는 내보내기 형식: {fmt}")
+    z = zlib.compressobj(6, zlib.DEFLATED, 31) if fmt.endswith(".gz") else None  # wbits 31 = gzip 헤더
+    out: List[bytes] = []
+    buf: List[str] = []
+    size = 0
+
+    def emit() -> None:
+        raw = "".join(buf).encode("utf-8")
+        buf.clear()
+        out.append(z.compress(raw) if z is not None else raw)
+
+    for chunk in iter_export_chunks(notes, fmt):
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= EXPORT_CHUNK_CHARS:
+            emit()
+            size = 0
+    emit()
+    if z is not None:
+        out.append(z.flush())
+    return b"".join(out)
+
+
+def export_notes(snap: NotesSnapshot, store: NoteStore, flt: ExportFilter) -> Iterator[Dict[str, Any]]:
+    """전체는 메모리 스냅샷 그대로(저장 순서), 조건이 있으면 저장소에서 created_at 순으로 읽어 옴."""
+    if not flt:
+        return iter(snap)
+    until = f"{flt.until} 23:59:59" if flt.until else ""
+    return store.iter_notes(flt.body_part, flt.since, until)
+
+
+class ExportCache:
+    """(노트 버전, 형식, 조건) → 내보내기 파일. 버전이 같으면 rerun마다 다시 직렬화하지 않음."""
+
+    def __init__(self, max_items: int) -> None:
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple[Any, ...], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.last_build_sec = 0.0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return data
+
+    def build(self, key: Tuple[Any, ...], make: Callable[[], bytes]) -> bytes:
+        data = self.get(key)
+        if data is not None:
+            return data
+        t0 = time.perf_counter()
+        data = make()
+        with self._lock:
+            self.builds += 1
+            self.last_build_sec = time.perf_counter() - t0
+            self._items[key] = data
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "builds": self.builds,
+                "items": len(self._items),
+                "bytes": sum(len(v) for v in self._items.values()),
+                "last_build_sec": self.last_build_sec,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def export_cache() -> ExportCache:
+    return ExportCache(EXPORT_CACHE_ITEMS)
+
+
 # -----------------------------
 # 4) OpenAI (선택) + 폴백 생성기
 # -----------------------------
@@ -212,56 +1624,236 @@ class SoapInput:
     barriers: List[str]
 
 
-def _has_openai_key() -> bool:
-    # Streamlit secrets 우선, 그 다음 환경변수
-    key = st.secrets.get("OPENAI_API_KEY", None) if hasattr(st, "secrets") else None
-    if not key:
-        key = os.getenv("OPENAI_API_KEY", "")
+SOAP_INPUT_DEFAULTS: Dict[str, Any] = {
+    "mode": "제출용",
+    "body_part": "기타(직접입력)",
+    "body_part_free": "",
+    "s_text": "",
+    "o_text": "",
+    "stimulus": "불명",
+    "treat_freq": "주 2회",
+    "exer_freq": "주 5-6회",
+    "follow_up": "2주",
+    "barriers": [],
+}
+
+
+def soap_input_from_dict(d: Dict[str, Any]) -> SoapInput:
+    """화면 상태/JSONL 레코드 → 정리된 SoapInput(빠진 항목은 기본값)."""
+    v = {k: d.get(k, default) for k, default in SOAP_INPUT_DEFAULTS.items()}
+    barriers = v["barriers"] if isinstance(v["barriers"], list) else []
+    return SoapInput(
+        mode=normalize_text(str(v["mode"])),
+        body_part=normalize_text(str(v["body_part"])),
+        body_part_free=normalize_text(str(v["body_part_free"])),
+        s_text=normalize_text(str(v["s_text"])),
+        o_text=normalize_text(str(v["o_text"])),
+        stimulus=normalize_text(str(v["stimulus"])),
+        treat_freq=normalize_text(str(v["treat_freq"])),
+        exer_freq=normalize_text(str(v["exer_freq"])),
+        follow_up=normalize_text(str(v["follow_up"])),
+        barriers=[normalize_text(str(x)) for x in barriers],
+    )
+
+
+def _secret(name: str) -> Optional[str]:
+    # streamlit run 밖(배치/CLI)에서는 secrets 파일이 없어 예외가 날 수 있음
+    try:
+        return st.secrets.get(name, None) if hasattr(st, "secrets") else None
+    except Exception:
+        return None
+
+
+def _valid_openai_key(key: Any) -> bool:
     return bool(key and isinstance(key, str) and len(key) > 10)
 
 
+def _has_openai_key() -> bool:
+    return _valid_openai_key(_get_openai_key())
+
+
 def _get_openai_key() -> str:
-    key = st.secrets.get("OPENAI_API_KEY", None) if hasattr(st, "secrets") else None
+    # Streamlit secrets 우선, 그 다음 환경변수
+    key = _secret("OPENAI_API_KEY")
     if not key:
         key = os.getenv("OPENAI_API_KEY", "")
     return key or ""
 
 
-def build_prompt(inp: SoapInput) -> str:
-    # 모드 차등: 제출용은 깔끔/무난, 상세는 10년차급(구체/전문) — 하지만 둘 다 "허술하지 않게"
-    mode_instructions = ""
-    if inp.mode == "제출용":
-        mode_instructions = (
-            "- 출력은 간결하지만 임상적으로 타당해야 한다.\n"
-            "- S/O는 원문을 그대로 복사하지 말고 문장 구조를 바꿔 재서술한다.\n"
-            "- A는 추정/가설을 과도하게 단정하지 말고, 임상적 인상(가능성/근거)을 짧게 정리한다.\n"
-            "- P는 최소 3~5개 항목, 운동은 구체적 운동명/방법/세트·반복/주의점 포함.\n"
-        )
-    else:
-        mode_instructions = (
-            "- 출력은 더 전문적이고 구체적이어야 한다(임상 10년차 수준).\n"
-            "- S/O는 원문을 그대로 복사하지 말고 재구성·보완(누락된 항목을 합리적으로 보완)한다.\n"
-            "- A는 감별/가설을 2~3개로 정리하고, 근거(증상·유발·제한·부하 반응)를 포함한다.\n"
-            "- P는 반드시 생성한다(누락 금지). 운동은 '무슨 운동'인지 구체적으로, 단계/진행 기준 포함.\n"
-            "- P에는 교육/자가관리/모니터링/재평가 기준을 포함한다.\n"
-        )
+# 출력 형식 블록(텍스트 라벨 / 구조화 JSON)
+SOAP_TEXT_FORMAT = """S:
+(재서술된 S)
 
-    body = inp.body_part_free.strip() if inp.body_part == "기타(직접입력)" else inp.body_part
-    body = normalize_text(body) or "부위 불명"
+O:
+(재서술된 O)
+
+A:
+(임상적 인상/가설/근거)
+
+P:
+- (구체적 계획 1)
+- (구체적 계획 2)
+- (구체적 계획 3)
+(필요 시 더)"""
+
+SOAP_JSON_FORMAT = """JSON 객체 하나만 출력한다(설명 문장/코드블록 표시 금지).
+{"S": "재서술된 S", "O": "재서술된 O", "A": "임상적 인상/가설/근거", "P": ["구체적 계획 1", "구체적 계획 2", "구체적 계획 3"]}
+- S/O/A는 문자열, P는 계획 항목 문자열의 배열(최소 3개, 필요 시 더)."""
+
+
+# 모드 차등: 제출용은 깔끔/무난, 상세는 10년차급(구체/전문) — 하지만 둘 다 "허술하지 않게"
+MODE_INSTRUCTIONS = {
+    "제출용": (
+        "- 출력은 간결하지만 임상적으로 타당해야 한다.\n"
+        "- S/O는 원문을 그대로 복사하지 말고 문장 구조를 바꿔 재서술한다.\n"
+        "- A는 추정/가설을 과도하게 단정하지 말고, 임상적 인상(가능성/근거)을 짧게 정리한다.\n"
+        "- P는 최소 3~5개 항목, 운동은 구체적 운동명/방법/세트·반복/주의점 포함.\n"
+    ),
+    "상세": (
+        "- 출력은 더 전문적이고 구체적이어야 한다(임상 10년차 수준).\n"
+        "- S/O는 원문을 그대로 복사하지 말고 재구성·보완(누락된 항목을 합리적으로 보완)한다.\n"
+        "- A는 감별/가설을 2~3개로 정리하고, 근거(증상·유발·제한·부하 반응)를 포함한다.\n"
+        "- P는 반드시 생성한다(누락 금지). 운동은 '무슨 운동'인지 구체적으로, 단계/진행 기준 포함.\n"
+        "- P에는 교육/자가관리/모니터링/재평가 기준을 포함한다.\n"
+    ),
+}
+
+# S/O 원문에 쓸 수 있는 토큰 수(추정). 넘으면 공백/중복 줄 정리 후 잘라냄
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("SOAP_PROMPT_INPUT_TOKENS", "1200"))
+PROMPT_TRUNCATED_MARK = " …(이하 생략)"
+
+# 추정 단위: 영단어 | 숫자 덩어리 | 기호 1개 | 그 밖의 글자(한글·한자·가나 등) 1글자
+_TOKENISH_RE = re.compile(r"[A-Za-z]+|\d+|[^\s\w]|[^\W\d_]")
+_ASCII_WORD_RE = re.compile(r"[A-Za-z]+")
 
-    barriers = ", ".join(inp.barriers) if inp.barriers else "없음/미선택"
 
-    prompt = f"""
-너는 물리치료 SOAP 노트 작성 보조 AI다.
+def _token_costs(text: str) -> Iterator[Tuple[int, int]]:
+    """(단위가 끝나는 위치, 토큰 수)를 앞에서부터."""
+    for m in _TOKENISH_RE.finditer(text):
+        w = m.group()
+        yield m.end(), -(-len(w) // 4) if w[0].isascii() and w.isalpha() else 1
+
+
+def estimate_tokens(text: str) -> int:
+    """로컬 토큰 추정(토크나이저 없이): 한글 등 비ASCII 1글자 ≈ 1토큰, 영단어 4글자 ≈ 1토큰, 숫자/기호는 덩어리당 1토큰.
+    _token_costs의 합과 같음(단위당 1 + 영단어의 4글자 초과분). 실제 값과의 차이는 LLM 호출 기록
+    (est_prompt_tokens vs prompt_tokens)에서 확인."""
+    return len(_TOKENISH_RE.findall(text)) + sum((len(w) - 1) // 4 for w in _ASCII_WORD_RE.findall(text))
+
+
+def _compact_input(text: str) -> str:
+    """의미 손실 없는 정리: 줄 끝 공백/연속 공백/빈 줄 정리, 연달아 반복된 같은 줄 제거."""
+    out: List[str] = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line or (out and out[-1] == line):
+            continue
+        out.append(line)
+    return "\n".join(out)
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    """앞에서부터 budget 토큰까지(가능하면 줄/문장 경계에서 자름)."""
+    used, end = 0, 0
+    # 정리된 글에서는 5글자(영단어 4 + 공백)마다 최소 1토큰 → 그 뒤는 볼 필요 없음
+    for pos, cost in _token_costs(text[:budget * 5 + 5]):
+        if used + cost > budget:
+            break
+        used, end = used + cost, pos
+    else:
+        if end >= len(text):
+            return text
+    cut = text[:end]
+    for sep in ("\n", ". ", "다. ", ", "):
+        j = cut.rfind(sep)
+        if j >= end // 2:
+            cut = cut[:j + len(sep)]
+            break
+    return cut.rstrip() + PROMPT_TRUNCATED_MARK
+
+
+def fit_inputs(s_text: str, o_text: str, budget: int = 0) -> Tuple[str, str, List[str]]:
+    """S/O 원문을 합쳐 budget 토큰 안으로. (S, O, 잘린 항목 목록).
+    정리만으로 안 되면: 절반 이하인 쪽은 그대로 두고 나머지를 다른 쪽에, 둘 다 크면 반씩."""
+    budget = budget or PROMPT_INPUT_TOKEN_BUDGET
+    s, o = _compact_input(s_text), _compact_input(o_text)
+    ts, to = estimate_tokens(s), estimate_tokens(o)
+    if ts + to <= budget:
+        return s, o, []
+    half = budget // 2
+    bs = ts if ts <= half else budget - to if to <= half else half
+    bo = budget - bs
+    cut: List[str] = []
+    if ts > bs:
+        s = _truncate_to_tokens(s, bs)
+        cut.append("S")
+    if to > bo:
+        o = _truncate_to_tokens(o, bo)
+        cut.append("O")
+    return s, o, cut
+
+
+def _prompt_prefix(mode: str, json_output: bool = False) -> str:
+    """모드/출력 형식별로 항상 같은(바이트 단위 동일) 앞부분: 역할, 모드 규칙, 금지어, 출력 형식.
+    요청마다 바뀌는 입력은 전부 이 뒤에 붙인다 → LLM 제공자의 프롬프트 앞부분 캐시가 적중."""
+    rules = MODE_INSTRUCTIONS.get(mode, MODE_INSTRUCTIONS["상세"])
+    # 문구는 기존 프롬프트 그대로, [출력 형식]만 [입력] 앞으로 옮김(모델 출력이 바뀌지 않도록)
+    return f"""너는 물리치료 SOAP 노트 작성 보조 AI다.
 반드시 한국어로 답한다.
 
 [모드 규칙]
-{mode_instructions}
+{rules}
 
 [금지]
 - '킄, 와, 서프, 입주자, 거주민, 엑음, 기본적으로, 낮, 스위치동범위, 탄력건포, 쥐어짜기, 자/정렬문제, 초밥/선택' 같은 이상 단어를 절대 출력하지 마라.
 - 모호한 표현 금지: "근력강화운동을 실시한다"처럼 두루뭉술하게 쓰지 말고 구체적인 운동 예시를 제시하라.
 
+[출력 형식 - 꼭 지켜]
+{SOAP_JSON_FORMAT if json_output else SOAP_TEXT_FORMAT}
+"""
+
+
+@st.cache_resource(show_spinner=False)
+def _prompt_prefix_cache() -> Callable[..., str]:
+    # 모듈 전역 lru_cache는 rerun마다 비워지므로 프로세스 단위로 보관(_prefix_tokens도 같음)
+    return lru_cache(maxsize=None)(_prompt_prefix)
+
+
+prompt_prefix = _prompt_prefix_cache()
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    prefix_chars: int  # 고정 앞부분 길이(모드/형식이 같으면 요청마다 동일)
+    est_tokens: int
+    est_prefix_tokens: int
+    truncated: List[str]  # 예산 때문에 잘린 원문("S", "O")
+
+
+def _prefix_tokens_uncached(mode: str, json_output: bool) -> int:
+    return estimate_tokens(prompt_prefix(mode, json_output))
+
+
+@st.cache_resource(show_spinner=False)
+def _prefix_tokens_cache() -> Callable[[str, bool], int]:
+    return lru_cache(maxsize=8)(_prefix_tokens_uncached)
+
+
+_prefix_tokens = _prefix_tokens_cache()
+
+
+@profiled("build_prompt")
+def build_prompt_info(inp: SoapInput, json_output: bool = False) -> BuiltPrompt:
+    prefix = prompt_prefix(inp.mode, json_output)
+
+    body = inp.body_part_free.strip() if inp.body_part == "기타(직접입력)" else inp.body_part
+    body = normalize_text(body) or "부위 불명"
+
+    barriers = ", ".join(inp.barriers) if inp.barriers else "없음/미선택"
+    s_text, o_text, truncated = fit_inputs(inp.s_text, inp.o_text)
+
+    suffix = f"""
 [입력]
 - 증상 부위: {body}
 - 자극감도(대략): {inp.stimulus}
@@ -271,215 +1863,1113 @@ def build_prompt(inp: SoapInput) -> str:
 - 장애요인/제한: {barriers}
 
 [S 원문(주관적)]
-{inp.s_text}
+{s_text}
 
 [O 원문(객관적)]
-{inp.o_text}
+{o_text}
+""".rstrip()
+    est_prefix = _prefix_tokens(inp.mode, json_output)
+    return BuiltPrompt(prefix + suffix, len(prefix), est_prefix + estimate_tokens(suffix), est_prefix, truncated)
 
-[출력 형식 - 꼭 지켜]
-S:
-(재서술된 S)
 
-O:
-(재서술된 O)
+def build_prompt(inp: SoapInput, json_output: bool = False) -> str:
+    return build_prompt_info(inp, json_output).text
 
-A:
-(임상적 인상/가설/근거)
 
-P:
-- (구체적 계획 1)
-- (구체적 계획 2)
-- (구체적 계획 3)
-(필요 시 더)
-""".strip()
-    return prompt
+OPENAI_MODEL = "gpt-4.1-mini"
+OPENAI_TEMPERATURE = 0.4
 
 
-def call_openai(prompt: str) -> Optional[str]:
-    """openai 패키지가 있으면 사용. 없거나 실패하면 None."""
-    if not _has_openai_key():
-        return None
+def openai_base_url() -> str:
+    """SDK가 실제로 부르는 엔드포인트(OPENAI_BASE_URL, 비어 있으면 SDK 기본값)."""
+    return os.getenv("OPENAI_BASE_URL", "").strip().rstrip("/")
+
+
+# 오류 분류(LLMCall.error)
+LLM_ERROR_KINDS = ("timeout", "rate_limit", "auth", "bad_request", "server", "connection", "sdk_missing", "empty", "other")
+
+
+@dataclass
+class LLMCall:
+    """생성 1회의 기록. 호출 측이 만들어 chat_completion/call_openai(_stream)/finish_generation에 넘기면
+    각 단계가 자기 부분을 채우고, finish_generation이 LLM_TELEMETRY에 남긴다."""
+
+    mode: str = ""  # 제출용 / 상세
+    fmt: str = "text"  # text / json
+    stream: bool = False
+    model: str = OPENAI_MODEL
+    path: str = ""  # SDK("v1" | "legacy" | "none") 또는 "cache" | "shared" | "throttled" | "no_key" | "offline"
+    attempts: int = 0
+    queue_wait_sec: float = 0.0  # 속도 제한으로 줄 선 시간
+    latency_sec: float = 0.0  # LLM 응답 대기(재시도 포함, 캐시/키 없음이면 0)
+    ttfc_sec: Optional[float] = None  # 스트리밍: 첫 조각까지
+    est_prompt_tokens: Optional[int] = None  # build_prompt_info의 로컬 추정(실제 prompt_tokens와 비교)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    truncated: str = ""  # 예산 때문에 잘린 원문("S", "O", "SO")
+    error: str = ""  # LLM_ERROR_KINDS 중 하나(성공이면 "")
+    outcome: str = ""  # "llm" | "repaired" | "fallback"
+    fallback: bool = False  # 전체 폴백
+    p_patched: bool = False  # P가 비거나 잘못되어 규칙 기반으로 채움
+    ts: float = field(default_factory=time.time)
+
+    def set_usage(self, prompt_tokens: Any, completion_tokens: Any) -> None:
+        if isinstance(prompt_tokens, int):
+            self.prompt_tokens = prompt_tokens
+        if isinstance(completion_tokens, int):
+            self.completion_tokens = completion_tokens
+
+
+def classify_llm_error(e: BaseException) -> str:
+    """SDK 종류/버전과 무관하게 클래스 이름과 HTTP 상태로 분류(openai를 import하지 않음)."""
+    name = type(e).__name__
+    status = getattr(e, "status_code", None) or getattr(e, "http_status", None)
+    if "Timeout" in name:
+        return "timeout"
+    if status == 429 or "RateLimit" in name:
+        return "rate_limit"
+    if status in (401, 403) or "Authentication" in name or "PermissionDenied" in name:
+        return "auth"
+    if isinstance(status, int) and status >= 500 or name in ("InternalServerError", "ServiceUnavailableError"):
+        return "server"
+    if isinstance(status, int) and status >= 400 or "BadRequest" in name or "InvalidRequest" in name:
+        return "bad_request"
+    if "Connection" in name or isinstance(e, ConnectionError):
+        return "connection"
+    if isinstance(e, ImportError) or OPENAI_SDK == "none":
+        return "sdk_missing"
+    return "other"
+
+
+# -----------------------------
+# 4-1) LLM 클라이언트(프로세스 전역, 키별 1개 재사용)
+# -----------------------------
+OPENAI_CONNECT_TIMEOUT = 5.0  # 초
+OPENAI_READ_TIMEOUT = 60.0  # 초
+OPENAI_MAX_KEEPALIVE = 10
+
+
+def _detect_openai_sdk() -> str:
+    """설치된 openai SDK 종류: "v1" | "legacy" | "none" (패키지 메타데이터만 보고 판단, import 안 함)."""
     try:
-        # openai 최신/구버전 모두 최대한 대응
-        key = _get_openai_key()
+        from importlib.metadata import version
+        major = int(version("openai").split(".")[0])
+    except Exception:
+        return "none"
+    return "v1" if major >= 1 else "legacy"
 
-        # 1) 최신(OpenAI python SDK v1) 시도
-        try:
+
+OPENAI_SDK = _detect_openai_sdk()
+
+
+class LLMClientManager:
+    """(API 키, 엔드포인트)별 OpenAI 클라이언트 1개를 만들어 계속 재사용(HTTP keep-alive/TLS 세션 유지).
+    엔드포인트도 키에 넣어야 같은 프로세스에서 OPENAI_BASE_URL이 바뀌면(batch --base-url, api --bench)
+    새 엔드포인트로 감(응답 캐시 키와 같은 기준)."""
+
+    def __init__(self, sdk: str) -> None:
+        self.sdk = sdk
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.clients_created = 0
+        self.client_reuses = 0
+
+    def _client(self, key: str) -> Any:
+        base_url = openai_base_url()
+        with self._lock:
+            client = self._clients.get((key, base_url))
+            if client is not None:
+                self.client_reuses += 1
+                return client
+
+            import httpx  # openai v1 의존성
             from openai import OpenAI  # type: ignore
-            client = OpenAI(api_key=key)
-            resp = client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.4,
+
+            timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+            http = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_keepalive_connections=OPENAI_MAX_KEEPALIVE, keepalive_expiry=60.0),
             )
-            txt = resp.choices[0].message.content if resp and resp.choices else None
-            return txt
-        except Exception:
-            pass
+            client = OpenAI(api_key=key, base_url=base_url or None, timeout=timeout, http_client=http)
+            self._clients[(key, base_url)] = client
+            self.clients_created += 1
+            return client
+
+    def complete(
+        self,
+        key: str,
+        prompt: str,
+        json_mode: bool = False,
+        call: Optional[LLMCall] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[str]:
+        """LLM 1회 호출. 실패하면 예외를 그대로 올린다. json_mode면 JSON 객체 응답을 요청.
+        call을 주면 토큰 사용량을 채움. timeout(초)을 주면 이 요청만 읽기 제한 시간을 바꿈
+        (HTTP 요청 자체가 끝나므로 호출한 스레드가 계속 붙잡혀 있지 않음)."""
+        with self._lock:
+            self.requests += 1
+        messages = [{"role": "user", "content": prompt}]
+
+        if self.sdk == "v1":
+            extra: Dict[str, Any] = {"response_format": {"type": "json_object"}} if json_mode else {}
+            if timeout is not None:
+                extra["timeout"] = timeout
+            resp = self._client(key).chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=OPENAI_TEMPERATURE,
+                **extra,
+            )
+            usage = getattr(resp, "usage", None)
+            if call is not None and usage is not None:
+                call.set_usage(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+            return resp.choices[0].message.content if resp and resp.choices else None
 
-        # 2) 구버전(openai.ChatCompletion)
-        try:
+        if self.sdk == "legacy":
             import openai  # type: ignore
-            openai.api_key = key
             resp = openai.ChatCompletion.create(
-                model="gpt-4.1-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.4,
+                api_key=key,
+                api_base=openai_base_url() or None,
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=OPENAI_TEMPERATURE,
+                request_timeout=(OPENAI_CONNECT_TIMEOUT, timeout or OPENAI_READ_TIMEOUT),
             )
-            txt = resp["choices"][0]["message"]["content"]
-            return txt
-        except Exception:
-            return None
+            usage = resp.get("usage") or {}
+            if call is not None:
+                call.set_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+            return resp["choices"][0]["message"]["content"]
+
+        raise RuntimeError("openai 패키지가 설치되어 있지 않습니다.")
+
+    def stream(self, key: str, prompt: str, call: Optional[LLMCall] = None) -> Iterator[str]:
+        """스트리밍 호출: 응답 조각(텍스트)을 도착하는 대로 내보낸다. 실패하면 예외.
+        v1은 마지막 조각에 토큰 사용량을 받아 call에 채움(legacy는 사용량 없음)."""
+        with self._lock:
+            self.requests += 1
+        messages = [{"role": "user", "content": prompt}]
+
+        if self.sdk == "v1":
+            chunks = self._client(key).chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=OPENAI_TEMPERATURE,
+                stream=True,
+                extra_body={"stream_options": {"include_usage": True}},
+            )
+            for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                usage = getattr(chunk, "usage", None)
+                if call is not None and usage is not None:
+                    call.set_usage(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+            return
+
+        if self.sdk == "legacy":
+            import openai  # type: ignore
+            chunks = openai.ChatCompletion.create(
+                api_key=key,
+                api_base=openai_base_url() or None,
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=OPENAI_TEMPERATURE,
+                request_timeout=(OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT),
+                stream=True,
+            )
+            for chunk in chunks:
+                piece = chunk["choices"][0].get("delta", {}).get("content")
+                if piece:
+                    yield piece
+            return
+
+        raise RuntimeError("openai 패키지가 설치되어 있지 않습니다.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sdk": self.sdk,
+                "requests": self.requests,
+                "clients_created": self.clients_created,
+                "client_reuses": self.client_reuses,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def _llm_clients() -> LLMClientManager:
+    return LLMClientManager(OPENAI_SDK)
+
+
+LLM_CLIENTS = _llm_clients()
+
+
+def _warm_openai_sdk() -> None:
+    try:
+        import openai  # type: ignore  # noqa: F401
+        if OPENAI_SDK == "v1":
+            import httpx  # noqa: F401
+    except Exception:
+        pass
+
+
+@st.cache_resource(show_spinner=False)
+def warm_openai_sdk() -> Optional[threading.Thread]:
+    """openai SDK import(수백 ms)를 백그라운드에서 미리 해 둠 → 첫 생성 요청이 그 비용을 치르지 않음.
+    프로세스당 1회, 키가 없거나 SDK가 없으면 아무것도 안 함."""
+    if OPENAI_SDK == "none" or not _has_openai_key():
+        return None
+    th = threading.Thread(target=_warm_openai_sdk, name="openai-warmup", daemon=True)
+    th.start()
+    return th
+
+
+def chat_completion(
+    prompt: str,
+    key: Optional[str] = None,
+    json_mode: bool = False,
+    call: Optional[LLMCall] = None,
+    timeout: Optional[float] = None,
+) -> Optional[str]:
+    """LLM 1회 호출. 실패하면 예외를 그대로 올린다(재시도 판단은 호출 측).
+    call을 주면 시도 횟수/지연/토큰/오류 분류를 채움. timeout은 LLMClientManager.complete로 전달."""
+    if call is None:
+        return LLM_CLIENTS.complete(key or _get_openai_key(), prompt, json_mode=json_mode, timeout=timeout)
+    call.path = LLM_CLIENTS.sdk
+    call.attempts += 1
+    t0 = time.perf_counter()
+    try:
+        txt = LLM_CLIENTS.complete(key or _get_openai_key(), prompt, json_mode=json_mode, call=call, timeout=timeout)
+    except Exception as e:
+        call.error = classify_llm_error(e)
+        raise
+    finally:
+        call.latency_sec += time.perf_counter() - t0
+    call.error = "" if txt else "empty"
+    return txt
+
+
+def _call_openai_uncached(
+    prompt: str, key: Optional[str] = None, json_mode: bool = False, call: Optional[LLMCall] = None,
+) -> Optional[str]:
+    try:
+        return chat_completion(prompt, key, json_mode=json_mode, call=call)
     except Exception:
         return None
 
 
 # -----------------------------
-# 5) 폴백(규칙 기반) - P 누락 절대 방지 + 구체적 운동 제공
+# 4-2) LLM 응답 캐시(메모리 LRU + 디스크)
 # -----------------------------
-def fallback_generate(inp: SoapInput) -> str:
-    body = inp.body_part_free.strip() if inp.body_part == "기타(직접입력)" else inp.body_part
-    body = normalize_text(body) or "부위 불명"
+LLM_CACHE_DIR = os.path.join(DATA_DIR, "llm_cache")
+LLM_CACHE_MEM_ITEMS = 256
+LLM_CACHE_TTL_SEC = 7 * 24 * 3600  # 7일
+LLM_CACHE_MAX_BYTES = 50_000_000  # 디스크 50MB
+LLM_CACHE_EVICT_INTERVAL_SEC = 30.0  # 디스크 정리(전체 목록 조회)는 이 간격에 한 번만
+
+
+def response_cache_key(prompt: str, model: str, temperature: float, base_url: str) -> str:
+    """엔드포인트도 키에 포함: 스텁/다른 호환 서버에서 받은 응답이 실제 사용자에게 나가지 않도록."""
+    raw = json.dumps([base_url, model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """프롬프트 해시 → 응답 텍스트. 메모리(LRU)에 없으면 디스크(data/llm_cache)에서 찾는다."""
+
+    def __init__(self, cache_dir: str, mem_items: int, ttl_sec: float, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.mem_items = mem_items
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._last_evict = 0.0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, created: float, text: str) -> None:
+        self._mem[key] = (created, text)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None and now - item[0] <= self.ttl_sec:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return item[1]
+            self._mem.pop(key, None)
 
-    # S/O 재서술(복붙 느낌 최소화)
-    s = normalize_text(inp.s_text)
-    o = normalize_text(inp.o_text)
-    s_rs = f"환자는 {body} 부위와 관련하여 '{s[:80] + ('…' if len(s) > 80 else '')}'와 같은 불편을 호소한다."
-    o_rs = f"관찰/검사에서 '{o[:80] + ('…' if len(o) > 80 else '')}'와 같은 소견이 확인된다."
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                rec = json.load(f)
+            created, text = float(rec["created"]), str(rec["text"])
+        except Exception:
+            created, text = 0.0, ""
+        with self._lock:
+            if text and now - created <= self.ttl_sec:
+                self._remember(key, created, text)
+                self.hits_disk += 1
+                return text
+            self.misses += 1
+        return None
+
+    def put(self, key: str, text: str) -> None:
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, text)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "text": text}, f, ensure_ascii=False)
+            os.replace(tmp, self._path(key))
+            # 파일이 많으면 목록 조회/stat이 저장보다 훨씬 비싸므로 매번 하지 않음(한 스레드만)
+            with self._lock:
+                due = created - self._last_evict >= LLM_CACHE_EVICT_INTERVAL_SEC
+                if due:
+                    self._last_evict = created
+            if due:
+                self._evict_disk()
+        except Exception:
+            pass
+
+    def _evict_disk(self) -> None:
+        """만료 항목 삭제 후, 용량 초과 시 오래된 것부터 삭제."""
+        now = time.time()
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(".json"):
+                continue
+            p = os.path.join(self.cache_dir, fn)
+            try:
+                stt = os.stat(p)
+            except OSError:
+                continue
+            if now - stt.st_mtime > self.ttl_sec:
+                os.remove(p)
+            else:
+                entries.append((stt.st_mtime, stt.st_size, p))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(p)
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "mem_items": len(self._mem),
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def _response_cache() -> ResponseCache:
+    return ResponseCache(LLM_CACHE_DIR, LLM_CACHE_MEM_ITEMS, LLM_CACHE_TTL_SEC, LLM_CACHE_MAX_BYTES)
+
+
+RESPONSE_CACHE = _response_cache()
+
+
+# -----------------------------
+# 4-3) LLM 호출 기록(지연/토큰/오류 분류/폴백) - 모드별 비용·속도 조정용
+# -----------------------------
+LLM_TELEMETRY_KEEP = 2000  # 메모리에 남기는 최근 생성 수
+# data/llm_calls.jsonl에 생성마다 1줄(SOAP_LLM_LOG=0이면 메모리에만)
+LLM_TELEMETRY_LOG = os.getenv("SOAP_LLM_LOG", "1").strip().lower() not in ("0", "false", "no", "off")
+LLM_TELEMETRY_MAX_BYTES = 5_000_000
+
+
+class LLMTelemetry:
+    """LLMCall 링 버퍼 + (모드, 형식)별 집계."""
+
+    def __init__(self, keep: int, log_path: Optional[str]) -> None:
+        self.log_path = log_path
+        self._calls: "deque[Dict[str, Any]]" = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def record(self, call: LLMCall) -> None:
+        rec = asdict(call)
+        rec["ts"] = round(rec["ts"], 3)
+        with self._lock:
+            self._calls.append(rec)
+        if self.log_path:
+            append_jsonl(self.log_path, rec, LLM_TELEMETRY_MAX_BYTES)
+
+    def calls(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._calls)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """(모드, 형식)별: 생성 수, 실제 LLM 호출 수, 지연 p50/p95(초), 평균 토큰, 폴백/P 보완 비율, 오류 분류."""
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for c in self.calls():
+            groups.setdefault((c["mode"], c["fmt"]), []).append(c)
+        out = []
+        for (mode, fmt), cs in sorted(groups.items()):
+            sent = [c for c in cs if c["attempts"] > 0]
+            lat = sorted(c["latency_sec"] for c in sent)
+            pt = [c["prompt_tokens"] for c in sent if c["prompt_tokens"] is not None]
+            ct = [c["completion_tokens"] for c in sent if c["completion_tokens"] is not None]
+            # 추정/실제 토큰 비(1보다 크면 과대 추정)
+            ratio = [
+                c["est_prompt_tokens"] / c["prompt_tokens"]
+                for c in sent if c.get("est_prompt_tokens") and c["prompt_tokens"]
+            ]
+            errors: Dict[str, int] = {}
+            for c in cs:
+                if c["error"]:
+                    errors[c["error"]] = errors.get(c["error"], 0) + 1
+            out.append({
+                "mode": mode,
+                "fmt": fmt,
+                "generations": len(cs),
+                "llm_calls": len(sent),
+                "cache_hits": sum(1 for c in cs if c["path"] == "cache"),
+                "shared": sum(1 for c in cs if c["path"] == "shared"),
+                "throttled": sum(1 for c in cs if c["path"] == "throttled"),
+                "p50_sec": _percentile(lat, 0.5) if lat else None,
+                "p95_sec": _percentile(lat, 0.95) if lat else None,
+                "avg_prompt_tokens": sum(pt) / len(pt) if pt else None,
+                "avg_completion_tokens": sum(ct) / len(ct) if ct else None,
+                "total_tokens": sum(pt) + sum(ct),
+                "est_ratio": sum(ratio) / len(ratio) if ratio else None,
+                "truncated": sum(1 for c in cs if c.get("truncated")),
+                "fallback_rate": sum(1 for c in cs if c["fallback"]) / len(cs),
+                "p_patch_rate": sum(1 for c in cs if c["p_patched"]) / len(cs),
+                "errors": errors,
+            })
+        return out
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(c, ensure_ascii=False) + "\n" for c in self.calls())
+
+
+@st.cache_resource(show_spinner=False)
+def _llm_telemetry() -> LLMTelemetry:
+    return LLMTelemetry(LLM_TELEMETRY_KEEP, os.path.join(DATA_DIR, "llm_calls.jsonl") if LLM_TELEMETRY_LOG else None)
+
+
+LLM_TELEMETRY = _llm_telemetry()
+
+
+# -----------------------------
+# 4-4) 같은 요청 합치기(single-flight) + 호출 속도 제한(토큰 버킷)
+# -----------------------------
+LLM_RATE_PER_SEC = float(os.getenv("SOAP_LLM_RPS", "2"))  # 프로세스 전체 초당 LLM 호출
+LLM_RATE_BURST = int(os.getenv("SOAP_LLM_BURST", "5"))
+SESSION_RATE_PER_SEC = float(os.getenv("SOAP_SESSION_RPS", "0.2"))  # 세션(학생 1명)당: 기본 5초에 1회
+SESSION_RATE_BURST = int(os.getenv("SOAP_SESSION_BURST", "2"))
+LLM_QUEUE_MAX_WAIT_SEC = float(os.getenv("SOAP_LLM_MAX_WAIT_SEC", "15"))  # 이보다 오래 기다려야 하면 폴백
+SINGLE_FLIGHT_WAIT_SEC = OPENAI_CONNECT_TIMEOUT + OPENAI_READ_TIMEOUT  # 먼저 간 요청을 기다리는 최대 시간
+
+
+class _Flight:
+    __slots__ = ("key", "done", "result", "followers")
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """같은 프롬프트 요청이 동시에 여러 개면(더블 클릭, 같은 예제를 여러 학생이) LLM 호출은 1번만.
+    처음 온 요청(leader)이 호출하고, 나머지는 그 결과를 기다려 받는다(세션/스레드 무관)."""
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def join(self, key: str) -> Tuple[_Flight, bool]:
+        """(진행 중인 호출, 내가 leader인지). leader는 끝나면 반드시 finish()."""
+        with self._lock:
+            f = self._flights.get(key)
+            if f is None:
+                f = self._flights[key] = _Flight(key)
+                self.leaders += 1
+                return f, True
+            f.followers += 1
+            self.shared += 1
+            return f, False
+
+    def finish(self, key: str, flight: _Flight, result: Optional[str]) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.done.set()
+
+    def wait(self, flight: _Flight) -> Optional[str]:
+        """leader의 결과(시간 초과/실패면 None → 폴백). 시간 초과면 leader가 멈춘 것으로 보고
+        그 호출을 목록에서 빼서, 다음 같은 요청은 새로 호출하게 함."""
+        if not flight.done.wait(SINGLE_FLIGHT_WAIT_SEC):
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+        return flight.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._flights), "leaders": self.leaders, "shared": self.shared}
+
+
+class TokenBucket:
+    """초당 rate개, 최대 burst개. take()는 토큰이 모자라도 빚을 지고 가져감(→ 뒤 요청이 그만큼 줄 섬).
+    잠금은 쓰는 쪽이 잡는다(GenerationLimiter, batch.py의 asyncio 래퍼)."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wait_time(self, now: float) -> float:
+        """지금 1개를 가져가면 기다려야 하는 초."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class GenerationLimiter:
+    """프로세스 전체 + 세션별 토큰 버킷. 기다릴 시간이 max_wait 이하면 줄 서서 기다리고,
+    넘으면 바로 거절(호출 측은 fallback_generate). 대기열 길이/대기 시간을 집계."""
+
+    WAITS_KEPT = 500
+
+    def __init__(self, rate: float, burst: int, max_wait: float) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._waits: "deque[float]" = deque(maxlen=self.WAITS_KEPT)
+        self.queued = 0  # 지금 기다리는 요청 수
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def acquire(self, session: Optional[TokenBucket] = None) -> Tuple[bool, float]:
+        """(허용 여부, 기다린 초)."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.bucket.wait_time(now), session.wait_time(now) if session is not None else 0.0)
+            if wait > self.max_wait:
+                self.rejected += 1
+                return False, 0.0
+            self.bucket.take()
+            if session is not None:
+                session.take()
+            self.admitted += 1
+            if wait > 0:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+        if wait > 0:
+            time.sleep(wait)
+            with self._lock:
+                self.queued -= 1
+        with self._lock:
+            self._waits.append(wait)
+        return True, wait
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "wait_p50": _percentile(waits, 0.5) if waits else 0.0,
+                "wait_p95": _percentile(waits, 0.95) if waits else 0.0,
+            }
+
+
+def session_bucket() -> TokenBucket:
+    return TokenBucket(SESSION_RATE_PER_SEC, SESSION_RATE_BURST)
 
+
+@st.cache_resource(show_spinner=False)
+def _generation_gate() -> Tuple[SingleFlight, GenerationLimiter]:
+    return SingleFlight(), GenerationLimiter(LLM_RATE_PER_SEC, LLM_RATE_BURST, LLM_QUEUE_MAX_WAIT_SEC)
+
+
+SINGLE_FLIGHT, LLM_LIMITER = _generation_gate()
+
+
+def _admit(call: LLMCall, session: Optional[TokenBucket]) -> bool:
+    ok, wait = LLM_LIMITER.acquire(session)
+    call.queue_wait_sec += wait
+    if not ok:
+        call.path = "throttled"
+    return ok
+
+
+@profiled("call_openai")
+def call_openai(
+    prompt: str,
+    use_cache: bool = True,
+    json_mode: bool = False,
+    call: Optional[LLMCall] = None,
+    session: Optional[TokenBucket] = None,
+) -> Optional[str]:
+    """openai 패키지가 있으면 사용. 없거나 실패하면 None.
+    같은 프롬프트/모델/온도면 응답 캐시 사용(use_cache=False면 강제 재생성).
+    같은 요청이 이미 진행 중이면 그 결과를 함께 받고, 속도 제한에 걸리면 None(폴백)."""
+    call = call if call is not None else LLMCall()
+    api_key = _get_openai_key()
+    if not _valid_openai_key(api_key):
+        call.path = "no_key"
+        return None
+    key = response_cache_key(prompt, OPENAI_MODEL, OPENAI_TEMPERATURE, openai_base_url())
+    if use_cache:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            call.path = "cache"
+            return cached
+    flight, leader = SINGLE_FLIGHT.join(key)
+    if not leader:
+        call.path = "shared"
+        return SINGLE_FLIGHT.wait(flight)
+    txt: Optional[str] = None
+    try:
+        if _admit(call, session):
+            txt = _call_openai_uncached(prompt, api_key, json_mode=json_mode, call=call)
+            if txt:
+                RESPONSE_CACHE.put(key, txt)
+    finally:
+        SINGLE_FLIGHT.finish(key, flight, txt)
+    return txt
+
+
+class LLMUnavailable(RuntimeError):
+    """스트리밍 도중 LLM을 쓸 수 없게 됨(속도 제한/합친 요청 실패) → 호출 측 폴백."""
+
+
+def call_openai_stream(
+    prompt: str, use_cache: bool = True, call: Optional[LLMCall] = None, session: Optional[TokenBucket] = None,
+) -> Optional[Iterator[str]]:
+    """스트리밍 버전 call_openai. 키가 없으면 None, 캐시 적중이면 저장된 응답을 한 조각으로.
+    반복 중 실패하면 예외가 그대로 올라온다(호출 측에서 폴백).
+    같은 요청이 진행 중이면 끝날 때까지 기다렸다가 전체를 한 조각으로 받음."""
+    call = call if call is not None else LLMCall()
+    call.stream = True
+    api_key = _get_openai_key()
+    if not _valid_openai_key(api_key):
+        call.path = "no_key"
+        return None
+    key = response_cache_key(prompt, OPENAI_MODEL, OPENAI_TEMPERATURE, openai_base_url())
+    if use_cache:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            call.path = "cache"
+            return iter([cached])
+
+    # join은 반복을 시작할 때: 만들고 돌리지 않은 스트림이 finish 없이 호출을 붙잡아 두지 않도록
+    def run() -> Iterator[str]:
+        flight, leader = SINGLE_FLIGHT.join(key)
+        yield from (lead(flight) if leader else follow(flight))
+
+    def follow(flight: _Flight) -> Iterator[str]:
+        call.path = "shared"
+        txt = SINGLE_FLIGHT.wait(flight)
+        if not txt:
+            raise LLMUnavailable("함께 기다린 요청이 실패했습니다.")
+        yield txt
+
+    def lead(flight: _Flight) -> Iterator[str]:
+        parts: List[str] = []
+        txt: Optional[str] = None
+        try:
+            # 대기(속도 제한)도 반복 안에서 → 화면에는 "생성 중" 표시가 먼저 나감
+            if not _admit(call, session):
+                raise LLMUnavailable("요청이 많아 규칙 기반으로 작성합니다.")
+            call.path = LLM_CLIENTS.sdk
+            call.attempts += 1
+            t0 = time.perf_counter()
+            try:
+                for piece in LLM_CLIENTS.stream(api_key, prompt, call=call):
+                    if not parts:
+                        call.ttfc_sec = time.perf_counter() - t0
+                    parts.append(piece)
+                    yield piece
+            except Exception as e:
+                call.error = classify_llm_error(e)
+                raise
+            finally:
+                call.latency_sec += time.perf_counter() - t0
+            txt = "".join(parts) or None
+            if txt:
+                RESPONSE_CACHE.put(key, txt)
+            else:
+                call.error = "empty"
+        finally:
+            # 중간에 실패/중단돼도 기다리는 요청이 멈춰 있지 않도록
+            SINGLE_FLIGHT.finish(key, flight, txt)
+
+    return run()
+
+
+# -----------------------------
+# 5) 폴백(규칙 기반) - P 누락 절대 방지 + 구체적 운동 제공
+# -----------------------------
+def _fallback_assessment_uncached(body: str, barriers: Tuple[str, ...]) -> str:
     # 간단 A(단정 피하고 근거 기반)
+    joined = " ".join(barriers)
     a_lines = [
         f"{body} 통증/불편으로 기능적 움직임 수행에 제한이 의심된다.",
     ]
-    if "ROM" in " ".join(inp.barriers) or "가동" in " ".join(inp.barriers):
+    if "ROM" in joined or "가동" in joined:
         a_lines.append("관절가동범위 제한 및 통증 회피 패턴이 가능하다.")
-    if "근력" in " ".join(inp.barriers) or "근지구력" in " ".join(inp.barriers):
+    if "근력" in joined or "근지구력" in joined:
         a_lines.append("근력/근지구력 저하로 부하 내성이 낮아졌을 수 있다.")
-    if "정렬" in " ".join(inp.barriers) or "자세" in " ".join(inp.barriers):
+    if "정렬" in joined or "자세" in joined:
         a_lines.append("정렬/자세 요인이 증상 지속에 기여했을 가능성이 있다.")
-    a = " ".join(a_lines)
+    return " ".join(a_lines)
+
+
+@st.cache_resource(show_spinner=False)
+def _fallback_assessment_cache() -> Callable[[str, Tuple[str, ...]], str]:
+    # rerun마다 비워지지 않도록 프로세스 단위로 보관
+    return lru_cache(maxsize=1024)(_fallback_assessment_uncached)
+
+
+_fallback_assessment = _fallback_assessment_cache()
+
+
+def fallback_sections(inp: SoapInput, only: Sequence[str] = ("S", "O", "A", "P")) -> Dict[str, str]:
+    """규칙 기반 S/O/A/P 중 필요한 것만 생성(P는 "- 항목" 줄 목록)."""
+    body = inp.body_part_free.strip() if inp.body_part == "기타(직접입력)" else inp.body_part
+    body = normalize_text(body) or "부위 불명"
+    out: Dict[str, str] = {}
+
+    # S/O 재서술(복붙 느낌 최소화)
+    if "S" in only:
+        s = normalize_text(inp.s_text)
+        out["S"] = f"환자는 {body} 부위와 관련하여 '{s[:80] + ('…' if len(s) > 80 else '')}'와 같은 불편을 호소한다."
+    if "O" in only:
+        o = normalize_text(inp.o_text)
+        out["O"] = f"관찰/검사에서 '{o[:80] + ('…' if len(o) > 80 else '')}'와 같은 소견이 확인된다."
+
+    if "A" in only:
+        out["A"] = _fallback_assessment(body, tuple(inp.barriers))
 
     # 부위별 구체 P 템플릿 (너무 위험한 의료행위 지시는 피하고, 교육용/임상 검토 전제로)
-    P = build_specific_plan(inp, body)
+    if "P" in only:
+        out["P"] = "\n".join([f"- {line}" for line in build_specific_plan(inp, body)])
 
-    return f"S:\n{s_rs}\n\nO:\n{o_rs}\n\nA:\n{a}\n\nP:\n" + "\n".join([f"- {line}" for line in P])
+    return out
 
 
-def build_specific_plan(inp: SoapInput, body: str) -> List[str]:
-    mode = inp.mode
-    barriers = set(inp.barriers or [])
-    stim = inp.stimulus
-
-    # 강도/볼륨 가이드(대략)
-    if stim == "높음":
-        vol = "통증 0~3/10 범위에서"
-        prog = "통증/야간통/다음날 악화 여부를 기준으로 진행"
-    elif stim == "낮음":
-        vol = "통증 허용 범위 내(0~4/10)에서"
-        prog = "피로감은 허용하되 통증 급증/야간통은 피하며 진행"
-    else:
-        vol = "통증 허용 범위 내에서"
-        prog = "증상 반응(당일/다음날)을 기준으로 점진적 진행"
-
-    # 공통 계획
-    base = [
-        f"교육: 증상 유발 동작/부하 조절(특히 통증 악화 자세·반복 동작 회피), {prog}.",
-        f"자가관리: 온열/냉각은 본인 선호 및 반응에 따라 선택(피부 상태 확인).",
-        f"재평가: {inp.follow_up} 후 통증(강도/빈도), 기능, ROM/근력 변화로 계획 조정.",
-    ]
+def fallback_generate(inp: SoapInput) -> str:
+    fb = fallback_sections(inp)
+    return f"S:\n{fb['S']}\n\nO:\n{fb['O']}\n\nA:\n{fb['A']}\n\nP:\n{fb['P']}"
+
+
+# 부위별 P 템플릿 레지스트리(임포트 시 1회 정리/컴파일)
+# - aliases: 부위 표기(동의어). 입력 부위 문자열에서 가장 긴 표기를 우선 인식(예: "발목"은 "목"이 아니라 발목)
+#   기존 부위 판정과 같게 유지하고, 바꾼 것은 발목/손목/슬관절뿐(표기를 늘리면 자유 입력 결과가 바뀜)
+# - exercises: 기본 운동 세트({vol} = 자극감도별 강도 문구)
+# - barrier_additions: 선택한 장애요인이 있을 때 추가
+# - detail_additions: "상세" 모드에서 추가
+PLAN_REGIONS: Dict[str, Dict[str, Any]] = {
+    "shoulder": {
+        "aliases": ["어깨", "견"],
+        "exercises": [
+            "관절가동범위(ROM) 회복: 펜듈럼(코드만) 1~2분 × 2세트, 테이블/벽 슬라이드 10~12회 × 2세트, {vol}.",
+            "회전근개 등척성: 문틀/수건 이용 외회전·내회전 등척 5~10초 유지 × 8~10회 × 2세트(통증 없는 각도).",
+            "견갑 안정화: 견갑골 후인/하강(스캡 셋) 5초 × 10회 × 2세트 → 탄성밴드 로우 12회 × 2~3세트.",
+            "어깨 굴곡/외전 진행: 벽슬라이드 → 스틱 AAROM → 통증 허용 시 덤벨 프론트/레터럴 레이즈(가벼운 중량) 8~12회 × 2~3세트.",
+            "상지 기능 통합: 벽 푸시업+ 8~12회 × 2세트(견갑 전인 포함) → 점진적으로 난이도 상승.",
+        ],
+        "barrier_additions": {
+            "통증(부하 민감)": ["통증 조절 우선: 과부하 동작(오버헤드 반복, 고중량 프레스)은 일시 제한하고, 통증 없는 범위에서 노출을 단계적으로 증가."],
+        },
+        "detail_additions": [
+            "진행 기준(예): 외전 90°에서 통증 3/10 이하 + 다음날 악화 없음 → 외전 범위/부하 10~20% 증가.",
+            "스캡/흉추 보완: 폼롤러 흉추 신전 6~8회 × 2세트, 견갑면 거상 시 상부승모 과활성 시 큐잉(목 힘 빼고 하부승모/전거근 활성).",
+        ],
+    },
+    "neck": {
+        "aliases": ["목", "경추"],
+        "exercises": [
+            "자세/부하 교육: 화면 높이·턱 내밀기 감소, 30~40분마다 1~2분 휴식.",
+            "심부경부굴곡근 운동: 턱 당기기(치킨턱) 5초 × 10회 × 2세트 → 누워서 압력바이오피드백(가능 시) 22~26mmHg 단계.",
+            "견갑 안정화: 밴드 로우 12회 × 2~3세트 + Y/T(가벼운 강도) 8~10회 × 2세트.",
+            "가동성: 상부승모/견갑거근 스트레칭 20~30초 × 2~3회(통증 유발 금지), 흉추 회전 운동 8회 × 2세트.",
+        ],
+        "detail_additions": [
+            "두통/방사통/신경학적 증상 동반 시: 신경학적 스크리닝(감각/근력/반사) 및 의뢰 기준 확인(악화/야간통/진행성 저림 등).",
+        ],
+    },
+    "lowback": {
+        "aliases": ["허리", "요추"],
+        "exercises": [
+            "가동성/통증완화: 맥켄지(신전 선호 시) 프론프레스업 8~10회 × 2세트 또는 캣카우 8~10회 × 2세트, {vol}.",
+            "코어 안정화: 데드버그 6~10회 × 2~3세트, 버드독 6~10회 × 2~3세트(허리 꺾임 방지).",
+            "둔근 강화: 글루트 브리지 10~12회 × 2~3세트 → 밴드 몬스터 워크 10m × 3회.",
+            "기능 훈련: 힙힌지 패턴(막대기) 8~10회 × 2세트 → 통증 허용 시 스쿼트 범위 점진 확대.",
+        ],
+        "detail_additions": [
+            "진행 기준(예): 일상 동작(앉기/서기) 통증 3/10 이하 + 다음날 악화 없음 → 저항/반복 10~20% 증가, 고난도(데드리프트 패턴)로 단계화.",
+        ],
+    },
+    "knee": {
+        "aliases": ["무릎", "슬관절"],
+        "exercises": [
+            "ROM/부종 관리(필요 시): 무릎 굴곡 AAROM 10회 × 2세트, 슬개골 주변 가벼운 가동(통증 없는 범위).",
+            "대퇴사두/둔근 강화: 쿼드셋 5초 × 10회 × 2세트 → 미니 스쿼트 8~12회 × 2~3세트.",
+            "힙/무릎 정렬: 클램셸 12회 × 2~3세트 + 사이드 스텝(밴드) 10m × 3회.",
+            "기능: 스텝업(낮은 높이) 8~10회 × 2세트 → 통증 허용 시 높이/부하 점진 증가.",
+        ],
+        "detail_additions": [
+            "통증 위치(전방/내측/외측)에 따라 부하 조절(예: 전방 통증이면 깊은 굴곡 스쿼트 일시 제한, 힙 힌지 비중↑).",
+        ],
+    },
+    "ankle": {
+        "aliases": ["발목", "발/", "발가락"],
+        "exercises": [
+            "ROM: 발목 펌프/원 그리기 20~30회 × 2세트, 무릎-벽(DF) 테스트 겸 스트레치 8~10회 × 2세트.",
+            "근력: 밴드 저항 PF/DF/EV/IV 12회 × 2~3세트.",
+            "균형/고유수용감각: 한발서기 20~30초 × 3회 → 쿠션 위/눈 감기 등 단계화.",
+            "기능: 카프 레이즈 8~12회 × 2~3세트(가능 시) → 보행/계단 노출 점진 증가.",
+        ],
+        "detail_additions": [
+            "재부상 예방: 점프/컷팅 복귀 전(통증 0~2/10, 좌우 카프 레이즈 반복수 차이 <10%, Y-balance/홉 테스트 단계 통과) 같은 기준을 설정.",
+        ],
+    },
+    # 기타/미분류: 범용 템플릿("손목"처럼 다른 부위 표기를 품은 말이 엉뚱한 부위로 가지 않게 별칭만 등록)
+    "generic": {
+        "aliases": ["손목"],
+        "exercises": [
+            "ROM: 통증 없는 범위에서 AAROM 10~12회 × 2세트, {vol}.",
+            "근력: 해당 부위 저항운동(밴드/가벼운 중량) 8~12회 × 2~3세트.",
+            "안정화/조절: 자세 큐잉 + 천천히(3초 이완) 수행, 보상동작 최소화.",
+        ],
+        "detail_additions": [
+            "진행 기준: 통증/피로 반응(당일/다음날), 기능 점수(예: 동작 수행 가능 범위)로 단계적 증량(10~20%).",
+        ],
+    },
+}
+# 여러 부위가 함께 적힌 경우 우선순위(앞쪽 우선)
+PLAN_REGION_ORDER = ["shoulder", "neck", "lowback", "knee", "ankle", "generic"]
 
-    # 부위별 운동 세트(구체)
-    body_lower = body.replace(" ", "")
-    is_shoulder = any(k in body_lower for k in ["어깨", "견"])
-    is_neck = "목" in body_lower or "경추" in body_lower
-    is_lowback = any(k in body_lower for k in ["허리", "요추"])
-    is_knee = "무릎" in body_lower
-    is_ankle = "발목" in body_lower or "발/" in body_lower or "발가락" in body_lower
-
-    plan: List[str] = []
-
-    # 치료 빈도 반영
-    plan.append(f"치료/세션: {inp.treat_freq} 내원 기준, 홈운동 {inp.exer_freq} 권장(불가 시 최소 주 3회).")
-
-    # 장애요인 반영(ROM/근력/통증/정렬)
-    if is_shoulder:
-        plan += [
-            f"관절가동범위(ROM) 회복: 펜듈럼(코드만) 1~2분 × 2세트, 테이블/벽 슬라이드 10~12회 × 2세트, {vol}.",
-            f"회전근개 등척성: 문틀/수건 이용 외회전·내회전 등척 5~10초 유지 × 8~10회 × 2세트(통증 없는 각도).",
-            f"견갑 안정화: 견갑골 후인/하강(스캡 셋) 5초 × 10회 × 2세트 → 탄성밴드 로우 12회 × 2~3세트.",
-            f"어깨 굴곡/외전 진행: 벽슬라이드 → 스틱 AAROM → 통증 허용 시 덤벨 프론트/레터럴 레이즈(가벼운 중량) 8~12회 × 2~3세트.",
-            f"상지 기능 통합: 벽 푸시업+ 8~12회 × 2세트(견갑 전인 포함) → 점진적으로 난이도 상승.",
-        ]
-        if "통증(부하 민감)" in barriers:
-            plan.append("통증 조절 우선: 과부하 동작(오버헤드 반복, 고중량 프레스)은 일시 제한하고, 통증 없는 범위에서 노출을 단계적으로 증가.")
-        if mode == "상세":
-            plan += [
-                "진행 기준(예): 외전 90°에서 통증 3/10 이하 + 다음날 악화 없음 → 외전 범위/부하 10~20% 증가.",
-                "스캡/흉추 보완: 폼롤러 흉추 신전 6~8회 × 2세트, 견갑면 거상 시 상부승모 과활성 시 큐잉(목 힘 빼고 하부승모/전거근 활성).",
-            ]
+# 자극감도별 강도/진행 문구
+PLAN_VOLUME_RULES: Dict[str, Tuple[str, str]] = {
+    "높음": ("통증 0~3/10 범위에서", "통증/야간통/다음날 악화 여부를 기준으로 진행"),
+    "낮음": ("통증 허용 범위 내(0~4/10)에서", "피로감은 허용하되 통증 급증/야간통은 피하며 진행"),
+}
+PLAN_VOLUME_DEFAULT = ("통증 허용 범위 내에서", "증상 반응(당일/다음날)을 기준으로 점진적 진행")
+
+# 공통 계획(앞: 치료 빈도, 뒤: 교육/자가관리/재평가)
+PLAN_HEAD = ["치료/세션: {treat_freq} 내원 기준, 홈운동 {exer_freq} 권장(불가 시 최소 주 3회)."]
+PLAN_TAIL = [
+    "교육: 증상 유발 동작/부하 조절(특히 통증 악화 자세·반복 동작 회피), {prog}.",
+    "자가관리: 온열/냉각은 본인 선호 및 반응에 따라 선택(피부 상태 확인).",
+    "재평가: {follow_up} 후 통증(강도/빈도), 기능, ROM/근력 변화로 계획 조정.",
+]
+PLAN_SUBMIT_MAX_LINES = 9  # "제출용"은 핵심 6~9줄로 유지
 
-    elif is_neck:
-        plan += [
-            f"자세/부하 교육: 화면 높이·턱 내밀기 감소, 30~40분마다 1~2분 휴식.",
-            f"심부경부굴곡근 운동: 턱 당기기(치킨턱) 5초 × 10회 × 2세트 → 누워서 압력바이오피드백(가능 시) 22~26mmHg 단계.",
-            f"견갑 안정화: 밴드 로우 12회 × 2~3세트 + Y/T(가벼운 강도) 8~10회 × 2세트.",
-            f"가동성: 상부승모/견갑거근 스트레칭 20~30초 × 2~3회(통증 유발 금지), 흉추 회전 운동 8회 × 2세트.",
-        ]
-        if mode == "상세":
-            plan.append("두통/방사통/신경학적 증상 동반 시: 신경학적 스크리닝(감각/근력/반사) 및 의뢰 기준 확인(악화/야간통/진행성 저림 등).")
-
-    elif is_lowback:
-        plan += [
-            f"가동성/통증완화: 맥켄지(신전 선호 시) 프론프레스업 8~10회 × 2세트 또는 캣카우 8~10회 × 2세트, {vol}.",
-            f"코어 안정화: 데드버그 6~10회 × 2~3세트, 버드독 6~10회 × 2~3세트(허리 꺾임 방지).",
-            f"둔근 강화: 글루트 브리지 10~12회 × 2~3세트 → 밴드 몬스터 워크 10m × 3회.",
-            f"기능 훈련: 힙힌지 패턴(막대기) 8~10회 × 2세트 → 통증 허용 시 스쿼트 범위 점진 확대.",
-        ]
-        if mode == "상세":
-            plan.append("진행 기준(예): 일상 동작(앉기/서기) 통증 3/10 이하 + 다음날 악화 없음 → 저항/반복 10~20% 증가, 고난도(데드리프트 패턴)로 단계화.")
-
-    elif is_knee:
-        plan += [
-            f"ROM/부종 관리(필요 시): 무릎 굴곡 AAROM 10회 × 2세트, 슬개골 주변 가벼운 가동(통증 없는 범위).",
-            f"대퇴사두/둔근 강화: 쿼드셋 5초 × 10회 × 2세트 → 미니 스쿼트 8~12회 × 2~3세트.",
-            f"힙/무릎 정렬: 클램셸 12회 × 2~3세트 + 사이드 스텝(밴드) 10m × 3회.",
-            f"기능: 스텝업(낮은 높이) 8~10회 × 2세트 → 통증 허용 시 높이/부하 점진 증가.",
-        ]
-        if mode == "상세":
-            plan.append("통증 위치(전방/내측/외측)에 따라 부하 조절(예: 전방 통증이면 깊은 굴곡 스쿼트 일시 제한, 힙 힌지 비중↑).")
-
-    elif is_ankle:
-        plan += [
-            f"ROM: 발목 펌프/원 그리기 20~30회 × 2세트, 무릎-벽(DF) 테스트 겸 스트레치 8~10회 × 2세트.",
-            f"근력: 밴드 저항 PF/DF/EV/IV 12회 × 2~3세트.",
-            f"균형/고유수용감각: 한발서기 20~30초 × 3회 → 쿠션 위/눈 감기 등 단계화.",
-            f"기능: 카프 레이즈 8~12회 × 2~3세트(가능 시) → 보행/계단 노출 점진 증가.",
-        ]
-        if mode == "상세":
-            plan.append("재부상 예방: 점프/컷팅 복귀 전(통증 0~2/10, 좌우 카프 레이즈 반복수 차이 <10%, Y-balance/홉 테스트 단계 통과) 같은 기준을 설정.")
 
-    else:
-        # 기타/미분류: 범용 템플릿
-        plan += [
-            f"ROM: 통증 없는 범위에서 AAROM 10~12회 × 2세트, {vol}.",
-            f"근력: 해당 부위 저항운동(밴드/가벼운 중량) 8~12회 × 2~3세트.",
-            f"안정화/조절: 자세 큐잉 + 천천히(3초 이완) 수행, 보상동작 최소화.",
-        ]
-        if mode == "상세":
-            plan.append("진행 기준: 통증/피로 반응(당일/다음날), 기능 점수(예: 동작 수행 가능 범위)로 단계적 증량(10~20%).")
+class _PlanLine:
+    """템플릿 한 줄. 치환값이 없는 줄은 임포트 시 미리 정리(normalize)해 둔다."""
+
+    __slots__ = ("template", "static")
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.static = None if "{" in template else normalize_text(template)
+
+    def render(self, values: Dict[str, str]) -> str:
+        if self.static is not None:
+            return self.static
+        return normalize_text(self.template.format(**values))
+
+
+def _compile_lines(lines: List[str]) -> Tuple[_PlanLine, ...]:
+    return tuple(_PlanLine(x) for x in lines)
+
+
+_PLAN_HEAD = _compile_lines(PLAN_HEAD)
+_PLAN_TAIL = _compile_lines(PLAN_TAIL)
+_PLAN_COMPILED: Dict[str, Dict[str, Any]] = {
+    name: {
+        "exercises": _compile_lines(r["exercises"]),
+        "barrier_additions": tuple((b, _compile_lines(lines)) for b, lines in r.get("barrier_additions", {}).items()),
+        "detail_additions": _compile_lines(r.get("detail_additions", [])),
+    }
+    for name, r in PLAN_REGIONS.items()
+}
+
 
+def _build_alias_trie() -> Dict[str, Any]:
+    """부위 표기 트라이. 끝 노드의 "$" = 부위 이름."""
+    root: Dict[str, Any] = {}
+    for name in PLAN_REGION_ORDER:
+        for alias in PLAN_REGIONS[name]["aliases"]:
+            node = root
+            for ch in alias:
+                node = node.setdefault(ch, {})
+            node.setdefault("$", name)
+    return root
+
+
+_ALIAS_TRIE = _build_alias_trie()
+_REGION_RANK = {name: i for i, name in enumerate(PLAN_REGION_ORDER)}
+
+
+def _resolve_body_region(body: str) -> str:
+    """부위 문자열 → 템플릿 부위 이름. 왼쪽부터 가장 긴 표기를 인식하고, 여러 개면 우선순위 높은 쪽."""
+    text = body.replace(" ", "")
+    found: List[str] = []
+    i = 0
+    while i < len(text):
+        node = _ALIAS_TRIE
+        match_name, match_end = None, i
+        j = i
+        while j < len(text) and text[j] in node:
+            node = node[text[j]]
+            j += 1
+            if "$" in node:
+                match_name, match_end = node["$"], j
+        if match_name is not None:
+            found.append(match_name)
+            i = match_end
+        else:
+            i += 1
+    if not found:
+        return "generic"
+    return min(found, key=_REGION_RANK.__getitem__)
+
+
+@st.cache_resource(show_spinner=False)
+def _region_cache() -> Callable[[str], str]:
+    # 모듈 전역 lru_cache는 rerun마다 비워지므로 프로세스 단위로 보관(_plan_cache도 같음)
+    return lru_cache(maxsize=1024)(_resolve_body_region)
+
+
+resolve_body_region = _region_cache()
+
+
+def _build_plan(
+    body: str,
+    mode: str,
+    stimulus: str,
+    barriers: frozenset,
+    treat_freq: str,
+    exer_freq: str,
+    follow_up: str,
+) -> Tuple[str, ...]:
+    vol, prog = PLAN_VOLUME_RULES.get(stimulus, PLAN_VOLUME_DEFAULT)
+    values = {
+        "vol": vol,
+        "prog": prog,
+        "treat_freq": treat_freq,
+        "exer_freq": exer_freq,
+        "follow_up": follow_up,
+    }
+    region = _PLAN_COMPILED[resolve_body_region(body)]
+
+    lines: List[_PlanLine] = list(_PLAN_HEAD)
+    lines += region["exercises"]
+    for barrier, extra in region["barrier_additions"]:
+        if barrier in barriers:
+            lines += extra
+    if mode == "상세":
+        lines += region["detail_additions"]
     # 마지막에 공통/안전/추적 추가
-    plan += base
+    lines += _PLAN_TAIL
 
     # “제출용”은 너무 길어지지 않게 컷(하지만 구체성은 유지)
     if mode == "제출용":
-        # 핵심 6~9줄로 유지
-        if len(plan) > 9:
-            plan = plan[:9]
+        lines = lines[:PLAN_SUBMIT_MAX_LINES]
 
     # 최종 정리(금칙어 방지)
-    plan = [normalize_text(x) for x in plan if normalize_text(x)]
-    return plan
+    rendered = (x.render(values) for x in lines)
+    return tuple(x for x in rendered if x)
+
+
+@st.cache_resource(show_spinner=False)
+def _plan_cache() -> Callable[..., Tuple[str, ...]]:
+    return lru_cache(maxsize=4096)(_build_plan)
+
+
+_build_plan_cached = _plan_cache()
+
+
+def build_specific_plan(inp: SoapInput, body: str) -> List[str]:
+    return list(_build_plan_cached(
+        body,
+        inp.mode,
+        inp.stimulus,
+        frozenset(inp.barriers or []),
+        inp.treat_freq,
+        inp.exer_freq,
+        inp.follow_up,
+    ))
+
+
+class SoapStreamParser:
+    """스트리밍 응답에서 S/O/A/P 라벨 위치를 새로 들어온 부분만 훑어 갱신.
+    구간 규칙은 parse_soap과 같음(라벨 첫 위치 ~ 그 뒤 첫 다음 라벨). 정리(normalize)는 마지막에 한 번."""
+
+    LABELS = ("S", "O", "A", "P")
+
+    def __init__(self) -> None:
+        self.text = ""
+        self._scanned = 0
+        self._pos: Dict[str, List[int]] = {k: [] for k in self.LABELS}
+
+    def feed(self, piece: str) -> None:
+        self.text += piece
+        t = self.text
+        # "S" 와 ":" 가 서로 다른 조각으로 올 수 있어 1글자 겹쳐서 확인
+        i = max(0, self._scanned - 1)
+        while True:
+            j = t.find(":", i)
+            if j < 0:
+                break
+            if j > 0 and t[j - 1] in self._pos and (j - 1) >= max(0, self._scanned - 1):
+                self._pos[t[j - 1]].append(j - 1)
+            i = j + 1
+        self._scanned = len(t)
+
+    def sections(self) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        for n, label in enumerate(self.LABELS):
+            if not self._pos[label]:
+                out[label] = ""
+                continue
+            start = self._pos[label][0] + 2
+            end = len(self.text)
+            for nl in self.LABELS[n + 1:]:
+                for p in self._pos[nl]:
+                    if p >= start:
+                        end = min(end, p)
+                        break
+            out[label] = self.text[start:end].strip()
+        return out
 
 
 def parse_soap(text: str) -> Dict[str, str]:
@@ -525,6 +3015,418 @@ def ensure_p_not_empty(inp: SoapInput, soap: Dict[str, str]) -> Dict[str, str]:
     return soap
 
 
+def soap_from_text(inp: SoapInput, txt: str) -> Dict[str, str]:
+    """LLM/폴백 응답 → 최종 S/O/A/P(P 누락 방지 + 금칙어 최종 정리)."""
+    soap = parse_soap(txt)
+    soap = ensure_p_not_empty(inp, soap)
+    # 금칙어 최종 방지(출력 전 마지막 정리)
+    return {k: normalize_text(v) for k, v in soap.items()}
+
+
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_soap_json(text: str) -> Tuple[Dict[str, str], List[str]]:
+    """구조화(JSON) 응답 검증: S/O/A는 비어 있지 않은 문자열, P는 비어 있지 않은 항목 배열.
+    (통과한 필드의 S/O/A/P, 검증 실패 필드 목록) 반환."""
+    t = _JSON_FENCE_RE.sub("", (text or "").strip())
+    try:
+        obj = json.loads(t, strict=False)
+    except ValueError:
+        i, j = t.find("{"), t.rfind("}")
+        try:
+            obj = json.loads(t[i:j + 1], strict=False) if 0 <= i < j else None
+        except ValueError:
+            obj = None
+    if not isinstance(obj, dict):
+        return {}, ["S", "O", "A", "P"]
+
+    soap: Dict[str, str] = {}
+    failed: List[str] = []
+    for k in ("S", "O", "A"):
+        v = obj.get(k)
+        if isinstance(v, str) and v.strip():
+            soap[k] = v.strip()
+        else:
+            failed.append(k)
+
+    v = obj.get("P")
+    if isinstance(v, str):
+        items = [line.strip().lstrip("-•").strip() for line in v.splitlines()]
+    elif isinstance(v, list):
+        items = [str(x).strip().lstrip("-•").strip() for x in v if isinstance(x, (str, int, float))]
+    else:
+        items = []
+    items = [x for x in items if x]
+    if items:
+        soap["P"] = "\n".join(f"- {x}" for x in items)
+    else:
+        failed.append("P")
+    return soap, failed
+
+
+def soap_from_json(inp: SoapInput, txt: str) -> Tuple[Dict[str, str], List[str]]:
+    """구조화 응답 → 최종 S/O/A/P. 검증 실패한 필드만 규칙 기반으로 채움(전체 재생성 없음).
+    (결과, 채운 필드 목록) 반환."""
+    soap, failed = parse_soap_json(txt)
+    if failed:
+        soap.update(fallback_sections(inp, only=failed))
+    return {k: normalize_text(soap[k]) for k in ("S", "O", "A", "P")}, failed
+
+
+class GenerationStats:
+    """출력 형식(text/json)별 결과 집계: llm(그대로 사용) / repaired(일부 보완) / fallback(전체 폴백)."""
+
+    OUTCOMES = ("llm", "repaired", "fallback")
+
+    def __init__(self) -> None:
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, fmt: str, outcome: str) -> None:
+        with self._lock:
+            c = self._counts.setdefault(fmt, {k: 0 for k in self.OUTCOMES})
+            c[outcome] = c.get(outcome, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out: Dict[str, Dict[str, float]] = {}
+            for fmt, c in self._counts.items():
+                total = sum(c.values())
+                out[fmt] = {
+                    "total": total,
+                    **{k: c[k] for k in self.OUTCOMES},
+                    "fallback_rate": c["fallback"] / total if total else 0.0,
+                    "repair_rate": c["repaired"] / total if total else 0.0,
+                }
+            return out
+
+
+@st.cache_resource(show_spinner=False)
+def _generation_stats() -> GenerationStats:
+    return GenerationStats()
+
+
+GENERATION_STATS = _generation_stats()
+
+
+@profiled("finish_generation")
+def finish_generation(
+    inp: SoapInput,
+    txt: Optional[str],
+    json_mode: bool = False,
+    call: Optional[LLMCall] = None,
+    draft: Optional[Dict[str, str]] = None,
+) -> Tuple[Dict[str, str], str]:
+    """LLM 응답(None이면 폴백) → 최종 S/O/A/P와 결과 구분("llm" | "repaired" | "fallback").
+    call을 주면 결과를 채워 LLM_TELEMETRY에 기록. draft(미리 만든 폴백 초안)가 있으면 폴백 때 그대로 사용."""
+    p_patched = False
+    if txt is None:
+        soap = dict(draft) if draft is not None else soap_from_text(inp, fallback_generate(inp))
+        outcome = "fallback"
+    elif json_mode:
+        soap, failed = soap_from_json(inp, txt)
+        # 네 필드 모두 실패(JSON 파싱 불가 등)면 사실상 전체 폴백
+        outcome = "fallback" if len(failed) == 4 else ("repaired" if failed else "llm")
+        p_patched = "P" in failed
+    else:
+        parsed = parse_soap(txt)
+        p_patched = not parsed.get("P", "").strip()
+        outcome = "repaired" if p_patched else "llm"
+        soap = {k: normalize_text(v) for k, v in ensure_p_not_empty(inp, parsed).items()}
+    fmt = "json" if json_mode else "text"
+    GENERATION_STATS.record(fmt, outcome)
+    if call is not None:
+        call.mode = call.mode or inp.mode
+        call.fmt = fmt
+        call.outcome = outcome
+        call.fallback = outcome == "fallback"
+        call.p_patched = p_patched
+        LLM_TELEMETRY.record(call)
+    return soap, outcome
+
+
+# -----------------------------
+# 5-1) 입력 지문(같은 입력이면 다시 생성하지 않음) + 규칙 기반 초안 미리 만들기
+# -----------------------------
+DRAFT_CACHE_ITEMS = 256
+DRAFT_WORKERS = 2
+
+
+def input_fingerprint(inp: SoapInput) -> str:
+    """정리된 SoapInput 전체의 해시(모드/부위/선택지/장애요인 순서까지 포함)."""
+    raw = json.dumps(asdict(inp), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def generation_key(inp: SoapInput, json_mode: bool) -> str:
+    """같은 결과를 기대할 수 있는 생성 조건(입력 + 출력 형식)."""
+    return f"{input_fingerprint(inp)}:{'json' if json_mode else 'text'}"
+
+
+class DraftPrecomputer:
+    """S/O가 채워지면 fallback_generate 초안을 백그라운드에서 미리 만들어 둠(입력 지문별, 프로세스 공유).
+    생성 버튼을 누르면 LLM 결과를 기다리는 동안 이 초안을 바로 보여주고, 폴백이면 그대로 결과로 씀."""
+
+    def __init__(self, max_items: int, workers: int) -> None:
+        self.max_items = max_items
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="soap-draft")
+        self._drafts: "OrderedDict[str, Future[Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.hits = 0
+
+    @staticmethod
+    def _make(inp: SoapInput) -> Dict[str, str]:
+        return soap_from_text(inp, fallback_generate(inp))
+
+    def _future(self, inp: SoapInput, fp: str) -> "Future[Dict[str, str]]":
+        with self._lock:
+            fut = self._drafts.get(fp)
+            if fut is not None:
+                self._drafts.move_to_end(fp)
+                return fut
+            fut = self._pool.submit(self._make, inp)
+            self._drafts[fp] = fut
+            self.submitted += 1
+            while len(self._drafts) > self.max_items:
+                self._drafts.popitem(last=False)
+            return fut
+
+    def prefetch(self, inp: SoapInput) -> None:
+        if inp.s_text.strip() and inp.o_text.strip():
+            self._future(inp, input_fingerprint(inp))
+
+    def get(self, inp: SoapInput) -> Dict[str, str]:
+        """초안(아직 안 끝났으면 끝날 때까지, 실패하면 여기서 직접 만듦)."""
+        fp = input_fingerprint(inp)
+        fut = self._future(inp, fp)
+        try:
+            draft = fut.result()
+        except Exception:
+            return self._make(inp)
+        with self._lock:
+            self.hits += 1
+        return dict(draft)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"items": len(self._drafts), "submitted": self.submitted, "hits": self.hits}
+
+
+@st.cache_resource(show_spinner=False)
+def draft_precomputer() -> DraftPrecomputer:
+    return DraftPrecomputer(DRAFT_CACHE_ITEMS, DRAFT_WORKERS)
+
+
+# -----------------------------
+# 5-2) 생성 작업 실행기(LLM 대기는 백그라운드 스레드에서, 화면은 주기적으로 확인)
+# -----------------------------
+JOB_WORKERS = int(os.getenv("SOAP_JOB_WORKERS", "4"))  # 동시에 LLM을 기다리는 작업 수
+JOB_MAX_QUEUED = int(os.getenv("SOAP_JOB_MAX_QUEUED", "8"))  # 실행 중 외에 줄 설 수 있는 작업 수(넘으면 거절)
+JOB_TIMEOUT_SEC = float(os.getenv("SOAP_JOB_TIMEOUT_SEC", "45"))  # 접수부터 이 시간이 지나면 초안으로 대체
+JOB_POLL_SEC = float(os.getenv("SOAP_JOB_POLL_SEC", "0.5"))  # 화면이 작업 상태를 확인하는 간격
+JOB_KEEP_FINISHED = 200  # 세션이 가져가기 전까지 보관하는 끝난 작업 수
+
+JOB_ACTIVE = ("queued", "running", "finishing")
+
+
+@dataclass
+class GenerationJob:
+    """생성 작업 1건. state: queued → running → finishing → done | cancelled | timeout."""
+
+    id: str
+    key: str  # generation_key(입력 + 출력 형식)
+    inp: SoapInput
+    prompt: str
+    json_mode: bool
+    stream: bool
+    use_cache: bool
+    call: LLMCall
+    draft: Dict[str, str]
+    session: Optional[TokenBucket] = None
+    notices: List[str] = field(default_factory=list)
+    state: str = "queued"
+    created: float = field(default_factory=time.monotonic)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    partial: str = ""  # 스트리밍 중 지금까지 받은 텍스트
+    ttfc: Optional[float] = None
+    soap: Optional[Dict[str, str]] = None
+    outcome: str = ""
+    cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    future: Optional["Future[None]"] = field(default=None, repr=False)
+
+    def elapsed(self) -> float:
+        return (self.finished if self.finished is not None else time.monotonic()) - self.created
+
+
+class GenerationJobs:
+    """LLM 생성 작업용 고정 크기 스레드 풀(프로세스 공유).
+
+    - 스크립트 스레드는 작업을 넣고 id만 세션에 보관 → 느린 응답이 rerun을 붙잡지 않음
+    - 작업 중인 스레드 + 대기 작업이 workers + max_queued를 넘으면 바로 거절(호출 측은 초안 사용).
+      취소/시간 초과된 작업도 LLM 응답을 기다리는 동안은 스레드를 차지하므로 스레드 기준으로 셈
+    - 취소: 대기 중이면 풀에서 빼고, 실행 중이면 스트림을 끊거나 결과를 버림
+    - 시간 초과: 확인(poll) 시점에 접수부터 timeout이 지났으면 미리 만든 초안으로 마무리
+    """
+
+    def __init__(self, workers: int, max_queued: int, timeout: float, keep_finished: int) -> None:
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.keep_finished = keep_finished
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="soap-job")
+        self._jobs: "OrderedDict[str, GenerationJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._durations: "deque[float]" = deque(maxlen=500)
+        self._busy = 0  # _run 안에 있는 스레드 수(결과를 버릴 작업 포함)
+        self.counts = {"submitted": 0, "rejected": 0, "done": 0, "cancelled": 0, "timeout": 0}
+
+    def _occupied(self) -> int:
+        """잠금 안에서 호출: 작업 중인 스레드 + 아직 시작 안 한 작업."""
+        return self._busy + sum(1 for j in self._jobs.values() if j.state == "queued")
+
+    def submit(self, job: GenerationJob) -> bool:
+        """작업 접수. 풀이 꽉 찼으면 False(접수 안 됨)."""
+        with self._lock:
+            if self._occupied() >= self.workers + self.max_queued:
+                self.counts["rejected"] += 1
+                return False
+            self._jobs[job.id] = job
+            self.counts["submitted"] += 1
+            job.future = self._pool.submit(self._run, job)
+            return True
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job: GenerationJob) -> int:
+        """대기 순번(1부터). 대기 중이 아니면 0."""
+        with self._lock:
+            if job.state != "queued":
+                return 0
+            return 1 + sum(1 for j in self._jobs.values() if j.state == "queued" and j.created < job.created)
+
+    def _end(self, job: GenerationJob, state: str) -> None:
+        """잠금 안에서 호출: 끝난 상태로 바꾸고 집계/정리."""
+        job.state = state
+        job.finished = time.monotonic()
+        self.counts[state] += 1
+        if state == "done":
+            self._durations.append(job.finished - job.created)
+        finished = [k for k, j in self._jobs.items() if j.state not in JOB_ACTIVE]
+        for k in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[k]
+
+    def _run(self, job: GenerationJob) -> None:
+        with self._lock:
+            if job.state != "queued":  # 대기 중에 취소/시간 초과
+                return
+            job.state = "running"
+            job.started = time.monotonic()
+            self._busy += 1
+        try:
+            self._run_started(job)
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def _run_started(self, job: GenerationJob) -> None:
+        txt: Optional[str] = None
+        try:
+            txt = self._generate(job)
+        except Exception as e:
+            job.call.error = job.call.error or classify_llm_error(e)
+        with self._lock:
+            if job.state != "running":  # 이미 취소/시간 초과 → 결과는 버림(응답 캐시에는 남음)
+                return
+            job.state = "finishing"
+        # txt가 None이면 폴백(미리 만든 초안 사용)
+        job.soap, job.outcome = finish_generation(job.inp, txt, json_mode=job.json_mode, call=job.call, draft=job.draft)
+        if job.call.path == "throttled":
+            job.notices.append("요청이 많아 이번에는 규칙 기반 초안으로 작성했어요. 잠시 후 다시 시도해 주세요.")
+        with self._lock:
+            self._end(job, "done")
+
+    @staticmethod
+    def _generate(job: GenerationJob) -> Optional[str]:
+        call = job.call
+        stream = (
+            call_openai_stream(job.prompt, use_cache=job.use_cache, call=call, session=job.session)
+            if job.stream else None
+        )
+        if stream is not None:
+            parser = SoapStreamParser()
+            try:
+                for piece in stream:
+                    if job.cancel.is_set():
+                        return None
+                    parser.feed(piece)
+                    if job.ttfc is None and parser.text.strip():
+                        job.ttfc = time.monotonic() - job.created
+                    job.partial = parser.text
+            except Exception:
+                return None
+            finally:
+                close = getattr(stream, "close", None)  # 중간에 끝내도 기다리는 요청이 풀리도록
+                if close is not None:
+                    close()
+            return parser.text or None
+        if call.path == "no_key":
+            return None
+        return call_openai(job.prompt, use_cache=job.use_cache, json_mode=job.json_mode, call=call, session=job.session)
+
+    def cancel(self, job_id: str) -> Optional[GenerationJob]:
+        """취소(이미 끝났으면 그대로). 결과는 쓰지 않으므로 호출 기록도 남기지 않음."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state not in ("queued", "running"):
+                return job
+            job.cancel.set()
+            if job.future is not None:
+                job.future.cancel()
+            self._end(job, "cancelled")
+            return job
+
+    def poll(self, job_id: str) -> Optional[GenerationJob]:
+        """작업 상태 확인. 시간이 지났으면 초안으로 마무리(state="timeout", outcome="fallback")."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state not in ("queued", "running") or time.monotonic() - job.created < self.timeout:
+                return job
+            job.cancel.set()
+            if job.future is not None:
+                job.future.cancel()
+            job.state = "finishing"
+        job.call.error = job.call.error or "timeout"
+        job.soap, job.outcome = finish_generation(job.inp, None, json_mode=job.json_mode, call=job.call, draft=job.draft)
+        job.notices.append(f"AI 응답이 {self.timeout:.0f}초 안에 오지 않아 규칙 기반 초안으로 작성했어요.")
+        with self._lock:
+            self._end(job, "timeout")
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            states = [j.state for j in self._jobs.values()]
+            durs = sorted(self._durations)
+            return {
+                "workers": self.workers,
+                "capacity": self.workers + self.max_queued,
+                "running": self._busy,
+                "queued": states.count("queued"),
+                **self.counts,
+                "p50": _percentile(durs, 0.5) if durs else 0.0,
+                "p95": _percentile(durs, 0.95) if durs else 0.0,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def generation_jobs() -> GenerationJobs:
+    return GenerationJobs(JOB_WORKERS, JOB_MAX_QUEUED, JOB_TIMEOUT_SEC, JOB_KEEP_FINISHED)
+
+
 # -----------------------------
 # 6) "프로젝트/문구 스캔" (사이드바 버튼)
 # -----------------------------
@@ -536,47 +3438,135 @@ SCAN_HINT = (
 )
 
 
-def scan_project_texts(root_dir: str) -> List[Tuple[str, int, str]]:
-    """root_dir 아래 .py/.json/.txt에서 BANNED/REPLACE 키워드 탐지."""
-    hits: List[Tuple[str, int, str]] = []
-    target_ext = (".py", ".json", ".txt", ".md")
-    max_file_size = 2_000_000  # 2MB
+SCAN_TARGET_EXT = (".py", ".json", ".txt", ".md")
+SCAN_MAX_FILE_SIZE = 50_000_000  # 50MB(한 줄씩 읽으므로 큰 노트 JSON도 메모리 부담 없음)
+# 또한, 잘못된 라벨(입주자/생활환경)도 탐지
+SCAN_BAD_LABELS = ["입주자/생활환경", "거주민/생활생활", "초밥/선택", "스위치동범위"]
+SCAN_WORKERS = min(8, (os.cpu_count() or 1) * 2)
 
-    for dirpath, _, filenames in os.walk(root_dir):
-        for fn in filenames:
-            if not fn.lower().endswith(target_ext):
-                continue
-            path = os.path.join(dirpath, fn)
-            try:
-                if os.path.getsize(path) > max_file_size:
-                    continue
-                with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                    lines = f.readlines()
-            except Exception:
-                continue
+ScanHit = Tuple[str, int, str]
+
+# 모든 탐지어를 한 패턴으로(해당 줄에 아무것도 없으면 한 번의 검색으로 건너뜀)
+_SCAN_RE = re.compile(
+    "|".join(re.escape(t) for t in sorted(set(BANNED_TOKENS) | set(SCAN_BAD_LABELS), key=len, reverse=True) if t)
+)
+# 탐지어 목록이 바뀌면 캐시 무효화
+_SCAN_RULESET_HASH = hashlib.sha1(
+    json.dumps([BANNED_TOKENS, SCAN_BAD_LABELS], ensure_ascii=False).encode("utf-8")
+).hexdigest()[:12]
 
-            for i, line in enumerate(lines, start=1):
-                line_n = line.strip()
-                for tok in BANNED_TOKENS:
-                    if tok and tok in line_n:
-                        hits.append((path, i, f"term= {tok} | {line_n[:120]}"))
-                        break
-                # 또한, 잘못된 라벨(입주자/생활환경)도 탐지
-                for bad in ["입주자/생활환경", "거주민/생활생활", "초밥/선택", "스위치동범위"]:
-                    if bad in line_n:
-                        hits.append((path, i, f"term= {bad} | {line_n[:120]}"))
-                        break
 
+@st.cache_resource(show_spinner=False)
+def _scan_cache() -> Tuple[Dict[str, Tuple[int, int, str, List[ScanHit]]], threading.Lock]:
+    return {}, threading.Lock()
+
+
+# path -> (mtime_ns, size, ruleset_hash, hits), rerun 사이에도 유지
+_SCAN_CACHE, _SCAN_CACHE_LOCK = _scan_cache()
+
+
+@dataclass
+class ScanStats:
+    files: int = 0
+    cached: int = 0
+    hits: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached / self.files if self.files else 0.0
+
+
+def _scan_file(path: str) -> List[ScanHit]:
+    """파일을 한 줄씩 읽으며 탐지(파일 전체를 메모리에 올리지 않음)."""
+    hits: List[ScanHit] = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for i, line in enumerate(f, start=1):
+            if _SCAN_RE.search(line) is None:
+                continue
+            line_n = line.strip()
+            for tok in BANNED_TOKENS:
+                if tok and tok in line_n:
+                    hits.append((path, i, f"term= {tok} | {line_n[:120]}"))
+                    break
+            for bad in SCAN_BAD_LABELS:
+                if bad in line_n:
+                    hits.append((path, i, f"term= {bad} | {line_n[:120]}"))
+                    break
     return hits
 
 
+def _scan_file_cached(path: str) -> Tuple[Optional[List[ScanHit]], bool]:
+    """(탐지 결과, 캐시 적중 여부). 크기 초과/읽기 실패는 (None, False)."""
+    try:
+        stt = os.stat(path)
+        if stt.st_size > SCAN_MAX_FILE_SIZE:
+            return None, False
+        key = (stt.st_mtime_ns, stt.st_size, _SCAN_RULESET_HASH)
+        with _SCAN_CACHE_LOCK:
+            cached = _SCAN_CACHE.get(path)
+        if cached is not None and cached[:3] == key:
+            return cached[3], True
+        hits = _scan_file(path)
+    except Exception:
+        return None, False
+    with _SCAN_CACHE_LOCK:
+        _SCAN_CACHE[path] = (key[0], key[1], key[2], hits)
+    return hits, False
+
+
+@profiled("scan")
+def scan_project_texts_with_stats(root_dir: str, workers: int = SCAN_WORKERS) -> Tuple[List[ScanHit], ScanStats]:
+    """root_dir 아래 .py/.json/.txt/.md를 스레드 풀로 병렬 스캔(변경 없는 파일은 캐시 사용)."""
+    t0 = time.perf_counter()
+    paths = [
+        os.path.join(dirpath, fn)
+        for dirpath, _, filenames in os.walk(root_dir)
+        for fn in filenames
+        if fn.lower().endswith(SCAN_TARGET_EXT)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        results = list(ex.map(_scan_file_cached, paths))
+
+    # 결과는 os.walk 순서 그대로(직렬 스캔과 동일한 출력)
+    hits: List[ScanHit] = []
+    stats = ScanStats()
+    for file_hits, was_cached in results:
+        if file_hits is None:
+            continue
+        stats.files += 1
+        stats.cached += int(was_cached)
+        hits.extend(file_hits)
+    stats.hits = len(hits)
+    stats.elapsed = time.perf_counter() - t0
+
+    # 사라진 파일은 캐시에서 제거
+    seen = set(paths)
+    prefix = os.path.join(os.path.abspath(root_dir), "")
+    with _SCAN_CACHE_LOCK:
+        for p in [p for p in _SCAN_CACHE if p.startswith(prefix) and p not in seen]:
+            del _SCAN_CACHE[p]
+
+    return hits, stats
+
+
+def scan_project_texts(root_dir: str) -> List[ScanHit]:
+    """root_dir 아래 .py/.json/.txt에서 BANNED/REPLACE 키워드 탐지."""
+    return scan_project_texts_with_stats(root_dir)[0]
+
+
 # -----------------------------
 # 7) Streamlit UI
 # -----------------------------
 def init_state() -> None:
     defaults = {
-        "db_path": DEFAULT_DB_PATH,
-        "db": load_db(DEFAULT_DB_PATH),
+        # 노트 자체는 프로세스 공유(shared_notes), 세션에는 마지막으로 본 버전만
+        "db_version": 0,
         "keyword": "",
         "filter_body": "",
         "selected_note_id": "",
@@ -594,7 +3584,15 @@ def init_state() -> None:
 
         "soap_out": {"S": "", "O": "", "A": "", "P": ""},
         "scan_hits": [],
+        "scan_stats": None,
         "last_generate_at": 0.0,
+        "last_generate_key": "",  # 마지막 생성의 generation_key(입력이 같으면 재생성 생략)
+        "last_outcome": "",
+        "llm_bucket": session_bucket(),  # 이 세션의 LLM 호출 속도 제한
+        "stream_mode": True,
+        "json_mode": False,
+        "gen_timing": None,
+        "gen_job_id": "",  # 진행 중인 생성 작업(GenerationJobs) id
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -602,19 +3600,69 @@ def init_state() -> None:
 
 
 def sidebar_notes() -> None:
+    lap = laps("sidebar")
     st.sidebar.markdown("## 🗂️ 노트 기록")
     st.sidebar.caption("로컬 실행: 저장 유지 / Streamlit Cloud: (JSON)로 백업 권장")
 
     # 실행 확인(버전/해시)
-    st.sidebar.success(f"실행 확인: {APP_VERSION} | {os.path.basename(_THIS_FILE)} 해시: {APP_HASH}")
+    st.sidebar.success(f"실행 확인: {APP_VERSION} | {os.path.basename(_THIS_FILE)} 해시: {app_hash()}")
+    # 실행 상태(시작 시간/캐시/연결/대기열/작업/생성 결과)는 접어 둔 진단 칸에
+    with st.sidebar.expander("📊 진단(실행 상태)", expanded=False):
+        first = STARTUP.first_total_sec
+        if first is not None:
+            st.caption(
+                f"시작 시간: 첫 화면 {first * 1000:,.0f}ms(모듈 {STARTUP.first_module_sec * 1000:,.0f}ms) | "
+                f"최근 실행 {(STARTUP.last_module_sec + STARTUP.last_render_sec) * 1000:,.0f}ms | 실행 {STARTUP.runs}회"
+            )
+            if first > STARTUP_BUDGET_SEC:
+                st.warning(f"첫 화면이 목표({STARTUP_BUDGET_SEC:.1f}초)보다 느렸어요: {first:.2f}초")
+
+        cs = RESPONSE_CACHE.stats()
+        st.caption(
+            f"AI 응답 캐시: 적중 {cs['hits_mem'] + cs['hits_disk']}건(메모리 {cs['hits_mem']} / 디스크 {cs['hits_disk']}) | "
+            f"미적중 {cs['misses']}건"
+        )
+        ls = LLM_CLIENTS.stats()
+        st.caption(
+            f"LLM 연결: SDK {ls['sdk']} | 요청 {ls['requests']}건 | 클라이언트 생성 {ls['clients_created']} / "
+            f"재사용 {ls['client_reuses']}"
+        )
+        qs, fs = LLM_LIMITER.stats(), SINGLE_FLIGHT.stats()
+        st.caption(
+            f"LLM 대기열: 지금 {qs['queued']}건(최대 {qs['max_queued']}) | 대기 p50 {qs['wait_p50']:.2f}초 / "
+            f"p95 {qs['wait_p95']:.2f}초 | 허용 {qs['admitted']} / 폴백 {qs['rejected']} | 합친 요청 {fs['shared']}"
+        )
+        js = generation_jobs().stats()
+        st.caption(
+            f"생성 작업: 실행 {js['running']}/{js['workers']} | 대기 {js['queued']}(최대 {js['capacity'] - js['workers']}) | "
+            f"완료 {js['done']} / 시간 초과 {js['timeout']} / 취소 {js['cancelled']} / 거절 {js['rejected']} | "
+            f"소요 p50 {js['p50']:.1f}초 / p95 {js['p95']:.1f}초"
+        )
+        ds = draft_precomputer().stats()
+        st.caption(f"미리 만든 초안: {ds['items']}개 보관 | 생성 {ds['submitted']} / 사용 {ds['hits']}")
+        for fmt, g in GENERATION_STATS.summary().items():
+            st.caption(
+                f"생성 결과({'JSON' if fmt == 'json' else '텍스트'}): {g['total']}건 | "
+                f"전체 폴백 {g['fallback_rate']:.0%} | 부분 보완 {g['repair_rate']:.0%}"
+            )
+
+    render_llm_telemetry_panel()
+    render_profile_panel()
+    lap("status")
 
     # 스캔 UI
     with st.sidebar.expander("🧪 진단(문구/단어 오염 탐지)", expanded=True):
         st.write(SCAN_HINT)
         if st.button("프로젝트 전체 스캔 실행(권장)", use_container_width=True):
             root = os.path.dirname(_THIS_FILE)
-            st.session_state["scan_hits"] = scan_project_texts(root)
+            st.session_state["scan_hits"], st.session_state["scan_stats"] = scan_project_texts_with_stats(root)
         hits = st.session_state.get("scan_hits", [])
+        stats = st.session_state.get("scan_stats")
+        if stats is not None:
+            st.caption(
+                f"파일 {stats.files}개 | {stats.elapsed:.2f}초 ({stats.files_per_sec:,.0f} files/s) | "
+                f"캐시 적중 {stats.cache_hit_rate:.0%}"
+            )
         if hits:
             st.error(f"금칙어/오염 발견: {len(hits)}건")
             # 최대 30건까지만 표시
@@ -625,45 +3673,53 @@ def sidebar_notes() -> None:
         else:
             st.info("탐지 결과 없음(또는 아직 스캔 미실행).")
 
+    lap("scan")
+
     # 검색/필터
     st.sidebar.markdown("---")
     st.session_state["keyword"] = st.sidebar.text_input("키워드 검색(분야/내용)", value=st.session_state["keyword"])
     st.session_state["filter_body"] = st.sidebar.text_input("특정 부위 찾기(선택)", value=st.session_state["filter_body"])
 
-    db = st.session_state["db"]
-    notes = db.get("notes", [])
+    snap = shared_notes().snapshot()
+    st.session_state["db_version"] = snap.version
+    st.sidebar.caption(f"저장된 노트 {len(snap):,}건 | 버전 {snap.version}")
     keyword = normalize_text(st.session_state["keyword"]).lower()
     fbody = normalize_text(st.session_state["filter_body"]).lower()
 
-    def note_match(note: Dict[str, Any]) -> bool:
-        hay = " ".join([
-            str(note.get("body_part", "")),
-            str(note.get("body_part_free", "")),
-            str(note.get("S", "")),
-            str(note.get("O", "")),
-            str(note.get("A", "")),
-            str(note.get("P", "")),
-        ]).lower()
-        if keyword and keyword not in hay:
-            return False
-        if fbody:
-            bp = (str(note.get("body_part", "")) + " " + str(note.get("body_part_free", ""))).lower()
-            if fbody not in bp:
-                return False
-        return True
-
-    filtered = [n for n in notes if note_match(n)]
-    filtered = sorted(filtered, key=lambda x: x.get("created_at", ""), reverse=True)
-
-    # 최근 50개
-    filtered = filtered[:50]
-
-    options = ["(선택안함)"] + [f"{n.get('created_at','')} | {n.get('title','(무제)')}" for n in filtered]
-    choice = st.sidebar.selectbox("기록을 기록 선택(최근 50개)", options, index=0)
+    # 조건이 바뀌면 첫 페이지로
+    if st.session_state.get("note_query") != (keyword, fbody):
+        st.session_state["note_query"] = (keyword, fbody)
+        st.session_state["note_page"] = 0
+    jump = st.sidebar.text_input("날짜로 이동(YYYY-MM-DD)", value="", key="note_jump").strip()
+    if jump and jump != st.session_state.get("note_jump_done") and re.fullmatch(r"\d{4}-\d{2}-\d{2}", jump):
+        st.session_state["note_jump_done"] = jump
+        st.session_state["note_page"] = snap.page_of_date(jump, keyword, fbody)
+
+    page = st.session_state.get("note_page", 0)
+    filtered, total = snap.page(keyword, fbody, page)
+    pages = max(1, -(-total // NOTE_PAGE_SIZE))
+    if page > pages - 1:
+        page = st.session_state["note_page"] = pages - 1
+        filtered, total = snap.page(keyword, fbody, page)
+    c1, c2, c3 = st.sidebar.columns([1, 2, 1])
+    go_prev = c1.button("◀", disabled=page <= 0, use_container_width=True)
+    go_next = c3.button("▶", disabled=page >= pages - 1, use_container_width=True)
+    if go_prev or go_next:
+        page = min(max(0, page + (1 if go_next else -1)), pages - 1)
+        st.session_state["note_page"] = page
+        filtered, total = snap.page(keyword, fbody, page)
+    c2.caption(f"{page + 1}/{pages} 페이지 · {total:,}건")
+
+    labels = {_note_id(n): f"{n.get('created_at','')} | {n.get('title','(무제)')}" for n in filtered}
+    choice = st.sidebar.selectbox(
+        f"기록 선택({page + 1}/{pages} 페이지)",
+        [""] + list(labels),
+        index=0,
+        format_func=lambda nid: labels.get(nid, "(선택안함)"),
+    )
 
-    if choice != "(선택안함)":
-        idx = options.index(choice) - 1
-        picked = filtered[idx]
+    picked = snap.get(choice) if choice else None
+    if picked is not None:
         st.session_state["selected_note_id"] = picked.get("id", "")
 
         if st.sidebar.button("불러오기", use_container_width=True):
@@ -684,29 +3740,201 @@ def sidebar_notes() -> None:
                 "A": picked.get("A", ""),
                 "P": picked.get("P", ""),
             }
+            # 결과칸이 마지막 생성 결과와 달라졌으므로 "같은 입력 → 생략" 판정을 끊음
+            st.session_state["last_generate_key"] = ""
+            st.session_state["last_outcome"] = ""
+
+    lap("notes")
 
     st.sidebar.markdown("---")
-    # JSON 내보내기/가져오기
-    st.sidebar.download_button(
-        "전체 내용에 대해(JSON)",
-        data=json.dumps(st.session_state["db"], ensure_ascii=False, indent=2),
-        file_name="soap_notes_backup.json",
-        mime="application/json",
-        use_container_width=True,
-    )
+    # 내보내기: 버튼을 누를 때만 만들고, 같은 버전/형식/조건이면 만들어 둔 것을 그대로 씀
+    with st.sidebar.expander("내보내기", expanded=False):
+        fmt = st.selectbox("형식", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0])
+        flt = ExportFilter()
+        if st.checkbox("조건으로 골라 내보내기(날짜/부위)"):
+            c1, c2 = st.columns(2)
+            since = c1.date_input("시작일", value=None)
+            until = c2.date_input("종료일", value=None)
+            part = st.selectbox("부위", [""] + BODY_PARTS, format_func=lambda p: p or "(전체)")
+            flt = ExportFilter(
+                since.strftime("%Y-%m-%d") if since else "",
+                until.strftime("%Y-%m-%d") if until else "",
+                part,
+            )
+        cache = export_cache()
+        key = (snap.version, fmt, flt)
+        data = cache.get(key)
+        if data is None and st.button("내보내기 파일 만들기", use_container_width=True):
+            with st.spinner("내보내기 파일을 만드는 중..."):
+                data = cache.build(key, lambda: build_export(export_notes(snap, get_store(), flt), fmt))
+        if data is not None:
+            label, file_name, mime = EXPORT_FORMATS[fmt]
+            st.download_button(
+                f"내려받기({label}, {flt.label()})",
+                data=data,
+                file_name=file_name,
+                mime=mime,
+                use_container_width=True,
+            )
+            es = cache.stats()
+            st.caption(f"{len(data) / 1024:,.0f}KB | 만들기 {es['builds']}회(최근 {es['last_build_sec']:.2f}초) / 재사용 {es['hits']}회")
+
+    lap("export")
 
-    up = st.sidebar.file_uploader("가져오기(JSON)", type=["json"])
+    up = st.sidebar.file_uploader("가져오기(JSON / NDJSON / gzip)", type=["json", "ndjson", "gz"])
     if up is not None:
-        try:
-            new_db = json.loads(up.getvalue().decode("utf-8"))
-            if isinstance(new_db, dict) and isinstance(new_db.get("notes", []), list):
-                st.session_state["db"] = new_db
-                save_db(st.session_state["db_path"], st.session_state["db"])
-                st.sidebar.success("가져오기 완료!")
-            else:
-                st.sidebar.error("JSON 형식이 올바르지 않아요.")
-        except Exception as e:
-            st.sidebar.error(f"가져오기 실패: {e}")
+        policy = st.sidebar.radio(
+            "같은 id의 노트가 이미 있으면", list(IMPORT_POLICIES), format_func=IMPORT_POLICIES.get, horizontal=True
+        )
+        if st.sidebar.button("가져오기(병합) 실행", use_container_width=True):
+            bar = st.sidebar.progress(0.0, text="가져오는 중...")
+
+            def on_progress(frac: float, r: ImportResult) -> None:
+                bar.progress(min(1.0, frac), text=f"가져오는 중... 추가 {r.added:,} / 갱신 {r.updated:,} / 건너뜀 {r.skipped:,}")
+
+            try:
+                up.seek(0)
+                ndjson = up.name.lower().removesuffix(".gz").endswith(".ndjson")
+                res = import_backup(
+                    up, shared_notes(), policy=policy, total_bytes=up.size, on_progress=on_progress, ndjson=ndjson
+                )
+                st.session_state["db_version"] = shared_notes().snapshot().version
+                st.sidebar.success(
+                    f"가져오기 완료! 추가 {res.added:,} / 갱신 {res.updated:,} / 건너뜀 {res.skipped:,} / 오류 {res.invalid:,}"
+                    + (f" / 파일 안 중복 {res.duplicates:,}" if res.duplicates else "")
+                )
+                if res.errors:
+                    st.sidebar.caption("검증 오류(일부): " + " · ".join(res.errors[:5]))
+            except Exception as e:
+                st.sidebar.error(f"가져오기 실패: {e}")
+    lap("import")
+
+
+def render_llm_telemetry_panel() -> None:
+    """모드/형식별 LLM 지연·토큰·폴백·오류 집계 + 호출 기록 내려받기."""
+    rows = LLM_TELEMETRY.summary()
+    if not rows:
+        return
+    with st.sidebar.expander("📈 LLM 호출 기록(모드별)", expanded=False):
+        st.dataframe(
+            [
+                {
+                    "모드": r["mode"], "형식": r["fmt"], "생성": r["generations"], "LLM 호출": r["llm_calls"],
+                    "캐시": r["cache_hits"], "합침": r["shared"], "제한": r["throttled"],
+                    "p50(초)": None if r["p50_sec"] is None else round(r["p50_sec"], 2),
+                    "p95(초)": None if r["p95_sec"] is None else round(r["p95_sec"], 2),
+                    "입력 토큰(평균)": None if r["avg_prompt_tokens"] is None else round(r["avg_prompt_tokens"]),
+                    "출력 토큰(평균)": None if r["avg_completion_tokens"] is None else round(r["avg_completion_tokens"]),
+                    "추정/실제": None if r["est_ratio"] is None else round(r["est_ratio"], 2),
+                    "입력 잘림": r["truncated"],
+                    "폴백": f"{r['fallback_rate']:.0%}", "P 보완": f"{r['p_patch_rate']:.0%}",
+                }
+                for r in rows
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        errors: Dict[str, int] = {}
+        for r in rows:
+            for k, n in r["errors"].items():
+                errors[k] = errors.get(k, 0) + n
+        if errors:
+            st.caption("오류: " + " · ".join(f"{k} {errors[k]}" for k in LLM_ERROR_KINDS if k in errors))
+        st.download_button(
+            "호출 기록(JSONL)", data=LLM_TELEMETRY.to_jsonl(), file_name="llm_calls.jsonl",
+            mime="application/x-ndjson", use_container_width=True,
+        )
+
+
+def render_profile_panel() -> None:
+    """SOAP_PROFILE=1일 때만: 최근 rerun들의 단계별 p50/p95(ms) + 기록 내려받기."""
+    if not PROFILE_ENABLED:
+        return
+    with st.sidebar.expander(f"⏱️ 실행 시간 분석(최근 {PROFILER.keep}회)", expanded=False):
+        rows = PROFILER.summary()
+        if not rows:
+            st.caption("아직 끝난 실행이 없어요(이번 실행은 끝난 뒤 반영).")
+            return
+        st.dataframe(
+            [
+                {"단계": r["phase"], "횟수": r["runs"], "p50(ms)": round(r["p50"] * 1000, 1),
+                 "p95(ms)": round(r["p95"] * 1000, 1), "최근(ms)": round(r["last"] * 1000, 1)}
+                for r in rows
+            ],
+            hide_index=True,
+            use_container_width=True,
+        )
+        if PROFILER.log in ("jsonl", "prom"):
+            st.caption(f"기록 파일: {os.path.relpath(PROFILER.log_path(), os.path.dirname(_THIS_FILE))}")
+        c1, c2 = st.columns(2)
+        c1.download_button(
+            "JSONL", data=PROFILER.to_jsonl(), file_name="profile.jsonl", mime="application/x-ndjson",
+            use_container_width=True,
+        )
+        c2.download_button(
+            "Prometheus", data=PROFILER.to_prometheus(), file_name="profile.prom", mime="text/plain",
+            use_container_width=True,
+        )
+
+
+def apply_job_result(job: GenerationJob) -> None:
+    """끝난 생성 작업의 결과를 이 세션 상태로 옮김(취소면 이전 결과 유지)."""
+    ss = st.session_state
+    ss["gen_job_id"] = ""
+    notices = [("info", msg) for msg in job.notices]
+    if job.soap is None:
+        notices.append(("info", "생성을 취소했어요(이전 결과는 그대로 둡니다)."))
+    else:
+        ss["soap_out"] = job.soap
+        ss["last_generate_at"] = time.time()
+        ss["last_generate_key"] = job.key
+        ss["last_outcome"] = job.outcome
+        total = job.elapsed()
+        ss["gen_timing"] = {
+            "ttfc": total if job.ttfc is None else job.ttfc,
+            "total": total,
+            "est_tokens": job.call.est_prompt_tokens,
+            "prompt_tokens": job.call.prompt_tokens,
+        }
+        notices.append(("success", "생성 완료! (반드시 지도자/면허자의 최종 검토를 거치세요.)"))
+    ss["gen_notices"] = notices
+
+
+@st.fragment(run_every=JOB_POLL_SEC)
+def render_job_status() -> None:
+    """진행 중인 생성 작업: 이 부분만 주기적으로 다시 그리며 확인. 끝나면 결과를 옮기고 전체 rerun.
+    기다리는 동안 스트리밍 중인 내용(없으면 규칙 기반 초안)을 보여줌."""
+    jobs = generation_jobs()
+    job_id = st.session_state["gen_job_id"]
+    job = jobs.poll(job_id)
+    if job is None:  # 서버 재시작 등으로 작업이 사라짐
+        st.session_state["gen_job_id"] = ""
+        st.rerun()
+    if job.state not in JOB_ACTIVE:
+        apply_job_result(job)
+        st.rerun()
+
+    pos = jobs.position(job)
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        st.caption(
+            f"생성 대기 중({pos}번째)..." if pos else f"AI가 SOAP을 생성 중... ({job.elapsed():.0f}초)"
+        )
+    with c2:
+        if st.button("생성 취소", key="gen_cancel", use_container_width=True):
+            apply_job_result(jobs.cancel(job_id) or job)
+            st.rerun()
+
+    if job.partial:
+        parser = SoapStreamParser()
+        parser.feed(job.partial)
+        # 완성본과 같은 정리(normalize_text)를 거쳐 보여 줌 → 오염 문구가 스트리밍 중에도 보이지 않음
+        for k, v in parser.sections().items():
+            if v:
+                st.markdown(f"**{k}:**\n\n{normalize_text(v)}")
+    elif _has_openai_key():
+        st.caption("규칙 기반 초안(AI 결과가 오면 바뀝니다)")
+        st.text("\n\n".join(f"{k}:\n{job.draft[k]}" for k in ("S", "O", "A", "P")))
 
 
 def main_ui() -> None:
@@ -773,6 +4001,25 @@ def main_ui() -> None:
         gen = st.button("S/O 재작성 + A/P 생성", use_container_width=True)
     with colB:
         reset = st.button("초기화(캐시/선택 초기화)", use_container_width=True)
+    force_regen = st.checkbox("같은 입력이어도 새로 생성(AI 응답 캐시 무시)", value=False)
+    st.session_state["stream_mode"] = st.checkbox(
+        "생성되는 대로 바로 표시(스트리밍)", value=st.session_state["stream_mode"]
+    )
+    st.session_state["json_mode"] = st.checkbox(
+        "구조화(JSON) 출력 모드(실패한 항목만 보완)", value=st.session_state["json_mode"]
+    )
+
+    # 입력 정리 + 지문: S/O가 채워지면 규칙 기반 초안을 백그라운드에서 미리 만들어 둠
+    inp = soap_input_from_dict({k: st.session_state[k] for k in SOAP_INPUT_DEFAULTS})
+    drafts = draft_precomputer()
+    drafts.prefetch(inp)
+    json_mode = st.session_state["json_mode"]
+    gen_key = generation_key(inp, json_mode)
+    # 폴백 결과는 다시 시도할 가치가 있으므로(키 설정/일시 오류 해소) 같은 입력이어도 생략하지 않음
+    unchanged = gen_key == st.session_state["last_generate_key"] and st.session_state["last_outcome"] != "fallback"
+    jobs = generation_jobs()
+    active = jobs.get(st.session_state["gen_job_id"]) if st.session_state["gen_job_id"] else None
+    active_key = active.key if active is not None and active.state in JOB_ACTIVE else ""
 
     if reset:
         st.session_state["body_part"] = "기타(직접입력)"
@@ -785,44 +4032,57 @@ def main_ui() -> None:
         st.session_state["follow_up"] = "2주"
         st.session_state["barriers"] = []
         st.session_state["soap_out"] = {"S": "", "O": "", "A": "", "P": ""}
+        st.session_state["last_generate_key"] = ""
+        st.session_state["last_outcome"] = ""
         st.success("초기화 완료")
 
     if gen:
-        # 입력 정리
-        inp = SoapInput(
-            mode=st.session_state["mode"],
-            body_part=normalize_text(st.session_state["body_part"]),
-            body_part_free=normalize_text(st.session_state["body_part_free"]),
-            s_text=normalize_text(st.session_state["s_text"]),
-            o_text=normalize_text(st.session_state["o_text"]),
-            stimulus=normalize_text(st.session_state["stimulus"]),
-            treat_freq=normalize_text(st.session_state["treat_freq"]),
-            exer_freq=normalize_text(st.session_state["exer_freq"]),
-            follow_up=normalize_text(st.session_state["follow_up"]),
-            barriers=[normalize_text(x) for x in st.session_state["barriers"]],
-        )
-
         # 빈 입력 방지(최소한의 가드)
         if not inp.s_text.strip() or not inp.o_text.strip():
             st.warning("S(주관)와 O(객관)는 최소 1줄 이상 입력해 주세요.")
+        elif unchanged and not force_regen:
+            ago = time.time() - st.session_state["last_generate_at"]
+            st.info(
+                f"입력이 {ago:,.0f}초 전 생성 때와 같아 이전 결과를 그대로 보여줘요. "
+                "새로 만들려면 '같은 입력이어도 새로 생성'을 체크하세요."
+            )
+        elif active_key == gen_key:
+            st.info("같은 입력으로 이미 생성 중이에요.")
         else:
-            prompt = build_prompt(inp)
-
-            with st.spinner("AI가 SOAP을 생성 중..."):
-                txt = call_openai(prompt)
-                if txt is None:
-                    # 폴백
-                    txt = fallback_generate(inp)
-
-                soap = parse_soap(txt)
-                soap = ensure_p_not_empty(inp, soap)
-
-                # 금칙어 최종 방지(출력 전 마지막 정리)
-                soap = {k: normalize_text(v) for k, v in soap.items()}
-                st.session_state["soap_out"] = soap
-                st.session_state["last_generate_at"] = time.time()
+            built = build_prompt_info(inp, json_output=json_mode)
+            if st.session_state["gen_job_id"]:  # 입력을 바꿔 다시 누르면 이전 작업은 취소
+                jobs.cancel(st.session_state["gen_job_id"])
+            job = GenerationJob(
+                id=hashlib.sha1(f"{time.time()}-{gen_key}".encode("utf-8")).hexdigest()[:12],
+                key=gen_key,
+                inp=inp,
+                prompt=built.text,
+                json_mode=json_mode,
+                # JSON 모드는 부분 JSON을 보여줄 수 없어 스트리밍하지 않음
+                stream=st.session_state["stream_mode"] and not json_mode,
+                use_cache=not force_regen,
+                call=LLMCall(mode=inp.mode, est_prompt_tokens=built.est_tokens, truncated="".join(built.truncated)),
+                draft=drafts.get(inp),
+                session=st.session_state["llm_bucket"],
+            )
+            if built.truncated:
+                job.notices.append(
+                    f"입력이 길어 {'/'.join(built.truncated)} 원문 뒷부분을 줄여서 보냈어요"
+                    f"(입력 예산 약 {PROMPT_INPUT_TOKEN_BUDGET:,}토큰)."
+                )
+            if jobs.submit(job):
+                st.session_state["gen_job_id"] = job.id
+            else:
+                # 작업 풀이 꽉 참 → 기다리지 않고 미리 만든 초안으로
+                job.call.path = "throttled"
+                job.soap, job.outcome = finish_generation(inp, None, json_mode=json_mode, call=job.call, draft=job.draft)
+                job.notices.append("지금 생성 요청이 많아 규칙 기반 초안으로 작성했어요. 잠시 후 다시 시도해 주세요.")
+                apply_job_result(job)
 
-            st.success("생성 완료! (반드시 지도자/면허자의 최종 검토를 거치세요.)")
+    if st.session_state["gen_job_id"]:
+        render_job_status()
+    for level, msg in st.session_state.pop("gen_notices", []):
+        (st.success if level == "success" else st.info)(msg)
 
     # 결과 표시
     st.markdown("---")
@@ -830,6 +4090,14 @@ def main_ui() -> None:
 
     out = st.session_state["soap_out"]
     if any((out.get("S", ""), out.get("O", ""), out.get("A", ""), out.get("P", ""))):
+        timing = st.session_state.get("gen_timing")
+        if timing:
+            actual = timing.get("prompt_tokens")
+            st.caption(
+                f"첫 내용 표시 {timing['ttfc']:.2f}초 | 전체 생성 {timing['total']:.2f}초 | "
+                f"입력 토큰 추정 {timing.get('est_tokens', 0):,} / 실제 {'-' if actual is None else f'{actual:,}'}"
+            )
+
         st.markdown("**S:**")
         st.write(out.get("S", "").strip() or "—")
 
@@ -855,9 +4123,8 @@ def main_ui() -> None:
         st.info("아직 생성된 결과가 없습니다.")
 
 
+@profiled("save_current_note")
 def save_current_note() -> None:
-    db = st.session_state["db"]
-    notes = db.get("notes", [])
     soap = st.session_state["soap_out"]
 
     body = st.session_state["body_part_free"].strip() if st.session_state["body_part"] == "기타(직접입력)" else st.session_state["body_part"]
@@ -887,10 +4154,7 @@ def save_current_note() -> None:
         "P": normalize_text(soap.get("P", "")),
     }
 
-    notes.append(note)
-    db["notes"] = notes
-    st.session_state["db"] = db
-    save_db(st.session_state["db_path"], db)
+    st.session_state["db_version"] = shared_notes().upsert(note).version
     st.success("저장 완료!")
 
 
@@ -917,14 +4181,30 @@ def harden_ui_strings() -> None:
         st.session_state[k] = normalize_text(st.session_state.get(k, ""))
 
 
-def run() -> None:
-    st.set_page_config(page_title="PT SOAP 도우미", page_icon="📝", layout="wide")
+# 이번 실행에서 모듈 본문(상수/클래스/함수 정의, 전역 객체 준비)에 걸린 시간
+MODULE_LOAD_SEC = time.perf_counter() - _MODULE_T0
 
-    init_state()
-    harden_ui_strings()
 
-    sidebar_notes()
-    main_ui()
+def run() -> None:
+    t0 = time.perf_counter()
+    if PROFILE_ENABLED:
+        PROFILER.begin()
+        PROFILER.add("module_load", MODULE_LOAD_SEC)
+    st.set_page_config(page_title="PT SOAP 도우미", page_icon="📝", layout="wide")
+    warm_openai_sdk()
+
+    with phase("init_state"):
+        init_state()
+    with phase("harden_ui_strings"):
+        harden_ui_strings()
+
+    with phase("sidebar_notes"):
+        sidebar_notes()
+    with phase("main_ui"):
+        main_ui()
+    STARTUP.record(MODULE_LOAD_SEC, time.perf_counter() - t0)
+    if PROFILE_ENABLED:
+        PROFILER.end()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+# batch.py
+# SOAP 일괄 생성(헤드리스) — SoapInput JSONL 입력 → 결과 JSONL 출력(완료 순서대로)
+#
+# 실행: python batch.py cases.jsonl -o drafts.jsonl --concurrency 8 --rps 5
+# 입력 한 줄 예: {"id": "c1", "mode": "상세", "body_part": "어깨", "s_text": "...", "o_text": "...", "barriers": []}
+#   (빠진 항목은 화면 기본값 사용, SoapInput 필드명 그대로)
+# 로컬 스텁 서버로 확인: python stub_llm_server.py --port 8001 --delay 0.3 &
+#   OPENAI_API_KEY=sk-local-stub-key python batch.py cases.jsonl --base-url http://127.0.0.1:8001/v1
+# --rps는 이 실행만의 한도. 프로세스 전체 한도(SOAP_LLM_RPS, 화면/API와 공유)도 함께 적용됨
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import app
+
+
+class RateLimiter:
+    """app.TokenBucket(초당 rate개, 최대 burst개)를 asyncio에서 쓰는 래퍼: 기다리는 동안 이벤트 루프를 막지 않음."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.bucket = app.TokenBucket(rate, burst)
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.bucket.rate <= 0:
+            return
+        async with self._lock:
+            # TokenBucket처럼 먼저 가져가고(빚) 그만큼 기다림 → 다음 요청은 그 뒤로 줄 섬
+            wait = self.bucket.wait_time(time.monotonic())
+            self.bucket.take()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def llm_with_retry(
+    prompt: str,
+    limiter: RateLimiter,
+    retries: int,
+    backoff: float,
+    timeout: float,
+    json_mode: bool = False,
+    call: Optional[app.LLMCall] = None,
+) -> Tuple[Optional[str], int, Optional[str]]:
+    """(응답, 시도 횟수, 마지막 오류). 지수 백오프 + 지터로 재시도. call에 호출 기록을 채움."""
+    err: Optional[str] = None
+    attempt = 0
+    for attempt in range(1, retries + 2):
+        await limiter.acquire()
+        # 같은 프로세스의 화면/API와 함께 쓰는 전체 속도 제한(app.LLM_LIMITER). 넘치면 이번 시도는 실패로 보고 재시도
+        if not await asyncio.to_thread(app._admit, call if call is not None else app.LLMCall(), None):
+            err = "throttled"
+        else:
+            try:
+                # 제한 시간은 HTTP 요청에 직접 걸어야 스레드가 남지 않음(wait_for는 기다림만 끊고 요청은 계속됨)
+                txt = await asyncio.to_thread(app.chat_completion, prompt, None, json_mode, call, timeout)
+                if txt:
+                    return txt, attempt, None
+                err = "empty response"
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+                if call is not None:
+                    call.error = app.classify_llm_error(e)
+        if attempt <= retries:
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+    return None, attempt, err
+
+
+async def generate_one(
+    index: int,
+    rec: Dict[str, Any],
+    sem: asyncio.Semaphore,
+    limiter: RateLimiter,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    async with sem:
+        t0 = time.perf_counter()
+        out: Dict[str, Any] = {"index": index, "id": rec.get("id")}
+
+        inp = app.soap_input_from_dict(rec)
+        if not inp.s_text.strip() or not inp.o_text.strip():
+            out.update(source="skipped", error="S(주관)와 O(객관)는 최소 1줄 이상 필요", soap=None)
+            out["latency_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            return out
+
+        built = app.build_prompt_info(inp, json_output=args.json_output)
+        prompt = built.text
+        txt: Optional[str] = None
+        attempts = 0
+        err: Optional[str] = None
+        cache_key = app.response_cache_key(prompt, app.OPENAI_MODEL, app.OPENAI_TEMPERATURE, app.openai_base_url())
+        call = app.LLMCall(
+            mode=inp.mode,
+            path="offline" if args.offline else "no_key",
+            est_prompt_tokens=built.est_tokens,
+            truncated="".join(built.truncated),
+        )
+
+        if not args.offline and app._has_openai_key():
+            if not args.no_cache:
+                txt = app.RESPONSE_CACHE.get(cache_key)
+                if txt is not None:
+                    call.path = "cache"
+            if txt is None:
+                # 같은 프롬프트가 이미 진행 중이면(같은 파일 안 중복, 화면/API의 같은 요청) 그 결과를 함께 받음
+                flight, leader = app.SINGLE_FLIGHT.join(cache_key)
+                if not leader:
+                    call.path = "shared"
+                    txt = await asyncio.to_thread(app.SINGLE_FLIGHT.wait, flight)
+                else:
+                    try:
+                        txt, attempts, err = await llm_with_retry(
+                            prompt, limiter, args.retries, args.backoff, args.timeout,
+                            json_mode=args.json_output, call=call,
+                        )
+                        if txt:
+                            app.RESPONSE_CACHE.put(cache_key, txt)
+                    finally:
+                        app.SINGLE_FLIGHT.finish(cache_key, flight, txt)
+
+        # txt가 None이면 폴백, JSON 모드면 검증 실패 필드만 보완
+        soap, outcome = app.finish_generation(inp, txt or None, json_mode=args.json_output, call=call)
+        out.update(
+            # JSON 모드에서 모든 필드가 검증에 실패하면 응답이 있어도 전체 폴백
+            source="fallback" if outcome == "fallback" else "llm",
+            outcome=outcome,
+            attempts=attempts,
+            error=err,
+            soap=soap,
+            latency_ms=round((time.perf_counter() - t0) * 1000, 2),
+        )
+        return out
+
+
+def read_records(fp: TextIO) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """빈 줄은 건너뛰고, JSON이 아니면 {"_error": ...} 레코드로 전달."""
+    for i, line in enumerate(fp):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+            if not isinstance(rec, dict):
+                rec = {"_error": "JSON 객체가 아님"}
+        except json.JSONDecodeError as e:
+            rec = {"_error": f"JSON 파싱 실패: {e}"}
+        yield i, rec
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[max(0, math.ceil(q * len(s)) - 1)]
+
+
+async def run_batch(args: argparse.Namespace, src: TextIO, dst: TextIO) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max(1, args.concurrency)))
+
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+    limiter = RateLimiter(args.rps, args.burst)
+    tasks = []
+    bad: List[Dict[str, Any]] = []
+    for i, rec in read_records(src):
+        if "_error" in rec:
+            bad.append({"index": i, "id": None, "source": "invalid", "error": rec["_error"], "soap": None})
+            continue
+        tasks.append(asyncio.ensure_future(generate_one(i, rec, sem, limiter, args)))
+
+    t0 = time.perf_counter()
+    latencies: List[float] = []
+    counts: Dict[str, int] = {}
+    for rec in bad:
+        dst.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        counts["invalid"] = counts.get("invalid", 0) + 1
+    for fut in asyncio.as_completed(tasks):
+        res = await fut
+        dst.write(json.dumps(res, ensure_ascii=False) + "\n")
+        dst.flush()
+        counts[res["source"]] = counts.get(res["source"], 0) + 1
+        if res["source"] in ("llm", "fallback"):
+            latencies.append(res["latency_ms"])
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "notes": len(latencies),
+        "elapsed_sec": round(elapsed, 3),
+        "notes_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "by_source": counts,
+        "outcomes": app.GENERATION_STATS.summary(),
+        "llm": app.LLM_TELEMETRY.summary(),
+    }
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="SOAP 일괄 생성(JSONL → JSONL)")
+    ap.add_argument("input", help="SoapInput JSONL 파일('-'면 표준입력)")
+    ap.add_argument("-o", "--output", default="-", help="결과 JSONL 파일('-'면 표준출력)")
+    ap.add_argument("--concurrency", type=int, default=8, help="동시 LLM 요청 수")
+    ap.add_argument("--rps", type=float, default=5.0, help="초당 요청 한도(0이면 제한 없음)")
+    ap.add_argument("--burst", type=int, default=5, help="순간 허용 요청 수")
+    ap.add_argument("--retries", type=int, default=3, help="실패 시 재시도 횟수")
+    ap.add_argument("--backoff", type=float, default=0.5, help="재시도 기본 대기(초, 지수 증가)")
+    ap.add_argument("--timeout", type=float, default=60.0, help="요청 1건 제한 시간(초)")
+    ap.add_argument("--base-url", default="", help="OpenAI 호환 엔드포인트(로컬 스텁 서버 등)")
+    ap.add_argument("--no-cache", action="store_true", help="AI 응답 캐시 사용 안 함")
+    ap.add_argument("--offline", action="store_true", help="LLM 없이 폴백 생성기만 사용")
+    ap.add_argument("--json-output", action="store_true", help="구조화(JSON) 출력 모드(실패한 필드만 보완)")
+    return ap
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_arg_parser().parse_args(argv)
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        summary = asyncio.run(run_batch(args, src, dst))
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+    print(
+        f"완료: {summary['notes']}건 | {summary['elapsed_sec']}초 | {summary['notes_per_sec']}건/초 | "
+        f"p50 {summary['p50_ms']}ms | p95 {summary['p95_ms']}ms | {summary['by_source']} | {summary['outcomes']}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# bench.py
+# app.py 핫 함수 마이크로 벤치마크(개발용, 배포에는 불필요)
+# - streamlit/openai 없이 실행(가짜 모듈로 대체, LLM 호출 없음)
+# - 합성 노트 DB(1k/10k/100k)와 합성 소스 트리로 측정
+# - 콜드 스타트: 새 프로세스에서 import app / 첫 DB 로드 / 캐시된 DB 로드
+# - 결과 JSON을 기준(baseline)과 비교해 느려진 항목이 있으면 종료 코드 1
+#
+# 실행: python bench.py                                  # 전체(1k/10k/100k)
+#       python bench.py --sizes 1000 --out now.json       # 빠르게
+#       python bench.py --save-baseline bench_baseline.json
+#       python bench.py --baseline bench_baseline.json --threshold 0.2
+
+from __future__ import annotations
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from typing import Any, Callable, Dict, List, Optional
+
+
+# -----------------------------
+# 0) streamlit/openai 대체(헤드리스)
+# -----------------------------
+def _install_stubs() -> None:
+    st = types.ModuleType("streamlit")
+    st.session_state = {}  # type: ignore[attr-defined]
+    st.secrets = {}  # type: ignore[attr-defined]
+
+    def _noop(*args: Any, **kwargs: Any) -> None:
+        return None
+
+    def _memoize(func: Optional[Callable] = None, **kwargs: Any) -> Any:
+        # st.cache_resource/cache_data 대체: 인자별 1회 계산(프로세스 전역)
+        if func is None:
+            return lambda f: functools.lru_cache(maxsize=None)(f)
+        return functools.lru_cache(maxsize=None)(func)
+
+    st.cache_resource = _memoize  # type: ignore[attr-defined]
+    st.cache_data = _memoize  # type: ignore[attr-defined]
+    st.fragment = lambda func=None, **kwargs: func if func is not None else (lambda f: f)  # type: ignore[attr-defined]
+    st.__getattr__ = lambda name: _noop  # type: ignore[attr-defined]
+    sys.modules["streamlit"] = st
+    os.environ.pop("OPENAI_API_KEY", None)
+
+
+_install_stubs()
+_T_IMPORT0 = time.perf_counter()
+import app  # noqa: E402
+
+IMPORT_APP_SEC = time.perf_counter() - _T_IMPORT0
+
+app.LLM_CLIENTS.sdk = "none"
+
+
+# -----------------------------
+# 1) 기준(이전) 구현 — 결과 동일성/속도 비교용
+# -----------------------------
+def legacy_normalize_text(s: str) -> str:
+    if not isinstance(s, str):
+        return s
+    out = s
+    for k, v in app.REPLACE_MAP.items():
+        out = out.replace(k, v)
+    for tok in app.BANNED_TOKENS:
+        out = re.sub(rf"(^|[\s,/\|·\-]+){re.escape(tok)}([\s,/\|·\-]+|$)", r"\1", out)
+    out = re.sub(r"[ \t]+", " ", out).strip()
+    return out
+
+
+def legacy_note_filter(notes: List[Dict[str, Any]], keyword: str, fbody: str) -> List[Dict[str, Any]]:
+    """사이드바 note_match(색인 도입 전) 그대로."""
+    def note_match(note: Dict[str, Any]) -> bool:
+        hay = " ".join([
+            str(note.get("body_part", "")),
+            str(note.get("body_part_free", "")),
+            str(note.get("S", "")),
+            str(note.get("O", "")),
+            str(note.get("A", "")),
+            str(note.get("P", "")),
+        ]).lower()
+        if keyword and keyword not in hay:
+            return False
+        if fbody:
+            bp = (str(note.get("body_part", "")) + " " + str(note.get("body_part_free", ""))).lower()
+            if fbody not in bp:
+                return False
+        return True
+
+    return [n for n in notes if note_match(n)]
+
+
+# -----------------------------
+# 2) 합성 데이터
+# -----------------------------
+BODIES = ["어깨", "목", "허리(요추)", "무릎", "발목", "고관절", "기타(직접입력)"]
+S_SAMPLES = [
+    "2주 전부터 팔을 위로 들면 아프고, 밤에 통증이 심해져요.",
+    "앉았다 일어날 때 허리가 뻐근하고 오래 서 있으면 다리가 저려요.",
+    "계단 내려갈 때 무릎 앞쪽이 시큰거려요. 와, 거주민 생활환경 변화 후 악화.",
+    "컴퓨터 작업 후 목과 어깨가 뻣뻣하고 두통이 있어요.",
+]
+O_SAMPLES = [
+    "외전 90° 부근 통증 증가, 스위치동범위 제한, 낮 자극감도, 쥐어짜기/근육질 소견.",
+    "요추 굴곡 시 통증 재현, SLR 60°에서 당김, 코어 지구력 저하.",
+    "스쿼트 60° 이상에서 슬개골 주변 통증, 대퇴사두 근력 4/5.",
+    "경추 회전 좌측 제한, 상부승모 압통, 전방머리자세.",
+]
+
+
+def synth_input(i: int, rng: random.Random) -> app.SoapInput:
+    return app.SoapInput(
+        mode="상세" if i % 2 else "제출용",
+        body_part=BODIES[i % len(BODIES)],
+        body_part_free=rng.choice(["", "견관절", "슬관절"]),
+        s_text=rng.choice(S_SAMPLES),
+        o_text=rng.choice(O_SAMPLES),
+        stimulus=["낮음", "중간", "높음", "불명"][i % 4],
+        treat_freq=rng.choice(app.TREAT_FREQ),
+        exer_freq=rng.choice(app.EXER_FREQ),
+        follow_up=rng.choice(app.FOLLOW_UP),
+        barriers=rng.sample(app.BARRIERS_BASE, rng.randint(0, 3)),
+    )
+
+
+def sample_soap_output(target_len: int = 10_000) -> str:
+    """폴백 생성기 출력을 이어 붙여 target_len 글자 내외의 SOAP 텍스트를 만든다."""
+    rng = random.Random(1)
+    chunks: List[str] = []
+    total = 0
+    i = 0
+    while total < target_len:
+        txt = app.fallback_generate(synth_input(i, rng))
+        chunks.append(txt)
+        total += len(txt) + 2
+        i += 1
+    return "\n\n".join(chunks)[:target_len]
+
+
+def synth_notes(n: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """save_current_note와 같은 모양의 노트 n개(폴백 생성 결과 + 고유 단어)."""
+    rng = random.Random(seed)
+    pool = [app.fallback_sections(synth_input(i, rng)) for i in range(64)]
+    notes = []
+    for i in range(n):
+        inp = synth_input(i, rng)
+        sec = pool[i % len(pool)]
+        tag = f"케이스{i:06d}"
+        notes.append({
+            "id": f"{i:010x}",
+            "title": f"{inp.body_part} | {inp.mode}",
+            "created_at": f"2026-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i * 7) % 60:02d}",
+            "mode": inp.mode,
+            "body_part": inp.body_part,
+            "body_part_free": inp.body_part_free,
+            "stimulus": inp.stimulus,
+            "treat_freq": inp.treat_freq,
+            "exer_freq": inp.exer_freq,
+            "follow_up": inp.follow_up,
+            "barriers": inp.barriers,
+            "S_in": inp.s_text,
+            "O_in": inp.o_text,
+            "S": f"{sec['S']} {tag}",
+            "O": sec["O"],
+            "A": sec["A"],
+            "P": sec["P"],
+        })
+    return notes
+
+
+def synth_source_tree(root: str, files: int = 200, lines: int = 400) -> None:
+    rng = random.Random(3)
+    clean = ["def f(x):", "    return x + 1", "# 일반 주석입니다", "환자 호소/상황(주관적 정보)", "{\"k\": \"v\"}"]
+    dirty = ["입주자/생활환경", "스위치동범위 제한", "초밥/선택", "와 킄"]
+    exts = [".py", ".md", ".json", ".txt", ".bin"]
+    for i in range(files):
+        sub = os.path.join(root, f"pkg{i % 10}")
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, f"f{i}{exts[i % len(exts)]}"), "w", encoding="utf-8") as f:
+            for _ in range(lines):
+                f.write((rng.choice(dirty) if rng.random() < 0.02 else rng.choice(clean)) + "\n")
+
+
+# -----------------------------
+# 3) 측정
+# -----------------------------
+def measure(fn: Callable[[], Any], min_time: float = 0.2, min_runs: int = 3, max_runs: int = 10_000) -> Dict[str, float]:
+    """min_time초 이상(최소 min_runs회) 반복 실행한 ms 통계."""
+    times: List[float] = []
+    start = time.perf_counter()
+    while len(times) < max_runs:
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        if len(times) >= min_runs and time.perf_counter() - start >= min_time:
+            break
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "min_ms": round(min(times), 4),
+        "runs": len(times),
+    }
+
+
+class Suite:
+    def __init__(self, min_time: float) -> None:
+        self.min_time = min_time
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def run(self, name: str, fn: Callable[[], Any], **kwargs: Any) -> None:
+        kwargs.setdefault("min_time", self.min_time)
+        r = measure(fn, **kwargs)
+        self.results[name] = r
+        print(f"{name:<48} {r['median_ms']:>12.4f} ms  (min {r['min_ms']:.4f}, {r['runs']}회)", flush=True)
+
+
+def bench_text(suite: Suite) -> None:
+    big = sample_soap_output(10_000)
+    assert app._normalize_uncached(big) == legacy_normalize_text(big), "normalize_text 결과 불일치"
+    shorts = list(app.BODY_PARTS_BASE) + list(app.BARRIERS_BASE) + list(app.STIMULUS_LEVELS_BASE) + list(app.REPLACE_MAP)
+    for x in shorts:
+        assert app.normalize_text(x) == legacy_normalize_text(x), f"normalize_text 결과 불일치: {x!r}"
+
+    suite.run("normalize_text/10k_soap", lambda: app._normalize_uncached(big))
+    suite.run("normalize_text/10k_soap_legacy", lambda: legacy_normalize_text(big))
+    suite.run("normalize_text/short_cached_x35", lambda: [app.normalize_text(x) for x in shorts])
+    suite.run("clean_options/all_option_lists", lambda: (
+        app.clean_options(app.BODY_PARTS_BASE, allow_other_label="기타(직접입력)"),
+        app.clean_options(app.STIMULUS_LEVELS_BASE),
+        app.clean_options(app.BARRIERS_BASE),
+    ))
+
+    rng = random.Random(5)
+    inputs = [synth_input(i, rng) for i in range(256)]
+    it = iter(range(1 << 62))
+    suite.run("build_prompt", lambda: app.build_prompt(inputs[next(it) % 256]))
+    suite.run("build_prompt/json", lambda: app.build_prompt(inputs[next(it) % 256], json_output=True))
+    long_inp = app.soap_input_from_dict({**vars(inputs[0]), "s_text": big, "o_text": big[: len(big) // 2]})
+    assert app.build_prompt_info(long_inp).truncated, "긴 입력이 예산 안으로 줄지 않음"
+    suite.run("build_prompt/long_input_budget", lambda: app.build_prompt(long_inp))
+
+    def plan_cold() -> None:
+        app._build_plan_cached.cache_clear()
+        app.build_specific_plan(inputs[0], "어깨")
+
+    suite.run("build_specific_plan/cold", plan_cold)
+    suite.run("build_specific_plan/warm", lambda: app.build_specific_plan(inputs[next(it) % 256], "무릎"))
+    suite.run("fallback_generate", lambda: app.fallback_generate(inputs[next(it) % 256]))
+    suite.run("parse_soap/10k_soap", lambda: app.parse_soap(big))
+
+
+def bench_scan(suite: Suite, tmp: str) -> None:
+    root = os.path.join(tmp, "tree")
+    synth_source_tree(root)
+
+    def cold() -> None:
+        app._SCAN_CACHE.clear()
+        app.scan_project_texts(root)
+
+    suite.run("scan_project_texts/200files_cold", cold)
+    app.scan_project_texts(root)
+    suite.run("scan_project_texts/200files_warm", lambda: app.scan_project_texts(root))
+
+
+def bench_db(suite: Suite, tmp: str, sizes: List[int]) -> None:
+    for n in sizes:
+        notes = synth_notes(n)
+        db = {"notes": notes}
+        tag = f"{n // 1000}k"
+        big = n >= 100_000
+        slow_kw = {"min_time": 0.0, "min_runs": 1} if big else {}
+
+        jpath = os.path.join(tmp, f"notes_{tag}.json")
+        suite.run(f"save_db/{tag}", lambda: app.save_db(jpath, db), **slow_kw)
+        suite.run(f"load_db/{tag}", lambda: app.load_db(jpath), **slow_kw)
+
+        spath = os.path.join(tmp, f"notes_{tag}.sqlite3")
+        store = app.SqliteNoteStore(spath)
+        store.replace_all(db)
+        extra = dict(notes[-1], id="bench-upsert")
+        suite.run(f"sqlite.upsert_note/{tag}", lambda: store.upsert_note(extra))
+        suite.run(f"sqlite.iter_notes_first50/{tag}", lambda: list(itertools.islice(store.iter_notes(), 50)))
+
+        suite.run(f"export.legacy_dumps/{tag}", lambda: json.dumps(db, ensure_ascii=False, indent=2), **slow_kw)
+        suite.run(f"export.json/{tag}", lambda: app.build_export(iter(notes), "json"), **slow_kw)
+        suite.run(f"export.json_gz/{tag}", lambda: app.build_export(iter(notes), "json.gz"), **slow_kw)
+        since = notes[len(notes) // 2].get("created_at", "")[:10]
+        suite.run(
+            f"export.sqlite_filtered/{tag}",
+            lambda: app.build_export(store.iter_notes(since=since), "ndjson"),
+            **slow_kw,
+        )
+
+        keyword = "케이스000123"
+        fbody = "견관"
+        idx_holder: Dict[str, Any] = {}
+
+        def build_index() -> None:
+            idx_holder["idx"] = app.NoteSearchIndex.build(notes, 0)
+
+        suite.run(f"note_search.build/{tag}", build_index, min_time=0.0, min_runs=1)
+        idx = idx_holder["idx"]
+        expect = legacy_note_filter(notes, keyword, fbody)
+        assert [notes[i] for i in idx.search(keyword, fbody)] == expect, "검색 결과 불일치"
+        suite.run(f"note_match.legacy/{tag}", lambda: legacy_note_filter(notes, keyword, fbody), **slow_kw)
+        suite.run(f"note_match.index/{tag}", lambda: idx.search(keyword, fbody))
+        suite.run(f"note_match.index_common_term/{tag}", lambda: idx.search("통증", ""))
+
+
+def startup_probe(notes: int) -> Dict[str, float]:
+    """새 프로세스에서 실행: import app + 첫/두 번째 DB 로드(초). --startup-probe 전용."""
+    tmp = tempfile.mkdtemp(prefix="soap-startup-")
+    try:
+        spath = os.path.join(tmp, "notes.sqlite3")
+        app.SqliteNoteStore(spath).replace_all({"notes": synth_notes(notes)})
+        app.DATA_DIR = tmp
+        app.STORAGE_BACKEND = "sqlite"
+        app.DEFAULT_SQLITE_PATH = spath
+        app.DEFAULT_DB_PATH = os.path.join(tmp, "missing.json")
+        out = {"import_app": IMPORT_APP_SEC}
+        t0 = time.perf_counter()
+        app.shared_notes().snapshot()
+        out["first_db_load"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        app.shared_notes().snapshot()
+        out["cached_db_load"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        app.app_hash()
+        out["app_hash"] = time.perf_counter() - t0
+        if app.OPENAI_SDK != "none":
+            t0 = time.perf_counter()
+            app._warm_openai_sdk()
+            out["openai_import"] = time.perf_counter() - t0
+        return out
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_startup(suite: Suite, notes: int = 10_000, repeats: int = 3) -> None:
+    """콜드 스타트: 매번 새 파이썬 프로세스에서 측정(중앙값)."""
+    samples: Dict[str, List[float]] = {}
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--startup-probe", str(notes)],
+            capture_output=True, text=True, check=True,
+        )
+        for k, v in json.loads(proc.stdout.strip().splitlines()[-1]).items():
+            samples.setdefault(k, []).append(v * 1000.0)
+    tag = f"{notes // 1000}k"
+    for k, vals in samples.items():
+        name = f"startup/{k}" + (f"/{tag}" if k.endswith("db_load") else "")
+        suite.results[name] = {
+            "median_ms": round(statistics.median(vals), 4),
+            "min_ms": round(min(vals), 4),
+            "runs": len(vals),
+        }
+        print(f"{name:<48} {statistics.median(vals):>12.4f} ms  (min {min(vals):.4f}, {len(vals)}회)", flush=True)
+
+
+# -----------------------------
+# 4) 기준 비교
+# -----------------------------
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """기준 대비 median이 threshold(비율) 넘게 느려진 항목."""
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b or b.get("median_ms", 0) <= 0:
+            continue
+        ratio = r["median_ms"] / b["median_ms"]
+        mark = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            mark = "  <-- 느려짐"
+        print(f"{name:<48} {b['median_ms']:>10.4f} → {r['median_ms']:>10.4f} ms  (x{ratio:.2f}){mark}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="app.py 마이크로 벤치마크")
+    ap.add_argument("--sizes", default="1000,10000,100000", help="합성 노트 DB 크기(쉼표 구분)")
+    ap.add_argument("--min-time", type=float, default=0.2, help="항목별 최소 측정 시간(초)")
+    ap.add_argument("--only", default="", help="실행할 그룹(text,scan,db,startup 중 쉼표 구분, 기본 전체)")
+    ap.add_argument("--out", default="", help="결과 JSON 저장 경로")
+    ap.add_argument("--baseline", default="", help="비교할 기준 결과 JSON")
+    ap.add_argument("--save-baseline", default="", help="이번 결과를 기준으로 저장")
+    ap.add_argument("--threshold", type=float, default=0.2, help="허용 느려짐 비율(0.2 = 20%%)")
+    ap.add_argument("--startup-probe", type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.startup_probe:
+        print(json.dumps(startup_probe(args.startup_probe)))
+        return 0
+
+    groups = set(filter(None, args.only.split(","))) or {"text", "scan", "db", "startup"}
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    suite = Suite(args.min_time)
+    tmp = tempfile.mkdtemp(prefix="soap-bench-")
+    try:
+        if "text" in groups:
+            bench_text(suite)
+        if "scan" in groups:
+            bench_scan(suite, tmp)
+        if "db" in groups:
+            bench_db(suite, tmp, sizes)
+        if "startup" in groups:
+            bench_startup(suite)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    payload = {
+        "meta": {
+            "app_version": app.APP_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": app.now_str(),
+        },
+        "results": suite.results,
+    }
+    for path in filter(None, [args.out, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+        print("\n[기준 비교]")
+        regressions = compare(suite.results, baseline, args.threshold)
+        if regressions:
+            print(f"\n느려진 항목 {len(regressions)}개(허용 {args.threshold:.0%} 초과): {', '.join(regressions)}")
+            return 1
+        print("\n느려진 항목 없음")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# stub_llm_server.py
+# 로컬 테스트/벤치마크용 가짜 LLM 서버(OpenAI chat.completions 호환 최소 구현)
+#
+# 실행: python stub_llm_server.py --port 8001 --delay 0.3 --error-rate 0.1
+# 사용: OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=sk-local-stub-key python batch.py cases.jsonl
+# "stream": true 요청에는 SSE(text/event-stream)로 줄 단위 조각을 보냄(--chunk-delay로 조각 간격)
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator
+
+STUB_SOAP = (
+    "S:\n환자는 해당 부위 통증과 동작 시 불편을 호소한다.\n\n"
+    "O:\n특정 각도에서 통증이 재현되고 가동범위가 일부 제한된다.\n\n"
+    "A:\n부하 민감성 통증과 가동범위 제한이 기능 저하에 기여하는 것으로 보인다.\n\n"
+    "P:\n"
+    "- 통증 없는 범위에서 AAROM 10회 × 2세트\n"
+    "- 밴드 저항 운동 12회 × 2~3세트\n"
+    "- 2주 후 통증/기능/ROM 재평가"
+)
+
+
+class StubConfig:
+    delay = 0.0
+    chunk_delay = 0.0
+    error_rate = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+
+def _completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = ""
+    for m in body.get("messages", []):
+        prompt += str(m.get("content", ""))
+    content = STUB_SOAP
+    return {
+        "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": max(1, len(prompt) // 2),
+            "completion_tokens": max(1, len(content) // 2),
+            "total_tokens": max(1, len(prompt) // 2) + max(1, len(content) // 2),
+        },
+    }
+
+
+def _stream_chunks(body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """_completion과 같은 내용을 chat.completion.chunk 조각으로(줄 단위). include_usage면 마지막에 사용량."""
+    full = _completion(body)
+    base = {"id": full["id"], "object": "chat.completion.chunk", "created": full["created"], "model": full["model"]}
+    content = full["choices"][0]["message"]["content"]
+    pieces = content.splitlines(keepends=True)
+    for i, piece in enumerate(pieces):
+        delta: Dict[str, Any] = {"content": piece}
+        if i == 0:
+            delta["role"] = "assistant"
+        yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield {**base, "choices": [], "usage": full["usage"]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # 헤더/본문을 따로 써서, 끄지 않으면 응답마다 ~40ms 지연
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _send(self, code: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, body: Dict[str, Any]) -> None:
+        # keep-alive를 유지하려고 chunked 전송(길이를 미리 알 수 없음)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [f"data: {json.dumps(c, ensure_ascii=False)}\n\n" for c in _stream_chunks(body)] + ["data: [DONE]\n\n"]
+        for n, event in enumerate(events):
+            if n and StubConfig.chunk_delay:
+                time.sleep(StubConfig.chunk_delay)
+            data = event.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self) -> None:  # noqa: N802
+        length = int(self.headers.get("Content-Length", "0") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        with StubConfig.lock:
+            StubConfig.requests += 1
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        if StubConfig.delay:
+            time.sleep(StubConfig.delay)
+        if StubConfig.error_rate and random.random() < StubConfig.error_rate:
+            self._send(429, {"error": {"message": "stub rate limit", "type": "rate_limit_error"}})
+            return
+        try:
+            body = json.loads(raw.decode("utf-8"))
+        except Exception:
+            self._send(400, {"error": {"message": "invalid json"}})
+            return
+        if body.get("stream"):
+            self._send_stream(body)
+        else:
+            self._send(200, _completion(body))
+
+
+def serve(host: str, port: int) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    return srv
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="로컬 스텁 LLM 서버")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--delay", type=float, default=0.0, help="응답 지연(초)")
+    ap.add_argument("--chunk-delay", type=float, default=0.0, help="스트리밍 조각 사이 지연(초)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="429 응답 비율(0~1)")
+    args = ap.parse_args()
+
+    StubConfig.delay = args.delay
+    StubConfig.chunk_delay = args.chunk_delay
+    StubConfig.error_rate = args.error_rate
+    srv = serve(args.host, args.port)
+    print(f"stub LLM: http://{args.host}:{args.port}/v1 (delay={args.delay}s, error_rate={args.error_rate})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# synth.py
+# 폴백(규칙 기반) 생성기로 연습용/회귀 테스트용 SOAP 노트를 대량 생성(네트워크 없음)
+#
+# 실행(조합 격자): python synth.py --grid grid.json -o notes.jsonl --workers 4
+# 실행(케이스 파일): python synth.py --input cases.jsonl -o notes.jsonl
+# grid.json 예: {"mode": ["제출용", "상세"], "body_part": ["어깨", "무릎"], "stimulus": ["낮음", "높음"],
+#               "s_text": ["팔을 들면 아파요"], "o_text": ["외전 90° 통증"], "barriers": [[], ["통증(부하 민감)"]]}
+#   (빠진 항목은 화면 기본값, 각 값 목록의 모든 조합을 생성)
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+import app
+
+
+def expand_grid(spec: Dict[str, List[Any]]) -> Iterator[Dict[str, Any]]:
+    """필드별 값 목록의 모든 조합을 하나씩 만들어 낸다(메모리에 한꺼번에 올리지 않음)."""
+    keys = [k for k in app.SOAP_INPUT_DEFAULTS if k in spec]
+    values = [spec[k] if isinstance(spec[k], list) else [spec[k]] for k in keys]
+    for combo in itertools.product(*values):
+        yield dict(zip(keys, combo))
+
+
+def read_jsonl(fp: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    for line in fp:
+        line = line.strip()
+        if line:
+            rec = json.loads(line)
+            if isinstance(rec, dict):
+                yield rec
+
+
+def source_records(args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    """--grid/--input 레코드를 --repeat번 하나씩. 파일은 회차마다 다시 읽음(전체를 메모리에 올리지 않음)."""
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        for _ in range(args.repeat):
+            yield from expand_grid(spec)
+    elif args.input == "-":
+        if args.repeat <= 1:
+            yield from read_jsonl(sys.stdin)
+            return
+        # 표준입력은 다시 읽을 수 없으므로 반복할 때만 보관
+        base = list(read_jsonl(sys.stdin))
+        for _ in range(args.repeat):
+            yield from base
+    else:
+        for _ in range(args.repeat):
+            with open(args.input, "r", encoding="utf-8") as f:
+                yield from read_jsonl(f)
+
+
+def generate_note(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """레코드 1건 → 화면에서 폴백으로 생성했을 때와 같은 S/O/A/P."""
+    inp = app.soap_input_from_dict(rec)
+    soap = app.soap_from_text(inp, app.fallback_generate(inp))
+    out: Dict[str, Any] = {"input": {k: getattr(inp, k) for k in app.SOAP_INPUT_DEFAULTS}}
+    if "id" in rec:
+        out["id"] = rec["id"]
+    out.update(soap)
+    return out
+
+
+def _generate_chunk(chunk: List[Dict[str, Any]]) -> List[str]:
+    # 워커 프로세스에서 JSON 직렬화까지 끝내서 돌려보냄
+    return [json.dumps(generate_note(r), ensure_ascii=False) for r in chunk]
+
+
+def _chunks(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    it = iter(records)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate_notes(
+    records: Iterable[Dict[str, Any]],
+    workers: int = 0,
+    chunk_size: int = 2000,
+) -> Iterator[str]:
+    """노트를 JSON 문자열(한 줄)로 순서대로 내보내는 스트리밍 생성기.
+    workers > 0이면 프로세스 풀 사용(동시에 처리 중인 묶음은 workers*2개로 제한)."""
+    if workers <= 0:
+        for r in records:
+            yield json.dumps(generate_note(r), ensure_ascii=False)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending: Deque[Future] = deque()
+        for chunk in _chunks(records, chunk_size):
+            pending.append(ex.submit(_generate_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="폴백 생성기로 SOAP 노트 대량 생성(JSONL)")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--grid", help="필드별 값 목록 JSON 파일(모든 조합 생성)")
+    src.add_argument("--input", help="SoapInput JSONL 파일('-'면 표준입력)")
+    ap.add_argument("-o", "--output", default="-", help="결과 JSONL 파일('-'면 표준출력)")
+    ap.add_argument("--repeat", type=int, default=1, help="입력 전체를 N번 반복(부하 측정용)")
+    ap.add_argument("--limit", type=int, default=0, help="최대 생성 수(0이면 전부)")
+    ap.add_argument("--workers", type=int, default=0, help="프로세스 수(0이면 현재 프로세스에서)")
+    ap.add_argument("--chunk-size", type=int, default=2000, help="프로세스에 넘기는 묶음 크기")
+    args = ap.parse_args(argv)
+
+    records: Iterable[Dict[str, Any]] = source_records(args)
+    if args.limit:
+        records = itertools.islice(records, args.limit)
+
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    t0 = time.perf_counter()
+    n = 0
+    try:
+        for line in generate_notes(records, workers=args.workers, chunk_size=args.chunk_size):
+            dst.write(line)
+            dst.write("\n")
+            n += 1
+    finally:
+        if dst is not sys.stdout:
+            dst.close()
+    elapsed = time.perf_counter() - t0
+    rate = n / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"완료: {n:,}건 | {elapsed:.2f}초 | 분당 {rate:,.0f}건", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# app.py는 import할 때 스트림릿 스크립트 본문까지 실행됨 → 호출 기록은 파일에 남기지 않음
+os.environ.setdefault("SOAP_LLM_LOG", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_note():
+    def make(nid: str, created_at: str = "2024-01-01 09:00:00", **fields):
+        note = {"id": nid, "title": nid, "created_at": created_at, "body_part": "어깨", "S": f"{nid} 통증", "barriers": []}
+        note.update(fields)
+        return note
+
+    return make
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import app
+
+
+def test_single_flight_shares_leader_result():
+    sf = app.SingleFlight()
+    f, leader = sf.join("k")
+    f2, follower = sf.join("k")
+    assert (leader, follower) == (True, False)
+    threading.Timer(0.05, sf.finish, ("k", f, "결과")).start()
+    assert sf.wait(f2) == "결과"
+    assert sf.stats() == {"in_flight": 0, "leaders": 1, "shared": 1}
+
+
+def test_single_flight_timeout_drops_stale_leader(monkeypatch):
+    monkeypatch.setattr(app, "SINGLE_FLIGHT_WAIT_SEC", 0.05)
+    sf = app.SingleFlight()
+    stale, _ = sf.join("k")
+    f2, _ = sf.join("k")
+    assert sf.wait(f2) is None
+    assert sf.stats()["in_flight"] == 0
+    f3, leader = sf.join("k")  # 다음 요청은 새로 호출
+    assert leader and f3 is not stale
+    sf.finish("k", stale, "늦은 결과")  # 멈췄던 leader가 늦게 끝나도 새 호출은 그대로
+    assert sf.stats()["in_flight"] == 1
+    sf.finish("k", f3, None)
+    assert sf.stats()["in_flight"] == 0
+
+
+def make_job(i):
+    inp = app.SoapInput("제출용", "어깨", "", f"통증{i}", "ROM 제한", "", "주2", "주3", "2주", [])
+    draft = {"S": "초안", "O": "초안", "A": "초안", "P": "- 초안"}
+    return app.GenerationJob(
+        id=str(i), key=str(i), inp=inp, prompt="p", json_mode=False, stream=False,
+        use_cache=False, call=app.LLMCall(), draft=draft,
+    )
+
+
+def blocking_generate(monkeypatch):
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def generate(job):
+        started.release()
+        release.wait(5)
+        return "S: s\nO: o\nA: a\nP: - p"
+
+    monkeypatch.setattr(app.GenerationJobs, "_generate", staticmethod(generate))
+    return release, started
+
+
+def wait_until(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def test_jobs_reject_when_full(monkeypatch):
+    release, started = blocking_generate(monkeypatch)
+    jobs = app.GenerationJobs(workers=1, max_queued=1, timeout=30, keep_finished=10)
+    try:
+        assert jobs.submit(make_job(0))
+        assert started.acquire(timeout=5)
+        assert jobs.submit(make_job(1))  # 대기 1칸
+        assert not jobs.submit(make_job(2))
+        assert jobs.stats()["rejected"] == 1
+        release.set()
+        wait_until(lambda: jobs.stats()["done"] == 2)
+        assert jobs.get("0").outcome == "llm"
+        assert jobs.submit(make_job(3))
+    finally:
+        release.set()
+        jobs._pool.shutdown(wait=True)
+
+
+def test_cancelled_running_job_still_occupies_thread(monkeypatch):
+    release, started = blocking_generate(monkeypatch)
+    jobs = app.GenerationJobs(workers=1, max_queued=0, timeout=30, keep_finished=10)
+    try:
+        assert jobs.submit(make_job(0))
+        assert started.acquire(timeout=5)
+        assert jobs.cancel("0").state == "cancelled"
+        assert not jobs.submit(make_job(1))  # 스레드는 아직 응답을 기다리는 중
+        release.set()
+        wait_until(lambda: jobs.stats()["running"] == 0)
+        assert jobs.get("0").state == "cancelled"  # 늦게 온 결과는 버림
+        assert jobs.submit(make_job(2))
+    finally:
+        release.set()
+        jobs._pool.shutdown(wait=True)
+
+
+def test_queued_job_cancel_frees_slot(monkeypatch):
+    release, started = blocking_generate(monkeypatch)
+    jobs = app.GenerationJobs(workers=1, max_queued=1, timeout=30, keep_finished=10)
+    try:
+        assert jobs.submit(make_job(0))
+        assert started.acquire(timeout=5)
+        assert jobs.submit(make_job(1))
+        jobs.cancel("1")
+        assert jobs.submit(make_job(2))
+    finally:
+        release.set()
+        jobs._pool.shutdown(wait=True)
+
+
+def test_poll_times_out_to_draft(monkeypatch):
+    release, started = blocking_generate(monkeypatch)
+    jobs = app.GenerationJobs(workers=1, max_queued=0, timeout=0.05, keep_finished=10)
+    try:
+        assert jobs.submit(make_job(0))
+        assert started.acquire(timeout=5)
+        time.sleep(0.1)
+        job = jobs.poll("0")
+        assert (job.state, job.outcome) == ("timeout", "fallback")
+        assert job.soap["S"] == "초안"
+        assert job.call.error == "timeout"
+    finally:
+        release.set()
+        jobs._pool.shutdown(wait=True)
@@ -0,0 +1,85 @@
+import pytest
+
+import app
+
+
+def test_parse_soap_json_valid():
+    soap, failed = app.parse_soap_json('{"S": " 통증 ", "O": "ROM", "A": "평가", "P": ["운동", "- 찜질"]}')
+    assert failed == []
+    assert soap == {"S": "통증", "O": "ROM", "A": "평가", "P": "- 운동\n- 찜질"}
+
+
+def test_parse_soap_json_fenced_and_surrounded():
+    text = '다음과 같습니다.\n```json\n{"S": "s", "O": "o", "A": "a", "P": "- 하나\\n• 둘"}\n```\n끝'
+    soap, failed = app.parse_soap_json(text)
+    assert failed == []
+    assert soap["P"] == "- 하나\n- 둘"
+
+
+def test_parse_soap_json_partial_fields():
+    soap, failed = app.parse_soap_json('{"S": "s", "O": "", "A": 3, "P": []}')
+    assert soap == {"S": "s"}
+    assert failed == ["O", "A", "P"]
+
+
+@pytest.mark.parametrize("text", ["", "그냥 글", '{"S": "s", ', "[1, 2]"])
+def test_parse_soap_json_unparseable(text):
+    assert app.parse_soap_json(text) == ({}, ["S", "O", "A", "P"])
+
+
+def inp():
+    return app.SoapInput("제출용", "어깨", "", "통증", "ROM 제한", "", "주2", "주3", "2주", [])
+
+
+def test_finish_generation_repairs_only_failed_fields():
+    call = app.LLMCall()
+    soap, outcome = app.finish_generation(inp(), '{"S": "환자 진술", "O": "관찰", "A": "평가"}', json_mode=True, call=call)
+    assert outcome == "repaired"
+    assert soap["S"] == "환자 진술"
+    assert soap["P"].strip()
+    assert call.p_patched and not call.fallback
+
+
+def test_finish_generation_unparseable_json_is_fallback():
+    call = app.LLMCall()
+    soap, outcome = app.finish_generation(inp(), "죄송합니다", json_mode=True, call=call)
+    assert outcome == "fallback"
+    assert call.fallback
+    assert all(soap[k].strip() for k in ("S", "O", "A", "P"))
+
+
+def test_finish_generation_none_uses_draft():
+    draft = {"S": "초안S", "O": "초안O", "A": "초안A", "P": "- 초안P"}
+    soap, outcome = app.finish_generation(inp(), None, draft=draft)
+    assert (soap, outcome) == (draft, "fallback")
+
+
+@pytest.mark.parametrize("text", ["", "통증", "shoulder pain", "internationalization 123 ROM!", "어깨 flexion 90°, 통증 VAS 7/10"])
+def test_estimate_tokens_matches_costs(text):
+    assert app.estimate_tokens(text) == sum(c for _, c in app._token_costs(text))
+
+
+def test_estimate_tokens_units():
+    assert app.estimate_tokens("어깨") == 2
+    assert app.estimate_tokens("abcd abcde") == 3
+    assert app.estimate_tokens("12345 !?") == 3
+
+
+def test_fit_inputs_within_budget_only_compacts():
+    s, o, cut = app.fit_inputs("  통증   심함 \n\n통증   심함\n", "ROM", 100)
+    assert (s, o, cut) == ("통증 심함", "ROM", [])
+
+
+def test_fit_inputs_truncates_cjk():
+    s, o, cut = app.fit_inputs("漢" * 20000, "o", 100)
+    assert cut == ["S"]
+    assert o == "o"
+    assert s.endswith(app.PROMPT_TRUNCATED_MARK)
+    assert app.estimate_tokens(s[: -len(app.PROMPT_TRUNCATED_MARK)]) + app.estimate_tokens(o) <= 100
+
+
+def test_fit_inputs_splits_when_both_large():
+    s, o, cut = app.fit_inputs("가" * 500, "나" * 500, 100)
+    assert cut == ["S", "O"]
+    mark = len(app.PROMPT_TRUNCATED_MARK)
+    assert app.estimate_tokens(s[:-mark]) <= 50 and app.estimate_tokens(o[:-mark]) <= 50
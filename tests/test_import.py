@@ -0,0 +1,92 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def shared(tmp_path):
+    store = app.JsonNoteStore(str(tmp_path / "notes.json"))
+    return app.SharedNotes(store, app.NoteJournal(app.journal_path_for(store.path)))
+
+
+def backup(notes, gz=False, ndjson=False):
+    if ndjson:
+        raw = "".join(json.dumps(n, ensure_ascii=False) + "\n" for n in notes).encode("utf-8")
+    else:
+        raw = json.dumps({"notes": notes}, ensure_ascii=False).encode("utf-8")
+    return io.BytesIO(gzip.compress(raw) if gz else raw)
+
+
+def seed(shared, make_note):
+    shared.upsert_many([make_note("a", "2024-01-02 00:00:00", S="기존a"), make_note("b", "2024-01-02 00:00:00", S="기존b")])
+
+
+def test_newest_policy_keeps_more_recent(shared, make_note):
+    seed(shared, make_note)
+    res = app.import_backup(backup([
+        make_note("a", "2024-01-03 00:00:00", S="새a"),
+        make_note("b", "2024-01-01 00:00:00", S="옛b"),
+        make_note("c"),
+    ]), shared, "newest")
+    assert (res.added, res.updated, res.skipped, res.duplicates, res.invalid) == (1, 1, 1, 0, 0)
+    snap = shared.snapshot()
+    assert snap.get("a")["S"] == "새a"
+    assert snap.get("b")["S"] == "기존b"
+    assert snap.get("c") is not None
+
+
+def test_existing_policy_never_overwrites(shared, make_note):
+    seed(shared, make_note)
+    res = app.import_backup(backup([make_note("a", "2024-01-03 00:00:00", S="새a"), make_note("c")]), shared, "existing")
+    assert (res.added, res.updated, res.skipped) == (1, 0, 1)
+    assert shared.snapshot().get("a")["S"] == "기존a"
+
+
+@pytest.mark.parametrize("policy, kept", [("newest", "둘째"), ("existing", "첫째")])
+def test_in_file_duplicates(shared, make_note, policy, kept):
+    res = app.import_backup(backup([
+        make_note("d", "2024-01-01 00:00:00", S="첫째"),
+        make_note("d", "2024-01-05 00:00:00", S="둘째"),
+        make_note("d", "2024-01-03 00:00:00", S="셋째"),
+    ]), shared, policy)
+    assert (res.added, res.updated, res.skipped, res.duplicates) == (1, 0, 0, 2)
+    assert shared.snapshot().get("d")["S"] == kept
+
+
+def test_duplicates_across_batches(shared, make_note, monkeypatch):
+    monkeypatch.setattr(app, "IMPORT_BATCH", 2)
+    notes = [make_note(f"n{i}") for i in range(5)] + [make_note("n0", "2024-02-01 00:00:00", S="나중")]
+    res = app.import_backup(backup(notes), shared, "newest")
+    assert (res.added, res.duplicates) == (5, 1)
+    assert shared.snapshot().get("n0")["S"] == "나중"
+
+
+def test_invalid_rows_are_counted_and_skipped(shared, make_note):
+    res = app.import_backup(backup([
+        make_note("ok"),
+        make_note("bad_date", "2024/01/01"),
+        make_note("empty", S=""),
+        make_note("bad_barriers", barriers="없음"),
+        "노트 아님",
+    ]), shared, "newest")
+    assert (res.added, res.invalid) == (1, 4)
+    assert len(res.errors) == 4
+    assert res.errors[0].startswith("2번째")
+    assert [n["id"] for n in shared.snapshot()] == ["ok"]
+
+
+@pytest.mark.parametrize("gz", [False, True])
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_formats(shared, make_note, gz, ndjson):
+    res = app.import_backup(backup([make_note("a"), make_note("b")], gz=gz, ndjson=ndjson), shared, "newest", ndjson=ndjson)
+    assert res.added == 2
+    assert len(shared.snapshot()) == 2
+
+
+def test_unknown_policy(shared):
+    with pytest.raises(ValueError):
+        app.import_backup(backup([]), shared, "merge")
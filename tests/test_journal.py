@@ -0,0 +1,90 @@
+import json
+
+import app
+
+
+def shared_at(path):
+    store = app.SqliteNoteStore(str(path))
+    return app.SharedNotes(store, app.NoteJournal(app.journal_path_for(store.path)))
+
+
+def read_journal(sh):
+    with open(sh.journal.path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_other_process_saves_are_applied_from_journal(tmp_path, make_note):
+    a, b = shared_at(tmp_path / "notes.db"), shared_at(tmp_path / "notes.db")
+    assert len(b.snapshot()) == 0
+    a.upsert(make_note("x"))
+    a.upsert_many([make_note("y"), make_note("x", S="수정")])
+    snap = b.snapshot()
+    assert len(snap) == 2
+    assert snap.get("x")["S"] == "수정"
+    assert b.stats()["loads"] == 1  # 전체 재로딩 없이 기록만 반영
+
+
+def test_compaction_keeps_recent_entries_and_base(tmp_path, make_note, monkeypatch):
+    monkeypatch.setattr(app, "JOURNAL_COMPACT_BYTES", 2000)
+    monkeypatch.setattr(app, "JOURNAL_KEEP_BYTES", 500)
+    monkeypatch.setattr(app, "JOURNAL_KEEP_ENTRIES", 2)
+    sh = shared_at(tmp_path / "notes.db")
+    for i in range(30):
+        sh.upsert(make_note(f"n{i}"))
+    assert sh.journal.compactions > 0
+    assert sh.journal.stat()[1] <= 2000
+    with sh.journal.locked():
+        sh.journal.compact()
+    entries = read_journal(sh)
+    assert entries[0]["op"] == "base"
+    assert [e["seq"] for e in entries] == [28, 29, 30]  # base(28번까지 반영) + 최근 2개
+
+
+def test_compaction_respects_byte_limit(tmp_path, make_note, monkeypatch):
+    monkeypatch.setattr(app, "JOURNAL_KEEP_BYTES", 300)
+    sh = shared_at(tmp_path / "notes.db")
+    sh.upsert_many([make_note(f"n{i}", S="가" * 100) for i in range(10)])  # 기록 1줄이 상한보다 큼
+    sh.upsert(make_note("small"))
+    with sh.journal.locked():
+        sh.journal.compact()
+    entries = read_journal(sh)
+    assert (entries[0]["op"], entries[0]["seq"]) == ("base", 1)
+    assert [e["seq"] for e in entries[1:]] == [2]
+
+
+def test_lagging_reader_reloads_after_compaction(tmp_path, make_note, monkeypatch):
+    monkeypatch.setattr(app, "JOURNAL_COMPACT_BYTES", 2000)
+    monkeypatch.setattr(app, "JOURNAL_KEEP_BYTES", 500)
+    monkeypatch.setattr(app, "JOURNAL_KEEP_ENTRIES", 2)
+    writer, reader = shared_at(tmp_path / "notes.db"), shared_at(tmp_path / "notes.db")
+    writer.upsert(make_note("first"))
+    assert len(reader.snapshot()) == 1
+    for i in range(30):
+        writer.upsert(make_note(f"n{i}"))
+    assert writer.journal.compactions > 0
+    snap = reader.snapshot()
+    assert len(snap) == 31
+    assert reader.stats()["loads"] == 2  # 못 본 기록이 압축으로 사라짐 → 저장소에서 다시 읽음
+    writer.upsert(make_note("last"))
+    assert reader.snapshot().get("last") is not None
+    assert reader.stats()["loads"] == 2
+
+
+def test_writer_seq_continues_after_other_process_compacts(tmp_path, make_note, monkeypatch):
+    monkeypatch.setattr(app, "JOURNAL_COMPACT_BYTES", 2000)
+    monkeypatch.setattr(app, "JOURNAL_KEEP_BYTES", 500)
+    a, b = shared_at(tmp_path / "notes.db"), shared_at(tmp_path / "notes.db")
+    b.upsert(make_note("b0"))
+    for i in range(30):
+        a.upsert(make_note(f"a{i}"))
+    b.upsert(make_note("b1"))  # 압축된 새 파일(같은 inode일 수 있음)에서도 seq가 이어져야 함
+    seqs = [e["seq"] for e in read_journal(b)]
+    assert seqs == list(range(seqs[0], 33))
+
+
+def test_replace_all_is_seen_by_other_process(tmp_path, make_note):
+    a, b = shared_at(tmp_path / "notes.db"), shared_at(tmp_path / "notes.db")
+    a.upsert_many([make_note("x"), make_note("y")])
+    assert len(b.snapshot()) == 2
+    a.replace_all([make_note("z")])
+    assert [n["id"] for n in b.snapshot()] == ["z"]
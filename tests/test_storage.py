@@ -0,0 +1,65 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return app.JsonNoteStore(str(tmp_path / "notes.json"))
+    return app.SqliteNoteStore(str(tmp_path / "notes.db"))
+
+
+def ids(notes):
+    return [n["id"] for n in notes]
+
+
+def test_upsert_keeps_insertion_order_and_replaces_same_id(store, make_note):
+    store.upsert_many([make_note("a"), make_note("b")])
+    store.upsert_note(make_note("a", S="수정"))
+    store.upsert_many([make_note("c")])
+    notes = store.load()["notes"]
+    assert ids(notes) == ["a", "b", "c"]
+    assert notes[0]["S"] == "수정"
+
+
+def test_iter_notes_filters(store, make_note):
+    store.upsert_many([
+        make_note("c", "2024-03-01 00:00:00"),
+        make_note("a", "2024-01-01 00:00:00"),
+        make_note("b", "2024-02-01 00:00:00", body_part="무릎"),
+        make_note("d", "2024-02-01 00:00:00"),
+    ])
+    assert ids(store.iter_notes()) == ["a", "b", "d", "c"]
+    assert ids(store.iter_notes(body_part="무릎")) == ["b"]
+    assert ids(store.iter_notes(since="2024-02-01 00:00:00")) == ["b", "d", "c"]
+    assert ids(store.iter_notes(until="2024-02-01 00:00:00")) == ["a", "b", "d"]
+    assert ids(store.iter_notes(body_part="어깨", since="2024-01-15", until="2024-02-15")) == ["d"]
+
+
+def test_replace_all(store, make_note):
+    store.upsert_many([make_note("a"), make_note("b")])
+    store.replace_all({"notes": [make_note("x")]})
+    assert ids(store.load()["notes"]) == ["x"]
+
+
+def test_note_without_id_gets_stable_id(store, make_note):
+    note = make_note("a")
+    del note["id"]
+    store.upsert_many([note])
+    store.upsert_many([dict(note)])
+    notes = list(store.iter_notes())
+    assert len(notes) == 1
+    assert notes[0]["id"] == app._note_id(note)
+
+
+def test_sqlite_paging_matches_json(tmp_path, make_note, monkeypatch):
+    monkeypatch.setattr(app, "STORE_PAGE_ROWS", 3)  # 같은 created_at이 페이지 경계에 걸치도록
+    notes = [make_note(f"n{i:02d}", f"2024-01-{1 + i // 4:02d} 00:00:00") for i in range(17)]
+    js = app.JsonNoteStore(str(tmp_path / "notes.json"))
+    sq = app.SqliteNoteStore(str(tmp_path / "notes.db"))
+    for s in (js, sq):
+        s.upsert_many(notes)
+    for kw in ({}, {"since": "2024-01-02 00:00:00"}, {"since": "2024-01-02", "until": "2024-01-04 00:00:00"}):
+        assert ids(sq.iter_notes(**kw)) == ids(js.iter_notes(**kw))
+    assert len(ids(sq.iter_notes())) == 17